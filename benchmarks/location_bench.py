@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Throughput and accuracy of gazetteer location matching, without a database.
+
+Builds a synthetic hierarchy (one country, --admin1 regions, 8 admin2 per
+region, --settlements settlements) with repeated settlement names, then
+matches --rows free-text locations the way imports write them: exact names,
+"settlement, region" pairs, alt names and typos. Reports matches per second,
+cache hit rate, match rate and accuracy.
+
+    python benchmarks/location_bench.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_environment():
+    os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, os.path.join(REPO_ROOT, "services", "beneficiaries"))
+    sys.path.insert(0, REPO_ROOT)
+
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10))).title()
+
+
+def generate_nodes(admin1: int, settlements: int, seed: int = 42):
+    rng = random.Random(seed)
+    nodes = [SimpleNamespace(id=1, name="Kenya", alt_names=[], level=0, path="1")]
+    regions, districts = [], []
+    for _ in range(admin1):
+        node = SimpleNamespace(id=len(nodes) + 1, name=word(rng), alt_names=[], level=1, path="")
+        node.path = f"1/{node.id}"
+        nodes.append(node)
+        regions.append(node)
+        for _ in range(8):
+            district = SimpleNamespace(id=len(nodes) + 1, name=word(rng), alt_names=[], level=2, path="")
+            district.path = f"{node.path}/{district.id}"
+            district.region = node
+            nodes.append(district)
+            districts.append(district)
+    # About 1 in 10 settlement names is reused in another district
+    names = [word(rng) for _ in range(int(settlements * 0.9))]
+    places = []
+    for _ in range(settlements):
+        district = rng.choice(districts)
+        node = SimpleNamespace(id=len(nodes) + 1, name=rng.choice(names), alt_names=[], level=3, path="")
+        node.path = f"{district.path}/{node.id}"
+        node.alt_names = [f"{node.name} Camp"] if rng.random() < 0.2 else []
+        node.district = district
+        nodes.append(node)
+        places.append(node)
+    return nodes, places
+
+
+def generate_values(places, rows: int, distinct: int, seed: int = 7):
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(distinct):
+        place = rng.choice(places)
+        style = rng.random()
+        if style < 0.4:
+            value = f"{place.name}, {place.district.region.name}"
+        elif style < 0.6:
+            value = f"{place.district.region.name} > {place.district.name} > {place.name}"
+        elif style < 0.7 and place.alt_names:
+            value = place.alt_names[0]
+        elif style < 0.85:
+            i = rng.randrange(1, len(place.name))
+            value = f"{place.name[:i]}{rng.choice(string.ascii_lowercase)}{place.name[i + 1:]}, {place.district.name}"
+        else:
+            value = place.name
+        pool.append((value, place.id))
+    return [rng.choice(pool) for _ in range(rows)]
+
+
+def run(args) -> dict:
+    from gazetteer import LocationMatcher
+
+    nodes, places = generate_nodes(args.admin1, args.settlements)
+    matcher = LocationMatcher()
+    start = time.perf_counter()
+    matcher.index(nodes)
+    index_s = time.perf_counter() - start
+
+    values = generate_values(places, args.rows, args.distinct)
+    start = time.perf_counter()
+    results = [matcher.match(value) for value, _ in values]
+    match_s = time.perf_counter() - start
+
+    matched = sum(1 for result in results if result)
+    correct = sum(1 for result, (_, expected) in zip(results, values) if result == expected)
+    cache = matcher.match.cache_info()
+    return {
+        "nodes": len(nodes),
+        "rows": args.rows,
+        "distinct_values": args.distinct,
+        "index_s": round(index_s, 2),
+        "match_s": round(match_s, 2),
+        "rows_per_s": int(args.rows / match_s) if match_s else None,
+        "cache_hit_rate": round(cache.hits / (cache.hits + cache.misses), 4),
+        "match_rate": round(matched / args.rows, 4),
+        "precision": round(correct / matched, 4) if matched else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--distinct", type=int, default=20000, help="distinct location strings")
+    parser.add_argument("--admin1", type=int, default=47)
+    parser.add_argument("--settlements", type=int, default=20000)
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    configure_environment()
+    report = run(args)
+    for key, value in report.items():
+        print(f"{key:>16}: {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
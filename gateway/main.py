@@ -2,8 +2,10 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import httpx
+import hashlib
 import logging
 import os
+import time
 from datetime import datetime
 
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
@@ -26,6 +28,31 @@ SERVICE_REGISTRY = {
     "ai": "http://ai-service:8013"
 }
 
+# API keys ("evk_<prefix>.<secret>") are verified by auth-service and cached here;
+# downstream services receive the resolved identity in X-Evid-* headers instead
+API_KEY_PREFIX = "evk_"
+API_KEY_CACHE_SECONDS = int(os.getenv("API_KEY_CACHE_SECONDS", 30))
+IDENTITY_HEADERS = {"x-evid-api-key-id", "x-evid-org-id", "x-evid-scopes"}
+api_key_cache = {}
+auth_client = httpx.AsyncClient(base_url=SERVICE_REGISTRY["auth"], timeout=5.0)
+
+async def resolve_api_key(api_key: str):
+    """Return the API key's claims, or None if auth-service rejects it"""
+    cache_key = hashlib.sha256(api_key.encode()).hexdigest()
+    cached = api_key_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    response = await auth_client.post("/api-keys/verify", json={"api_key": api_key})
+    if response.status_code >= 500:
+        response.raise_for_status()
+    claims = response.json() if response.status_code == 200 else None
+    
+    if len(api_key_cache) > 10000:
+        api_key_cache.clear()
+    api_key_cache[cache_key] = (time.monotonic() + API_KEY_CACHE_SECONDS, claims)
+    return claims
+
 app = FastAPI(
     title="Evid Flow API Gateway",
     description="Main API Gateway for Evid Flow Microservices",
@@ -52,13 +79,34 @@ async def gateway_middleware(request: Request, call_next):
             service_path = path.replace(f"/{service_name}", "").replace(f"/api/{service_name}", "")
             target_url = f"{service_url}{service_path or '/'}"
             
+            headers = {
+                k: v for k, v in request.headers.items()
+                if k.lower() != 'host' and k.lower() not in IDENTITY_HEADERS
+            }
+            
+            authorization = request.headers.get("authorization", "")
+            if authorization.lower().startswith("bearer ") and authorization[7:].strip().startswith(API_KEY_PREFIX):
+                try:
+                    claims = await resolve_api_key(authorization[7:].strip())
+                except httpx.HTTPError as e:
+                    logger.error(f"API key verification unavailable: {e}")
+                    return JSONResponse(status_code=503, content={"detail": "Authentication temporarily unavailable"})
+                
+                if not claims:
+                    return JSONResponse(status_code=401, content={"detail": "Invalid API key"})
+                
+                headers = {k: v for k, v in headers.items() if k.lower() != "authorization"}
+                headers["X-Evid-Api-Key-Id"] = str(claims["key_id"])
+                headers["X-Evid-Org-Id"] = str(claims["org_id"])
+                headers["X-Evid-Scopes"] = ",".join(claims["scopes"])
+            
             try:
                 async with httpx.AsyncClient(timeout=30.0) as client:
                     # Forward request
                     response = await client.request(
                         method=request.method,
                         url=target_url,
-                        headers={k: v for k, v in request.headers.items() if k.lower() != 'host'},
+                        headers=headers,
                         content=await request.body(),
                         params=dict(request.query_params)
                     )
@@ -23,6 +23,15 @@ mkdir -p nginx/ssl
 echo "🐳 Building and starting Docker containers..."
 docker-compose -f docker-compose.prod.yml down
 docker-compose -f docker-compose.prod.yml build --no-cache
+
+# Run database migrations before any service starts serving traffic
+echo "🗄️ Running database migrations..."
+docker-compose -f docker-compose.prod.yml up -d postgres
+until docker-compose -f docker-compose.prod.yml exec -T postgres pg_isready -U evid_user -d evid_flow_prod; do
+    sleep 2
+done
+docker-compose -f docker-compose.prod.yml run --rm --no-deps auth-service python -m shared.migrations
+
 docker-compose -f docker-compose.prod.yml up -d
 
 # Wait for services to be healthy
@@ -37,14 +46,6 @@ curl -f http://localhost:8000/health || {
     exit 1
 }
 
-# Run database migrations
-echo "🗄️ Running database migrations..."
-docker-compose -f docker-compose.prod.yml exec api-gateway python -c "
-import asyncio
-from app.database import create_db_and_tables
-asyncio.run(create_db_and_tables())
-"
-
 echo "✅ Evid Flow Production Deployment Completed Successfully!"
 echo "🌐 Gateway: http://localhost:8000"
 echo "📊 API Docs: http://localhost:8000/docs"
@@ -0,0 +1,181 @@
+"""Scheduled cleanup of expired auth rows.
+
+Verification codes, reset codes, refresh-token sessions, delivered outbox
+emails and dead invitations are only useful until they expire. This job marks
+overdue invitations EXPIRED and deletes history past its retention window in
+small batches (``DELETE ... WHERE id IN (SELECT id ... LIMIT n)``), pausing
+between batches so it never holds many row locks or competes with live traffic.
+It also keeps the monthly partitions of shared tables ahead of time.
+A Postgres advisory lock ensures only one replica runs it at a time.
+
+Run once by hand with ``python housekeeping.py``.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from prometheus_client import Counter
+from sqlalchemy import delete, text, update
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal, engine
+from shared.partitions import maintain_partitions
+from shared.models import (
+    EmailOutbox, EmailOutboxStatus, EmailVerification, InvitationStatus,
+    OrganizationInvitation, PasswordReset, UserSession
+)
+
+logger = logging.getLogger(__name__)
+
+HOUSEKEEPING_ROWS = Counter(
+    "auth_housekeeping_rows_total",
+    "Rows expired or purged by auth housekeeping",
+    ["table", "action"]
+)
+
+# Arbitrary application-wide key for pg_try_advisory_lock
+HOUSEKEEPING_LOCK_KEY = 7_311_001
+
+
+class Housekeeper:
+    def __init__(self):
+        self.interval_seconds = int(os.getenv("HOUSEKEEPING_INTERVAL_SECONDS", 3600))
+        self.batch_size = int(os.getenv("HOUSEKEEPING_BATCH_SIZE", 500))
+        self.pause_seconds = float(os.getenv("HOUSEKEEPING_PAUSE_SECONDS", 0.2))
+        self.retention_days = int(os.getenv("HOUSEKEEPING_RETENTION_DAYS", 7))
+        self.outbox_retention_days = int(os.getenv("HOUSEKEEPING_OUTBOX_RETENTION_DAYS", 14))
+        self.invitation_retention_days = int(os.getenv("HOUSEKEEPING_INVITATION_RETENTION_DAYS", 30))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task or self.interval_seconds <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Auth housekeeping failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self):
+        """Run every cleanup step, unless another replica is already doing so"""
+        if engine.dialect.name != "postgresql":
+            await self._run_steps()
+            return
+
+        async with engine.connect() as lock_conn:
+            locked = await lock_conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": HOUSEKEEPING_LOCK_KEY})
+            if not locked:
+                logger.info("🧹 Auth housekeeping already running elsewhere, skipping")
+                return
+            try:
+                await self._run_steps()
+            finally:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": HOUSEKEEPING_LOCK_KEY})
+                await lock_conn.commit()
+
+    async def _run_steps(self):
+        now = datetime.utcnow()
+        retention_cutoff = now - timedelta(days=self.retention_days)
+        outbox_cutoff = now - timedelta(days=self.outbox_retention_days)
+        invitation_cutoff = now - timedelta(days=self.invitation_retention_days)
+        Invitation = OrganizationInvitation
+
+        counts = {
+            "organization_invitations.expired": await self._in_batches(
+                "organization_invitations", "expired",
+                lambda: update(Invitation)
+                .where(Invitation.id.in_(self._batch(
+                    Invitation, Invitation.status == InvitationStatus.PENDING, Invitation.expires_at < now
+                )))
+                .values(status=InvitationStatus.EXPIRED)
+            ),
+            "organization_invitations.purged": await self._in_batches(
+                "organization_invitations", "purged",
+                lambda: delete(Invitation).where(Invitation.id.in_(self._batch(
+                    Invitation,
+                    Invitation.status.in_([InvitationStatus.EXPIRED, InvitationStatus.REVOKED]),
+                    Invitation.expires_at < invitation_cutoff
+                )))
+            ),
+            "email_verifications.purged": await self._in_batches(
+                "email_verifications", "purged",
+                lambda: delete(EmailVerification).where(EmailVerification.id.in_(self._batch(
+                    EmailVerification, EmailVerification.expires_at < retention_cutoff
+                )))
+            ),
+            "password_resets.purged": await self._in_batches(
+                "password_resets", "purged",
+                lambda: delete(PasswordReset).where(PasswordReset.id.in_(self._batch(
+                    PasswordReset, PasswordReset.expires_at < retention_cutoff
+                )))
+            ),
+            "user_sessions.purged": await self._in_batches(
+                "user_sessions", "purged",
+                lambda: delete(UserSession).where(UserSession.id.in_(self._batch(
+                    UserSession, UserSession.expires_at < retention_cutoff
+                )))
+            ),
+            "email_outbox.purged": await self._in_batches(
+                "email_outbox", "purged",
+                lambda: delete(EmailOutbox).where(EmailOutbox.id.in_(self._batch(
+                    EmailOutbox,
+                    EmailOutbox.status != EmailOutboxStatus.PENDING,
+                    EmailOutbox.created_at < outbox_cutoff
+                )))
+            ),
+        }
+
+        touched = {step: count for step, count in counts.items() if count}
+        if touched:
+            logger.info(f"🧹 Auth housekeeping: {touched}")
+
+        await maintain_partitions(engine)
+
+    def _batch(self, model, *criteria):
+        """Ids of the next batch, oldest first; rows locked by live requests are skipped"""
+        return (
+            select(model.id)
+            .where(*criteria)
+            .order_by(model.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+
+    async def _in_batches(self, table: str, action: str, make_statement: Callable) -> int:
+        """Repeat a bounded statement, one short transaction per batch, until it runs dry"""
+        total = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(make_statement().execution_options(synchronize_session=False))
+                await session.commit()
+
+            total += result.rowcount
+            HOUSEKEEPING_ROWS.labels(table=table, action=action).inc(result.rowcount)
+            if result.rowcount < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause_seconds)
+
+
+housekeeper = Housekeeper()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    asyncio.run(housekeeper.run_once())
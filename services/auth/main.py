@@ -1,13 +1,21 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Response, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import func, literal, union_all, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
 import logging
 import os
 from datetime import datetime, timedelta
 from typing import Optional, List
 import secrets
 import string
-import httpx
+import csv
+import io
+from email_validator import validate_email, EmailNotValidError
 from pydantic import BaseModel, EmailStr
 
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
@@ -19,10 +27,20 @@ app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True,
 # Import shared modules
 import sys
 sys.path.append('/app')
-from shared.database import get_session, create_db_and_tables
-from shared.models import User, Organization, EmailVerification, PasswordReset, OrganizationInvitation, InvitationStatus
+from shared.database import get_session, get_read_session, AsyncSessionLocal, QueryStatsMiddleware
+from shared.migrations import check_schema_version
+from shared.models import ApiKey, User, UserRole, UserSession, Organization, EmailVerification, PasswordReset, OrganizationInvitation, OrganizationUsage, InvitationStatus
 from shared.auth_utils import verify_password, get_password_hash
 from shared.cookie_auth import cookie_auth
+from shared.api_keys import API_KEY_SCOPES, api_key_verifier, generate_api_key, hash_api_key_secret
+from outbox import enqueue_email, enqueue_emails, outbox_dispatcher
+from throttle import throttle
+from housekeeping import housekeeper
+
+app.add_middleware(QueryStatsMiddleware)
+
+MAX_BULK_INVITATIONS = int(os.getenv("MAX_BULK_INVITATIONS", 1000))
+INVITABLE_ROLES = {UserRole.ORG_ADMIN, UserRole.MEAL_OFFICER, UserRole.DONOR_VIEW}
 
 # Pydantic Models
 class UserLogin(BaseModel):
@@ -60,6 +78,21 @@ class InvitationCreate(BaseModel):
     email: EmailStr
     role: str
 
+class BulkInvitationItem(BaseModel):
+    email: str  # validated per row so one bad address doesn't reject the batch
+    role: Optional[str] = None
+
+class BulkInvitationCreate(BaseModel):
+    invitations: List[BulkInvitationItem]
+
+class ApiKeyCreate(BaseModel):
+    name: str
+    scopes: List[str]
+    expires_in_days: Optional[int] = None
+
+class ApiKeyVerifyRequest(BaseModel):
+    api_key: str
+
 class AcceptInvitationRequest(BaseModel):
     token: str
     password: str
@@ -67,125 +100,133 @@ class AcceptInvitationRequest(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    await create_db_and_tables()
+    await check_schema_version()
+    await outbox_dispatcher.start()
+    api_key_verifier.start(AsyncSessionLocal)
+    housekeeper.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await housekeeper.stop()
+    await outbox_dispatcher.stop()
+    await api_key_verifier.stop(AsyncSessionLocal)
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
 @app.post("/register")
-async def register(user_data: UserCreate, background_tasks: BackgroundTasks, response: Response):
+async def register(user_data: UserCreate, response: Response):
     """User registration with email verification"""
     try:
+        hashed_password = await run_in_threadpool(get_password_hash, user_data.password)
+        
         async for session in get_session():
-            from sqlmodel import select
-            
-            # Check if user exists
-            result = await session.execute(select(User).where(User.email == user_data.email))
-            existing_user = result.scalar_one_or_none()
-            
-            if existing_user:
-                raise HTTPException(status_code=400, detail="Email already registered")
-            
-            # Create user
-            user = User(
-                email=user_data.email,
-                hashed_password=get_password_hash(user_data.password),
-                full_name=user_data.full_name,
-                role="ORG_OWNER",
-                is_verified=False
+            # Create user; the unique email index rejects duplicates atomically,
+            # so concurrent registrations cannot both succeed
+            result = await session.execute(
+                insert(User)
+                .values(
+                    email=user_data.email,
+                    hashed_password=hashed_password,
+                    full_name=user_data.full_name,
+                    role=UserRole.ORG_OWNER,
+                    is_verified=False
+                )
+                .on_conflict_do_nothing(index_elements=[User.email])
+                .returning(User.id)
             )
+            user_id = result.scalar_one_or_none()
             
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
+            if user_id is None:
+                raise HTTPException(status_code=400, detail="Email already registered")
             
             # Generate verification code
             verification_code = ''.join(secrets.choice(string.digits) for _ in range(6))
             expires_at = datetime.utcnow() + timedelta(hours=24)
             
-            verification = EmailVerification(
-                email=user.email,
+            session.add(EmailVerification(
+                email=user_data.email,
                 verification_code=verification_code,
                 expires_at=expires_at
-            )
-            
-            session.add(verification)
+            ))
+            enqueue_verification_email(session, user_data.email, verification_code)
             await session.commit()
-            
-            # Send verification email
-            background_tasks.add_task(send_verification_email, user.email, verification_code)
+            outbox_dispatcher.notify()
             
             # Create temporary access token
-            token_data = {"sub": user.email, "role": user.role, "temp": True}
+            token_data = {"sub": user_data.email, "uid": user_id, "role": UserRole.ORG_OWNER, "temp": True}
             access_token = cookie_auth.create_access_token(token_data)
             cookie_auth.set_access_token_cookie(response, access_token)
             
-            logger.info(f"✅ User registered: {user.email}")
+            logger.info(f"✅ User registered: {user_data.email}")
             
             return {
                 "message": "Registration successful. Please check your email for verification code.",
-                "user_id": user.id,
+                "user_id": user_id,
                 "verification_required": True
             }
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Registration failed: {e}")
         raise HTTPException(status_code=500, detail="Registration failed")
 
 @app.post("/verify-email")
-async def verify_email(verify_data: VerifyEmailRequest, response: Response):
+async def verify_email(verify_data: VerifyEmailRequest, request: Request, response: Response):
     """Verify user email with code"""
     try:
+        await throttle.check("verify_email", request, verify_data.email)
+        
         async for session in get_session():
-            from sqlmodel import select
+            now = datetime.utcnow()
             
-            # Find verification record
-            result = await session.execute(
-                select(EmailVerification).where(
+            # Consume the code and mark the user verified in a single statement
+            consumed = (
+                update(EmailVerification)
+                .where(
                     EmailVerification.email == verify_data.email,
                     EmailVerification.verification_code == verify_data.code,
                     EmailVerification.used_at.is_(None),
-                    EmailVerification.expires_at > datetime.utcnow()
+                    EmailVerification.expires_at > now
                 )
+                .values(used_at=now)
+                .returning(EmailVerification.email)
+                .cte("consumed_verification")
             )
-            verification = result.scalar_one_or_none()
+            result = await session.execute(
+                update(User)
+                .where(User.email.in_(select(consumed.c.email)))
+                .values(is_verified=True, updated_at=now)
+                .returning(User)
+                .execution_options(synchronize_session=False)
+            )
+            user = result.scalar_one_or_none()
             
-            if not verification:
+            if not user:
+                await throttle.record_failure("verify_email", request, verify_data.email)
                 raise HTTPException(status_code=400, detail="Invalid or expired verification code")
             
-            # Mark verification as used
-            verification.used_at = datetime.utcnow()
-            
-            # Mark user as verified
-            user_result = await session.execute(select(User).where(User.email == verify_data.email))
-            user = user_result.scalar_one_or_none()
+            # Create full access token and start a refresh token family
+            issue_session_tokens(session, user, response)
+            await session.commit()
+            await throttle.record_success("verify_email", request, verify_data.email)
             
-            if user:
-                user.is_verified = True
-                await session.commit()
-                
-                # Create full access token
-                token_data = {"sub": user.email, "role": user.role, "org_id": user.organization_id}
-                access_token = cookie_auth.create_access_token(token_data)
-                cookie_auth.set_access_token_cookie(response, access_token)
-                
-                logger.info(f"✅ Email verified: {user.email}")
-                
-                return {
-                    "message": "Email verified successfully",
-                    "verified": True,
-                    "user": UserResponse(
-                        id=user.id,
-                        email=user.email,
-                        full_name=user.full_name,
-                        role=user.role,
-                        is_active=user.is_active,
-                        is_verified=user.is_verified,
-                        organization_id=user.organization_id,
-                        created_at=user.created_at
-                    )
-                }
+            logger.info(f"✅ Email verified: {user.email}")
             
-            raise HTTPException(status_code=400, detail="User not found")
+            return {
+                "message": "Email verified successfully",
+                "verified": True,
+                "user": UserResponse(
+                    id=user.id,
+                    email=user.email,
+                    full_name=user.full_name,
+                    role=user.role,
+                    is_active=user.is_active,
+                    is_verified=user.is_verified,
+                    organization_id=user.organization_id,
+                    created_at=user.created_at
+                )
+            }
             
     except HTTPException:
         raise
@@ -194,30 +235,32 @@ async def verify_email(verify_data: VerifyEmailRequest, response: Response):
         raise HTTPException(status_code=500, detail="Email verification failed")
 
 @app.post("/login")
-async def login(user_data: UserLogin, response: Response):
+async def login(user_data: UserLogin, request: Request, response: Response):
     """User login"""
     try:
+        # Rejected callers never reach bcrypt
+        await throttle.check("login", request, user_data.email)
+        
         async for session in get_session():
-            from sqlmodel import select
-            
             result = await session.execute(select(User).where(User.email == user_data.email))
             user = result.scalar_one_or_none()
             
-            if not user or not verify_password(user_data.password, user.hashed_password):
+            # bcrypt runs in the threadpool so a burst of attempts can't stall the event loop
+            if not user or not await run_in_threadpool(verify_password, user_data.password, user.hashed_password):
+                await throttle.record_failure("login", request, user_data.email)
                 raise HTTPException(status_code=401, detail="Invalid credentials")
             
+            await throttle.record_success("login", request, user_data.email)
+            
             if not user.is_active:
                 raise HTTPException(status_code=401, detail="Account deactivated")
             
             if not user.is_verified:
                 raise HTTPException(status_code=401, detail="Email verification required")
             
-            # Create tokens
-            token_data = {"sub": user.email, "role": user.role, "org_id": user.organization_id}
-            access_token = cookie_auth.create_access_token(token_data)
-            
-            # Set HTTP-only cookie
-            cookie_auth.set_access_token_cookie(response, access_token)
+            # Create tokens and set HTTP-only cookies
+            issue_session_tokens(session, user, response)
+            await session.commit()
             
             logger.info(f"✅ User logged in: {user.email}")
             
@@ -241,9 +284,66 @@ async def login(user_data: UserLogin, response: Response):
         logger.error(f"❌ Login failed: {e}")
         raise HTTPException(status_code=500, detail="Login failed")
 
+@app.post("/refresh")
+async def refresh(request: Request):
+    """Rotate the refresh token and issue a new short-lived access token"""
+    payload = get_refresh_token_payload(request)
+    if not payload or not payload.get("jti"):
+        return refresh_rejected()
+    
+    try:
+        async for session in get_session():
+            now = datetime.utcnow()
+            
+            # Consume the presented token; only one concurrent caller can win
+            result = await session.execute(
+                update(UserSession)
+                .where(
+                    UserSession.refresh_token == payload["jti"],
+                    UserSession.rotated_at.is_(None),
+                    UserSession.revoked_at.is_(None),
+                    UserSession.expires_at > now
+                )
+                .values(rotated_at=now)
+                .returning(UserSession.user_id, UserSession.family_id)
+            )
+            consumed = result.first()
+            
+            if not consumed:
+                # Signed by us but already rotated or revoked: treat as reuse
+                await revoke_session_family(session, payload.get("fam"))
+                await session.commit()
+                logger.warning(f"⚠️ Refresh token reuse detected for {payload.get('sub')}, family revoked")
+                return refresh_rejected()
+            
+            user = await session.get(User, consumed.user_id)
+            if not user or not user.is_active:
+                await revoke_session_family(session, consumed.family_id)
+                await session.commit()
+                return refresh_rejected()
+            
+            response = JSONResponse({"message": "Token refreshed"})
+            issue_session_tokens(session, user, response, family_id=consumed.family_id)
+            await session.commit()
+            
+            return response
+            
+    except Exception as e:
+        logger.error(f"❌ Token refresh failed: {e}")
+        raise HTTPException(status_code=500, detail="Token refresh failed")
+
 @app.post("/logout")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
     """User logout"""
+    payload = get_refresh_token_payload(request)
+    if payload and payload.get("fam"):
+        try:
+            async for session in get_session():
+                await revoke_session_family(session, payload["fam"])
+                await session.commit()
+        except Exception as e:
+            logger.error(f"❌ Failed to revoke session on logout: {e}")
+    
     cookie_auth.clear_token_cookies(response)
     return {"message": "Logout successful"}
 
@@ -271,7 +371,7 @@ async def get_current_user(request: Request):
 # ==================== PASSWORD RESET ENDPOINTS ====================
 
 @app.post("/forgot-password")
-async def forgot_password(forgot_data: ForgotPasswordRequest, background_tasks: BackgroundTasks):
+async def forgot_password(forgot_data: ForgotPasswordRequest):
     """Request password reset"""
     try:
         async for session in get_session():
@@ -307,10 +407,9 @@ async def forgot_password(forgot_data: ForgotPasswordRequest, background_tasks:
                 )
                 session.add(reset)
             
+            enqueue_password_reset_email(session, user.email, reset_code)
             await session.commit()
-            
-            # Send reset email
-            background_tasks.add_task(send_password_reset_email, user.email, reset_code)
+            outbox_dispatcher.notify()
             
             logger.info(f"✅ Password reset requested: {user.email}")
             
@@ -321,42 +420,68 @@ async def forgot_password(forgot_data: ForgotPasswordRequest, background_tasks:
         raise HTTPException(status_code=500, detail="Password reset failed")
 
 @app.post("/reset-password")
-async def reset_password(reset_data: ResetPasswordRequest):
+async def reset_password(reset_data: ResetPasswordRequest, request: Request):
     """Reset password with code"""
     try:
+        await throttle.check("reset_password", request, reset_data.email)
+        
+        # Hash before opening the transaction so the reset code row is never
+        # locked while bcrypt runs; the throttle bounds wasted hashes
+        hashed_password = await run_in_threadpool(get_password_hash, reset_data.new_password)
+        
         async for session in get_session():
-            from sqlmodel import select
+            now = datetime.utcnow()
             
-            # Find reset record
-            result = await session.execute(
-                select(PasswordReset).where(
+            # Consume the code, update the password and revoke outstanding
+            # refresh tokens in a single statement
+            consumed = (
+                update(PasswordReset)
+                .where(
                     PasswordReset.email == reset_data.email,
                     PasswordReset.reset_code == reset_data.code,
                     PasswordReset.used_at.is_(None),
-                    PasswordReset.expires_at > datetime.utcnow()
+                    PasswordReset.expires_at > now
+                )
+                .values(used_at=now)
+                .returning(PasswordReset.email)
+                .cte("consumed_reset")
+            )
+            updated_user = (
+                update(User)
+                .where(User.email.in_(select(consumed.c.email)))
+                .values(hashed_password=hashed_password, updated_at=now)
+                .returning(User.id, User.email)
+                .cte("updated_user")
+            )
+            revoked_sessions = (
+                update(UserSession)
+                .where(
+                    UserSession.user_id.in_(select(updated_user.c.id)),
+                    UserSession.revoked_at.is_(None)
                 )
+                .values(revoked_at=now)
+                .returning(UserSession.id)
+                .cte("revoked_sessions")
             )
-            reset_record = result.scalar_one_or_none()
+            result = await session.execute(
+                select(consumed.c.email, updated_user.c.id)
+                .select_from(consumed.outerjoin(updated_user, updated_user.c.email == consumed.c.email))
+                .add_cte(revoked_sessions)
+            )
+            row = result.first()
             
-            if not reset_record:
+            if not row:
+                await throttle.record_failure("reset_password", request, reset_data.email)
                 raise HTTPException(status_code=400, detail="Invalid or expired reset code")
+            if row.id is None:
+                raise HTTPException(status_code=400, detail="User not found")
             
-            # Mark reset as used
-            reset_record.used_at = datetime.utcnow()
-            
-            # Update user password
-            user_result = await session.execute(select(User).where(User.email == reset_data.email))
-            user = user_result.scalar_one_or_none()
+            await session.commit()
+            await throttle.record_success("reset_password", request, reset_data.email)
             
-            if user:
-                user.hashed_password = get_password_hash(reset_data.new_password)
-                await session.commit()
-                
-                logger.info(f"✅ Password reset: {user.email}")
-                
-                return {"message": "Password reset successfully"}
+            logger.info(f"✅ Password reset: {reset_data.email}")
             
-            raise HTTPException(status_code=400, detail="User not found")
+            return {"message": "Password reset successfully"}
             
     except HTTPException:
         raise
@@ -370,21 +495,16 @@ async def reset_password(reset_data: ResetPasswordRequest):
 async def create_invitation(invitation_data: InvitationCreate, request: Request):
     """Create organization invitation"""
     try:
+        # Check if user has permission to invite
+        claims = require_org_admin(request)
+        organization_id = claims["org_id"]
+        
         async for session in get_session():
-            user = await cookie_auth.get_current_user(request, session)
-            
-            if not user.organization_id:
-                raise HTTPException(status_code=400, detail="User must belong to an organization")
-            
-            # Check if user has permission to invite
-            if user.role not in ["org_owner", "org_admin"]:
-                raise HTTPException(status_code=403, detail="Insufficient permissions")
-            
             # Check if user already exists in organization
             existing_user_result = await session.execute(
                 select(User).where(
                     User.email == invitation_data.email,
-                    User.organization_id == user.organization_id
+                    User.organization_id == organization_id
                 )
             )
             if existing_user_result.scalar_one_or_none():
@@ -397,17 +517,18 @@ async def create_invitation(invitation_data: InvitationCreate, request: Request)
             invitation = OrganizationInvitation(
                 email=invitation_data.email,
                 role=invitation_data.role,
-                invited_by=user.id,
-                organization_id=user.organization_id,
+                invited_by=claims["uid"],
+                organization_id=organization_id,
                 token=token,
                 expires_at=expires_at
             )
             
             session.add(invitation)
-            await session.commit()
             
-            # Send invitation email
-            await send_invitation_email(invitation_data.email, token, user.organization_id)
+            organization = await session.get(Organization, organization_id)
+            enqueue_invitation_email(session, invitation_data.email, token, organization.name if organization else "Unknown")
+            await session.commit()
+            outbox_dispatcher.notify()
             
             logger.info(f"✅ Invitation created for {invitation_data.email}")
             
@@ -423,6 +544,154 @@ async def create_invitation(invitation_data: InvitationCreate, request: Request)
         logger.error(f"❌ Invitation creation failed: {e}")
         raise HTTPException(status_code=500, detail="Invitation creation failed")
 
+@app.post("/invitations/bulk")
+async def create_bulk_invitations(request: Request):
+    """Invite many people at once from a JSON list or a CSV file with email,role columns"""
+    try:
+        claims = require_org_admin(request)
+        organization_id = claims["org_id"]
+        
+        items = await read_bulk_invitation_items(request)
+        if not items:
+            raise HTTPException(status_code=400, detail="No invitations supplied")
+        if len(items) > MAX_BULK_INVITATIONS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_INVITATIONS} invitations per request")
+        
+        # Validate rows and drop in-batch duplicates before touching the database
+        results = []
+        candidates = {}
+        for row, item in enumerate(items):
+            result = {"row": row, "email": item.email, "role": item.role, "status": None}
+            results.append(result)
+            
+            try:
+                email = validate_email(item.email.strip(), check_deliverability=False).normalized
+            except EmailNotValidError as e:
+                result.update(status="invalid_email", detail=str(e))
+                continue
+            
+            role = parse_invitation_role(item.role or UserRole.MEAL_OFFICER.value)
+            if role not in INVITABLE_ROLES:
+                result.update(status="invalid_role")
+                continue
+            
+            result.update(email=email, role=role.value)
+            if email.lower() in candidates:
+                result["status"] = "duplicate"
+                continue
+            candidates[email.lower()] = result
+        
+        async for session in get_session():
+            now = datetime.utcnow()
+            emails = [result["email"] for result in candidates.values()]
+            
+            # Seats left = max_users minus active members (maintained counter) minus open invitations.
+            # Locking the counter row first makes concurrent bulk requests queue here until the
+            # other commits; invitations are counted in a later statement, whose snapshot then
+            # includes theirs, so seats can't be handed out twice.
+            await session.execute(
+                insert(OrganizationUsage)
+                .from_select(["organization_id"], select(Organization.id).where(Organization.id == organization_id))
+                .on_conflict_do_nothing()
+            )
+            org_result = await session.execute(
+                select(Organization.name, Organization.max_users, OrganizationUsage.active_users)
+                .join(OrganizationUsage, OrganizationUsage.organization_id == Organization.id)
+                .where(Organization.id == organization_id)
+                .with_for_update(of=OrganizationUsage)
+            )
+            organization = org_result.first()
+            if not organization:
+                raise HTTPException(status_code=404, detail="Organization not found")
+            organization_name, max_users, member_count = organization
+            pending_count = await session.scalar(
+                select(func.count(OrganizationInvitation.id)).where(
+                    OrganizationInvitation.organization_id == organization_id,
+                    OrganizationInvitation.status == InvitationStatus.PENDING,
+                    OrganizationInvitation.expires_at > now
+                )
+            )
+            seats_left = max(max_users - member_count - pending_count, 0)
+            
+            if emails:
+                # Existing members and live invitations for these addresses, in one query
+                existing = await session.execute(union_all(
+                    select(User.email, literal("already_member").label("reason")).where(
+                        User.organization_id == organization_id,
+                        User.email.in_(emails)
+                    ),
+                    select(OrganizationInvitation.email, literal("already_invited").label("reason")).where(
+                        OrganizationInvitation.organization_id == organization_id,
+                        OrganizationInvitation.status == InvitationStatus.PENDING,
+                        OrganizationInvitation.expires_at > now,
+                        OrganizationInvitation.email.in_(emails)
+                    )
+                ))
+                for email, reason in existing:
+                    result = candidates.get(email.lower())
+                    if result and not result["status"]:
+                        result["status"] = reason
+            
+            expires_at = now + timedelta(days=7)
+            to_invite = []
+            for result in candidates.values():
+                if result["status"]:
+                    continue
+                if len(to_invite) >= seats_left:
+                    result["status"] = "quota_exceeded"
+                    continue
+                result["token"] = secrets.token_urlsafe(32)
+                to_invite.append(result)
+            
+            if to_invite:
+                inserted = await session.execute(
+                    insert(OrganizationInvitation)
+                    .values([
+                        {
+                            "email": result["email"],
+                            "role": result["role"],
+                            "invited_by": claims["uid"],
+                            "organization_id": organization_id,
+                            "token": result["token"],
+                            "status": InvitationStatus.PENDING,
+                            "expires_at": expires_at,
+                            "created_at": now
+                        }
+                        for result in to_invite
+                    ])
+                    .returning(OrganizationInvitation.id, OrganizationInvitation.token)
+                )
+                invitation_ids = {token: invitation_id for invitation_id, token in inserted}
+                
+                await enqueue_emails(session, "/send-invitation", [
+                    invitation_email_payload(result["email"], result["token"], organization_name)
+                    for result in to_invite
+                ])
+                await session.commit()
+                outbox_dispatcher.notify()
+                
+                for result in to_invite:
+                    result.update(status="invited", invitation_id=invitation_ids.get(result.pop("token")))
+            
+            summary = {}
+            for result in results:
+                summary[result["status"]] = summary.get(result["status"], 0) + 1
+            
+            logger.info(f"✅ Bulk invitations for organization {organization_id}: {summary}")
+            
+            return {
+                "message": f"{len(to_invite)} invitation(s) sent",
+                "summary": summary,
+                "expires_at": expires_at.isoformat(),
+                "results": results
+            }
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Bulk invitation creation failed: {e}")
+        raise HTTPException(status_code=500, detail="Bulk invitation creation failed")
+
 @app.get("/invitations/{token}")
 async def get_invitation(token: str):
     """Get invitation details"""
@@ -492,14 +761,14 @@ async def accept_invitation(token: str, accept_data: AcceptInvitationRequest, re
                     raise HTTPException(status_code=400, detail="User already belongs to an organization")
                 
                 existing_user.organization_id = invitation.organization_id
-                existing_user.role = invitation.role
+                existing_user.role = parse_invitation_role(invitation.role) or invitation.role
             else:
                 # Create new user
                 user = User(
                     email=invitation.email,
-                    hashed_password=get_password_hash(accept_data.password),
+                    hashed_password=await run_in_threadpool(get_password_hash, accept_data.password),
                     full_name=accept_data.full_name,
-                    role=invitation.role,
+                    role=parse_invitation_role(invitation.role) or invitation.role,
                     organization_id=invitation.organization_id,
                     is_verified=True
                 )
@@ -512,13 +781,10 @@ async def accept_invitation(token: str, accept_data: AcceptInvitationRequest, re
             invitation.status = InvitationStatus.ACCEPTED
             invitation.accepted_at = datetime.utcnow()
             
+            # Create access token and start a refresh token family
+            issue_session_tokens(session, existing_user, response)
             await session.commit()
             
-            # Create access token
-            token_data = {"sub": existing_user.email, "role": existing_user.role, "org_id": existing_user.organization_id}
-            access_token = cookie_auth.create_access_token(token_data)
-            cookie_auth.set_access_token_cookie(response, access_token)
-            
             logger.info(f"✅ Invitation accepted: {invitation.email}")
             
             return {
@@ -541,55 +807,262 @@ async def accept_invitation(token: str, accept_data: AcceptInvitationRequest, re
         logger.error(f"❌ Accept invitation failed: {e}")
         raise HTTPException(status_code=500, detail="Accept invitation failed")
 
-# ==================== UTILITY FUNCTIONS ====================
+# ==================== API KEY ENDPOINTS ====================
 
-async def send_verification_email(email: str, code: str):
-    """Send verification email via email service"""
+@app.post("/api-keys")
+async def create_api_key(key_data: ApiKeyCreate, request: Request):
+    """Create an organization API key; the full key is only returned once"""
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                "http://165.227.116.219:8010/send-verification",
-                json={"email": email, "code": code},
-                timeout=10.0
+        claims = require_org_admin(request)
+        
+        unknown_scopes = set(key_data.scopes) - API_KEY_SCOPES
+        if unknown_scopes:
+            raise HTTPException(status_code=400, detail=f"Unknown scopes: {', '.join(sorted(unknown_scopes))}")
+        
+        prefix, api_key = generate_api_key()
+        expires_at = (
+            datetime.utcnow() + timedelta(days=key_data.expires_in_days)
+            if key_data.expires_in_days else None
+        )
+        
+        async for session in get_session(claims["org_id"]):
+            key = ApiKey(
+                organization_id=claims["org_id"],
+                name=key_data.name,
+                prefix=prefix,
+                secret_hash=hash_api_key_secret(api_key.partition(".")[2]),
+                scopes=sorted(set(key_data.scopes)),
+                created_by=claims["uid"],
+                expires_at=expires_at
             )
+            session.add(key)
+            await session.commit()
+            
+            logger.info(f"✅ API key {prefix} created for organization {claims['org_id']}")
+            
+            return {
+                "message": "API key created. Store it now; it cannot be shown again.",
+                "api_key": api_key,
+                "id": key.id,
+                "prefix": prefix,
+                "scopes": key.scopes,
+                "expires_at": expires_at.isoformat() if expires_at else None
+            }
+            
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Failed to send verification email: {e}")
+        logger.error(f"❌ API key creation failed: {e}")
+        raise HTTPException(status_code=500, detail="API key creation failed")
 
-async def send_password_reset_email(email: str, code: str):
-    """Send password reset email via email service"""
+@app.get("/api-keys")
+async def list_api_keys(request: Request):
+    """List the organization's API keys"""
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                "http://165.227.116.219:8010/send-password-reset",
-                json={"email": email, "code": code},
-                timeout=10.0
+        claims = require_org_admin(request)
+        
+        async for session in get_read_session(claims["org_id"]):
+            result = await session.execute(
+                select(ApiKey)
+                .where(ApiKey.organization_id == claims["org_id"])
+                .order_by(ApiKey.created_at.desc())
             )
+            return {
+                "api_keys": [
+                    {
+                        "id": key.id,
+                        "name": key.name,
+                        "prefix": key.prefix,
+                        "scopes": key.scopes,
+                        "created_at": key.created_at.isoformat(),
+                        "expires_at": key.expires_at.isoformat() if key.expires_at else None,
+                        "last_used_at": key.last_used_at.isoformat() if key.last_used_at else None,
+                        "revoked": key.revoked_at is not None
+                    }
+                    for key in result.scalars()
+                ]
+            }
+            
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Failed to send password reset email: {e}")
+        logger.error(f"❌ Listing API keys failed: {e}")
+        raise HTTPException(status_code=500, detail="Listing API keys failed")
 
-async def send_invitation_email(email: str, token: str, organization_id: int):
-    """Send invitation email via email service"""
+@app.delete("/api-keys/{key_id}")
+async def revoke_api_key(key_id: int, request: Request):
+    """Revoke an API key"""
     try:
-        async for session in get_session():
-            from sqlmodel import select
+        claims = require_org_admin(request)
+        
+        async for session in get_session(claims["org_id"]):
+            result = await session.execute(
+                update(ApiKey)
+                .where(
+                    ApiKey.id == key_id,
+                    ApiKey.organization_id == claims["org_id"],
+                    ApiKey.revoked_at.is_(None)
+                )
+                .values(revoked_at=datetime.utcnow())
+                .returning(ApiKey.prefix)
+            )
+            prefix = result.scalar_one_or_none()
+            if not prefix:
+                raise HTTPException(status_code=404, detail="API key not found")
+            await session.commit()
             
-            org_result = await session.execute(select(Organization).where(Organization.id == organization_id))
-            organization = org_result.scalar_one_or_none()
+            api_key_verifier.invalidate(prefix)
+            logger.info(f"✅ API key {prefix} revoked")
             
-            invitation_link = f"https://evidflow.com/accept-invitation?token={token}"
-            
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    "http://165.227.116.219:8010/send-invitation",
-                    json={
-                        "email": email,
-                        "organization_name": organization.name if organization else "Unknown",
-                        "invitation_link": invitation_link
-                    },
-                    timeout=10.0
-                )
+            return {"message": "API key revoked"}
+            
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Failed to send invitation email: {e}")
+        logger.error(f"❌ API key revocation failed: {e}")
+        raise HTTPException(status_code=500, detail="API key revocation failed")
+
+@app.post("/api-keys/verify")
+async def verify_api_key(verify_data: ApiKeyVerifyRequest):
+    """Resolve an API key to its claims; used by the gateway"""
+    try:
+        async for session in get_session():
+            claims = await api_key_verifier.verify(session, verify_data.api_key)
+            if not claims:
+                raise HTTPException(status_code=401, detail="Invalid API key")
+            return claims
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ API key verification failed: {e}")
+        raise HTTPException(status_code=500, detail="API key verification failed")
+
+# ==================== UTILITY FUNCTIONS ====================
+
+def require_org_admin(request: Request) -> dict:
+    """Token claims of an organization owner or admin"""
+    claims = cookie_auth.get_token_claims(request)
+    if not claims.get("org_id"):
+        raise HTTPException(status_code=400, detail="User must belong to an organization")
+    if claims.get("role") not in ["org_owner", "org_admin"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return claims
+
+def issue_session_tokens(session: AsyncSession, user: User, response: Response, family_id: Optional[str] = None):
+    """Set a short-lived access token and a rotating refresh token on the response.
+    
+    The refresh token is recorded as a UserSession row in the caller's transaction;
+    the caller commits.
+    """
+    access_jti = secrets.token_urlsafe(16)
+    refresh_jti = secrets.token_urlsafe(32)
+    family_id = family_id or secrets.token_urlsafe(16)
+    
+    access_token = cookie_auth.create_access_token({**cookie_auth.build_token_claims(user), "jti": access_jti})
+    refresh_token = cookie_auth.create_refresh_token({"sub": user.email, "jti": refresh_jti, "fam": family_id})
+    
+    session.add(UserSession(
+        user_id=user.id,
+        family_id=family_id,
+        access_token=access_jti,
+        refresh_token=refresh_jti,
+        expires_at=datetime.utcnow() + timedelta(days=cookie_auth.refresh_token_expire_days)
+    ))
+    
+    cookie_auth.set_access_token_cookie(response, access_token)
+    cookie_auth.set_refresh_token_cookie(response, refresh_token)
+
+async def revoke_session_family(session: AsyncSession, family_id: Optional[str]):
+    """Revoke every live refresh token descended from the same login"""
+    if not family_id:
+        return
+    await session.execute(
+        update(UserSession)
+        .where(UserSession.family_id == family_id, UserSession.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+
+def get_refresh_token_payload(request: Request) -> Optional[dict]:
+    """Decode the refresh token cookie, if present and valid"""
+    token = cookie_auth.get_token_from_cookie(request, token_type="refresh")
+    payload = cookie_auth.verify_token(token) if token else None
+    if not payload or payload.get("type") != "refresh":
+        return None
+    return payload
+
+def refresh_rejected() -> JSONResponse:
+    """401 response that also clears the client's token cookies"""
+    response = JSONResponse(status_code=401, content={"detail": "Invalid refresh token"})
+    cookie_auth.clear_token_cookies(response)
+    return response
+
+def enqueue_verification_email(session: AsyncSession, email: str, code: str):
+    """Queue the verification email in the caller's transaction"""
+    enqueue_email(session, "/send-verification", {"email": email, "code": code})
+
+def enqueue_password_reset_email(session: AsyncSession, email: str, code: str):
+    """Queue the password reset email in the caller's transaction"""
+    enqueue_email(session, "/send-password-reset", {"email": email, "code": code})
+
+def invitation_email_payload(email: str, token: str, organization_name: str) -> dict:
+    return {
+        "email": email,
+        "organization_name": organization_name,
+        "invitation_link": f"https://evidflow.com/accept-invitation?token={token}"
+    }
+
+def enqueue_invitation_email(session: AsyncSession, email: str, token: str, organization_name: str):
+    """Queue the invitation email in the caller's transaction"""
+    enqueue_email(session, "/send-invitation", invitation_email_payload(email, token, organization_name))
+
+def parse_invitation_role(role: Optional[str]) -> Optional[UserRole]:
+    """Accept a role by name or value, case-insensitively"""
+    if not role:
+        return None
+    for member in UserRole:
+        if role.strip().lower() in (member.name.lower(), member.value.lower()):
+            return member
+    return None
+
+async def read_bulk_invitation_items(request: Request) -> List[BulkInvitationItem]:
+    """Parse a bulk invitation body: JSON (list or {"invitations": [...]}), CSV, or a CSV upload"""
+    content_type = request.headers.get("content-type", "")
+    
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Expected a CSV upload in the 'file' field")
+        return parse_invitation_csv((await upload.read()).decode("utf-8-sig"))
+    
+    if content_type.startswith("text/csv"):
+        return parse_invitation_csv((await request.body()).decode("utf-8-sig"))
+    
+    try:
+        body = await request.json()
+        if isinstance(body, list):
+            body = {"invitations": body}
+        return BulkInvitationCreate(**body).invitations
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected a list of {email, role} objects")
+
+def parse_invitation_csv(text: str) -> List[BulkInvitationItem]:
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or "email" not in [name.strip().lower() for name in reader.fieldnames]:
+        raise HTTPException(status_code=400, detail="CSV must have a header row with an 'email' column")
+    
+    items = []
+    for row in reader:
+        row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+        if not any(row.values()):
+            continue
+        items.append(BulkInvitationItem(email=row.get("email", ""), role=row.get("role") or None))
+    return items
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 async def health_check():
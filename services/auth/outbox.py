@@ -0,0 +1,212 @@
+"""Transactional outbox for auth emails.
+
+Endpoints call ``enqueue_email`` inside the transaction that creates the
+verification code, reset code or invitation, so the email is recorded if and
+only if that row commits. ``OutboxDispatcher`` drains the table in the
+background: it leases a batch of due rows, posts them to the email service over
+one pooled HTTP client, and reschedules failures with exponential backoff.
+API latency therefore never depends on the email path.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal
+from shared.models import EmailOutbox, EmailOutboxStatus
+
+logger = logging.getLogger(__name__)
+
+EMAIL_SERVICE_URL = os.getenv("EMAIL_SERVICE_URL", "http://165.227.116.219:8010")
+
+
+def enqueue_email(session: AsyncSession, endpoint: str, payload: Dict[str, Any]):
+    """Record an email for delivery; the caller's commit makes it durable"""
+    session.add(EmailOutbox(endpoint=endpoint, payload=payload))
+
+
+async def enqueue_emails(session: AsyncSession, endpoint: str, payloads: List[Dict[str, Any]]):
+    """Record many emails with a single multi-row INSERT"""
+    if payloads:
+        await session.execute(
+            insert(EmailOutbox),
+            [{"endpoint": endpoint, "payload": payload} for payload in payloads]
+        )
+
+
+class PermanentDeliveryError(Exception):
+    """The email service rejected the message; retrying will not help"""
+
+
+class OutboxDispatcher:
+    def __init__(self):
+        self.batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+        self.concurrency = int(os.getenv("OUTBOX_CONCURRENCY", 10))
+        self.poll_interval = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", 5))
+        self.lease_seconds = int(os.getenv("OUTBOX_LEASE_SECONDS", 60))
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+        self.base_backoff_seconds = float(os.getenv("OUTBOX_BASE_BACKOFF_SECONDS", 10))
+        self.max_backoff_seconds = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 3600))
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self):
+        """Open the pooled client and start draining in the background"""
+        if self._task:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=EMAIL_SERVICE_URL,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"📬 Email outbox dispatcher started ({EMAIL_SERVICE_URL})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def notify(self):
+        """Wake the dispatcher after committing new outbox rows"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                dispatched = await self.dispatch_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Email outbox dispatch failed: {e}")
+                dispatched = 0
+
+            # A full batch means more rows are probably due; go again immediately
+            if dispatched >= self.batch_size:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def dispatch_batch(self) -> int:
+        """Deliver one batch of due emails; returns the number attempted"""
+        rows = await self._lease_batch()
+        if not rows:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(row: EmailOutbox) -> Optional[Exception]:
+            async with semaphore:
+                try:
+                    await self._deliver(row)
+                    return None
+                except Exception as e:
+                    return e
+
+        errors = await asyncio.gather(*(deliver(row) for row in rows))
+        await self._record_results(rows, errors)
+        return len(rows)
+
+    async def _lease_batch(self) -> List[EmailOutbox]:
+        """Claim due rows by pushing next_attempt_at past the lease window.
+
+        SKIP LOCKED lets several replicas drain the table without handing out
+        the same row twice, and the short transaction never spans HTTP calls.
+        """
+        async with AsyncSessionLocal() as session:
+            now = datetime.utcnow()
+            due = (
+                select(EmailOutbox.id)
+                .where(
+                    EmailOutbox.status == EmailOutboxStatus.PENDING,
+                    EmailOutbox.next_attempt_at <= now
+                )
+                .order_by(EmailOutbox.next_attempt_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = await session.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id.in_(due.scalar_subquery()))
+                .values(next_attempt_at=now + timedelta(seconds=self.lease_seconds))
+                .returning(EmailOutbox)
+                .execution_options(synchronize_session=False)
+            )
+            rows = list(result.scalars().all())
+            await session.commit()
+            return rows
+
+    async def _deliver(self, row: EmailOutbox):
+        response = await self._client.post(row.endpoint, json=row.payload)
+        if response.status_code < 400:
+            return
+        error = f"HTTP {response.status_code}: {response.text[:200]}"
+        if response.status_code < 500 and response.status_code != 429:
+            raise PermanentDeliveryError(error)
+        raise RuntimeError(error)
+
+    async def _record_results(self, rows: List[EmailOutbox], errors: List[Optional[Exception]]):
+        now = datetime.utcnow()
+        sent_ids = [row.id for row, error in zip(rows, errors) if error is None]
+
+        async with AsyncSessionLocal() as session:
+            if sent_ids:
+                await session.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_(sent_ids))
+                    .values(
+                        status=EmailOutboxStatus.SENT,
+                        attempts=EmailOutbox.attempts + 1,
+                        sent_at=now,
+                        last_error=None
+                    )
+                )
+
+            for row, error in zip(rows, errors):
+                if error is None:
+                    continue
+                attempts = row.attempts + 1
+                if isinstance(error, PermanentDeliveryError) or attempts >= self.max_attempts:
+                    values = {"status": EmailOutboxStatus.FAILED}
+                    logger.error(f"❌ Giving up on outbox email {row.id} ({row.endpoint}) after {attempts} attempts: {error}")
+                else:
+                    values = {"next_attempt_at": now + timedelta(seconds=self.backoff_seconds(attempts))}
+                    logger.warning(f"⚠️ Outbox email {row.id} ({row.endpoint}) failed, attempt {attempts}: {error}")
+                await session.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id == row.id)
+                    .values(attempts=attempts, last_error=str(error)[:1000], **values)
+                )
+
+            await session.commit()
+
+        if sent_ids:
+            logger.info(f"📧 Delivered {len(sent_ids)} outbox email(s)")
+
+    def backoff_seconds(self, attempts: int) -> float:
+        """Exponential backoff with jitter so retries from a burst spread out"""
+        delay = min(self.max_backoff_seconds, self.base_backoff_seconds * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+
+outbox_dispatcher = OutboxDispatcher()
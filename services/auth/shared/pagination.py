@@ -0,0 +1,146 @@
+"""Keyset pagination for tenant-scoped list endpoints.
+
+Pages are ordered by ``(created_at, id)`` within one organization and fetched
+with a row-value comparison against the last row seen, which the
+``(organization_id, created_at, id)`` indexes answer directly. Page 1,000
+therefore costs the same as page 1. One extra row is fetched to know whether
+another page exists, so no ``COUNT(*)`` is needed.
+
+Cursors are opaque to clients: the position, direction, sort order, table and
+organization are HMAC-signed. A cursor therefore can't be forged, can't be
+replayed against another tenant, and can't be reused with a different sort.
+
+    page = await paginate(session, Beneficiary, claims["org_id"], Beneficiary.is_active == True,
+                          cursor=cursor, limit=limit)
+    return page.to_dict(lambda b: {"id": b.id, ...})
+"""
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from sqlmodel import select
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 200))
+
+
+def _cursor_key() -> bytes:
+    return (os.getenv("PAGINATION_CURSOR_SECRET") or os.getenv("SECRET_KEY") or "").encode()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def encode_cursor(table: str, organization_id: int, created_at: datetime, row_id: int,
+                  backward: bool, descending: bool) -> str:
+    """Signed, URL-safe cursor pointing just past (created_at, row_id)"""
+    payload = json.dumps(
+        [table, organization_id, created_at.isoformat(), row_id, int(backward), int(descending)],
+        separators=(",", ":")
+    ).encode()
+    signature = hmac.new(_cursor_key(), payload, hashlib.sha256).digest()[:16]
+    return f"{_b64encode(payload)}.{_b64encode(signature)}"
+
+
+def decode_cursor(cursor: str, table: str, organization_id: int, descending: bool):
+    """Return (created_at, id, backward) or reject the cursor with 400"""
+    try:
+        encoded_payload, _, encoded_signature = cursor.partition(".")
+        payload = _b64decode(encoded_payload)
+        expected = hmac.new(_cursor_key(), payload, hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(expected, _b64decode(encoded_signature)):
+            raise ValueError("bad signature")
+        cursor_table, cursor_org, created_at, row_id, backward, cursor_descending = json.loads(payload)
+        if cursor_table != table or cursor_org != organization_id or bool(cursor_descending) != descending:
+            raise ValueError("cursor belongs to another listing")
+        return datetime.fromisoformat(created_at), int(row_id), bool(backward)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class Page:
+    def __init__(self, items: List[Any], next_cursor: Optional[str], prev_cursor: Optional[str], has_more: bool):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.has_more = has_more
+
+    def to_dict(self, serialize: Callable[[Any], Any] = lambda item: item) -> dict:
+        return {
+            "items": [serialize(item) for item in self.items],
+            "next_cursor": self.next_cursor,
+            "prev_cursor": self.prev_cursor,
+            "has_more": self.has_more,
+        }
+
+
+async def paginate(
+    session,
+    model,
+    organization_id: int,
+    *criteria,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    descending: bool = True
+) -> Page:
+    """One page of ``model`` rows for an organization, newest first by default.
+
+    ``next_cursor`` continues in the listing's order and ``prev_cursor`` walks
+    back towards the start; either is None when there is nothing that way.
+    ``has_more`` tells whether a next page exists.
+    """
+    table = model.__tablename__
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    sort_key = tuple_(model.created_at, model.id)
+
+    backward = False
+    query = select(model).where(model.organization_id == organization_id, *criteria)
+    if cursor:
+        created_at, row_id, backward = decode_cursor(cursor, table, organization_id, descending)
+        position = tuple_(created_at, row_id)
+        # Walking backward flips both the comparison and the scan direction
+        if descending != backward:
+            query = query.where(sort_key < position)
+        else:
+            query = query.where(sort_key > position)
+
+    if descending != backward:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at, model.id)
+
+    result = await session.execute(query.limit(limit + 1))
+    rows = list(result.scalars().all())
+    more_this_way = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    def cursor_for(row, towards_start: bool) -> str:
+        return encode_cursor(table, organization_id, row.created_at, row.id, towards_start, descending)
+
+    if backward:
+        # We came from the page after this one, so it always exists
+        has_more = bool(rows)
+        prev_available = more_this_way
+    else:
+        has_more = more_this_way
+        prev_available = cursor is not None
+
+    return Page(
+        items=rows,
+        next_cursor=cursor_for(rows[-1], False) if rows and has_more else None,
+        prev_cursor=cursor_for(rows[0], True) if rows and prev_available else None,
+        has_more=has_more,
+    )
@@ -3,7 +3,7 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
 
-from app.models import UserRole, OrganizationTier, ReportType, ReportFormat, FeedbackCategory
+from shared.models import UserRole, OrganizationTier, ReportType, ReportFormat, FeedbackCategory
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -218,4 +218,41 @@ class DataImportResponse(BaseModel):
     imported_count: int
     errors: List[str]
     total_rows: int
-    import_id: str
+    import_id: Optional[str] = None
+    status: Optional[str] = None
+    processed_rows: int = 0
+    error_count: int = 0
+
+class DuplicateCheckRequest(BaseModel):
+    name: str
+    contact_info: Optional[str] = None
+    age: Optional[int] = None
+    location: Optional[str] = None
+    exclude_id: Optional[int] = None
+
+class DuplicateReviewRequest(BaseModel):
+    status: str  # confirmed, rejected
+
+class VulnerabilityModelRequest(BaseModel):
+    factors: List[Dict[str, Any]]
+    thresholds: Dict[str, float] = {}  # level name -> minimum score (0-100)
+
+class SyncChange(BaseModel):
+    op: str  # upsert, delete
+    id: Optional[int] = None  # omitted for beneficiaries created offline
+    client_ref: Optional[str] = None  # device-assigned id, required for creates
+    base_seq: Optional[int] = None  # sync_seq the edit was made against
+    data: Dict[str, Any] = {}
+
+class HouseholdRequest(BaseModel):
+    name: Optional[str] = None
+    kind: str = "household"  # household, group
+    member_ids: List[int] = []
+
+class HouseholdMembersRequest(BaseModel):
+    member_ids: List[int]
+
+class BeneficiaryLinkRequest(BaseModel):
+    beneficiary_id: int
+    related_id: int
+    relation: str  # what related_id is to beneficiary_id
@@ -0,0 +1,197 @@
+"""Brute-force throttling for login and one-time-code endpoints.
+
+Failed attempts are counted in Redis per account, per client IP and per /24
+(/64 for IPv6) network using an approximate sliding window: a counter for the
+current fixed window plus a weighted share of the previous one. ``check`` reads
+every counter and lockout key in one MGET, so a throttled caller is rejected
+before any bcrypt work happens. Accounts that keep hitting their limit are
+locked out for exponentially longer periods.
+
+Redis errors fail open: throttling degrades, authentication keeps working.
+"""
+import ipaddress
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, Request, status
+from prometheus_client import Counter
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_REJECTIONS = Counter(
+    "auth_throttle_rejections_total",
+    "Requests rejected by the auth throttle before credential checks",
+    ["action", "scope"]
+)
+THROTTLE_FAILURES = Counter(
+    "auth_throttle_failures_total",
+    "Failed credential or code attempts recorded by the auth throttle",
+    ["action"]
+)
+THROTTLE_LOCKOUTS = Counter(
+    "auth_throttle_lockouts_total",
+    "Account lockouts started by the auth throttle",
+    ["action"]
+)
+THROTTLE_ERRORS = Counter(
+    "auth_throttle_errors_total",
+    "Redis errors in the auth throttle (requests were allowed through)"
+)
+
+# Failed attempts allowed per window, by action and scope
+DEFAULT_LIMITS = {
+    "login": {"account": 10, "ip": 50, "net": 200},
+    "verify_email": {"account": 5, "ip": 30, "net": 100},
+    "reset_password": {"account": 5, "ip": 30, "net": 100},
+}
+
+
+def client_ip(request: Request) -> str:
+    """Client address as seen by nginx, which overwrites X-Real-IP"""
+    real_ip = request.headers.get("x-real-ip")
+    if real_ip:
+        return real_ip.strip()
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        # nginx appends the peer address; earlier entries are client-controlled
+        return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def client_network(ip: str) -> str:
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+class Throttle:
+    def __init__(self):
+        self.enabled = os.getenv("AUTH_THROTTLE_ENABLED", "True").lower() == "true"
+        self.window_seconds = int(os.getenv("AUTH_THROTTLE_WINDOW_SECONDS", 900))
+        self.lockout_base_seconds = int(os.getenv("AUTH_LOCKOUT_BASE_SECONDS", 60))
+        self.lockout_max_seconds = int(os.getenv("AUTH_LOCKOUT_MAX_SECONDS", 24 * 60 * 60))
+        self.limits = DEFAULT_LIMITS
+        self._redis = redis.from_url(
+            os.getenv("REDIS_URL", "redis://redis:6379/0"),
+            socket_timeout=0.25,
+            socket_connect_timeout=0.25
+        )
+
+    def _scopes(self, request: Request, account: str) -> Dict[str, str]:
+        ip = client_ip(request)
+        return {"account": account.strip().lower(), "ip": ip, "net": client_network(ip)}
+
+    def _window_keys(self, action: str, scope: str, value: str, now: float) -> Tuple[str, str, float]:
+        window = int(now // self.window_seconds)
+        elapsed = (now % self.window_seconds) / self.window_seconds
+        base = f"throttle:{action}:{scope}:{value}"
+        return f"{base}:{window}", f"{base}:{window - 1}", elapsed
+
+    def _lock_key(self, action: str, account: str) -> str:
+        return f"throttle:{action}:lock:{account}"
+
+    async def check(self, action: str, request: Request, account: str):
+        """Reject with 429 if any scope is locked out or over its limit"""
+        if not self.enabled:
+            return
+        now = time.time()
+        scopes = self._scopes(request, account)
+
+        keys: List[str] = [self._lock_key(action, scopes["account"])]
+        weights: List[Tuple[str, float]] = []
+        for scope, value in scopes.items():
+            current, previous, elapsed = self._window_keys(action, scope, value, now)
+            keys += [current, previous]
+            weights.append((scope, elapsed))
+
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.mget(keys)
+            pipe.pttl(keys[0])
+            values, lock_ttl_ms = await pipe.execute()
+        except redis.RedisError as e:
+            THROTTLE_ERRORS.inc()
+            logger.warning(f"⚠️ Throttle check skipped, Redis unavailable: {e}")
+            return
+
+        if values[0] is not None:
+            THROTTLE_REJECTIONS.labels(action=action, scope="lockout").inc()
+            self._reject(max(lock_ttl_ms, 1000) / 1000)
+
+        for index, (scope, elapsed) in enumerate(weights):
+            current = int(values[1 + 2 * index] or 0)
+            previous = int(values[2 + 2 * index] or 0)
+            estimate = current + previous * (1 - elapsed)
+            if estimate >= self.limits[action][scope]:
+                THROTTLE_REJECTIONS.labels(action=action, scope=scope).inc()
+                self._reject(self.window_seconds * (1 - elapsed))
+
+    async def record_failure(self, action: str, request: Request, account: str):
+        """Count a failed attempt and lock the account out if it hit its limit"""
+        if not self.enabled:
+            return
+        THROTTLE_FAILURES.labels(action=action).inc()
+        now = time.time()
+        scopes = self._scopes(request, account)
+
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for scope, value in scopes.items():
+                current, previous, elapsed = self._window_keys(action, scope, value, now)
+                pipe.incr(current)
+                pipe.expire(current, self.window_seconds * 2)
+            results = await pipe.execute()
+
+            account_failures = int(results[0])
+            if account_failures >= self.limits[action]["account"]:
+                await self._lock_out(action, scopes["account"])
+        except redis.RedisError as e:
+            THROTTLE_ERRORS.inc()
+            logger.warning(f"⚠️ Throttle failure not recorded, Redis unavailable: {e}")
+
+    async def record_success(self, action: str, request: Request, account: str):
+        """Clear the account's failure count once it proves the credential"""
+        if not self.enabled:
+            return
+        now = time.time()
+        account = account.strip().lower()
+        current, previous, _ = self._window_keys(action, "account", account, now)
+        try:
+            await self._redis.delete(current, previous)
+        except redis.RedisError as e:
+            THROTTLE_ERRORS.inc()
+            logger.warning(f"⚠️ Throttle reset skipped, Redis unavailable: {e}")
+
+    async def _lock_out(self, action: str, account: str):
+        level_key = f"throttle:{action}:lockouts:{account}"
+        level = await self._redis.incr(level_key)
+        await self._redis.expire(level_key, self.lockout_max_seconds)
+
+        duration = min(self.lockout_base_seconds * (2 ** (level - 1)), self.lockout_max_seconds)
+        now = time.time()
+        current, previous, _ = self._window_keys(action, "account", account, now)
+
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._lock_key(action, account), level, ex=int(duration))
+        # Start the next lockout level with a clean window
+        pipe.delete(current, previous)
+        await pipe.execute()
+
+        THROTTLE_LOCKOUTS.labels(action=action).inc()
+        logger.warning(f"🔒 {action} locked for {account} for {int(duration)}s (lockout #{level})")
+
+    def _reject(self, retry_after: float):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(int(retry_after) + 1)}
+        )
+
+
+throttle = Throttle()
@@ -0,0 +1,149 @@
+"""Exact contact lookup and bulk re-keying of encrypted contact details.
+
+``contact_info`` is encrypted (``shared.pii``), so lookups match blind indexes
+through the (organization_id, contact_hash) and (organization_id, phone_hash)
+B-tree indexes. Candidates are decrypted and compared, which drops collisions
+of truncated hashes.
+
+``rekey_contacts`` streams beneficiaries in id order, ``CONTACT_REKEY_BATCH_SIZE``
+rows per transaction. It encrypts rows still in clear or under an old key, and
+fills in missing hashes. ``--all`` rewrites every row, which is needed after
+a blind index key rotation. Re-keying sets ``sync.rekey`` so sync clients
+don't see the rows as changed. After a blind index key rotation, run a dedup
+batch scan as well to rebuild the phone blocking keys.
+
+    python contacts.py rekey [--organization-id 3] [--all] [--dry-run]
+"""
+import argparse
+import logging
+import os
+import time
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal
+from shared.models import Beneficiary
+from shared.pii import (
+    CIPHERTEXT_PREFIX, blind_indexes, contact_hashes, current_key_id, decrypt, encrypt,
+    normalize_contact, normalize_phone,
+)
+
+logger = logging.getLogger(__name__)
+
+CONTACT_REKEY_BATCH_SIZE = int(os.getenv("CONTACT_REKEY_BATCH_SIZE", 2000))
+# Rows read per lookup before verification; collisions are rare even with short hashes
+LOOKUP_CANDIDATE_LIMIT = 1000
+MAX_LOOKUP_LIMIT = 100
+
+REKEY_WRITE = text("""
+    UPDATE beneficiaries b
+    SET contact_info = v.contact_info, contact_hash = v.contact_hash, phone_hash = v.phone_hash
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:contacts AS VARCHAR[]),
+                CAST(:contact_hashes AS VARCHAR[]), CAST(:phone_hashes AS VARCHAR[]))
+         AS v(id, contact_info, contact_hash, phone_hash)
+    WHERE b.id = v.id
+""")
+
+
+async def lookup_contacts(session, organization_id: int, contact: Optional[str] = None,
+                          phone: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """Active beneficiaries whose contact equals ``contact``, or holds phone number ``phone``"""
+    if phone is not None:
+        value, column, normalize = normalize_phone(phone), Beneficiary.phone_hash, normalize_phone
+    else:
+        value, column, normalize = normalize_contact(contact), Beneficiary.contact_hash, normalize_contact
+    if not value:
+        raise HTTPException(status_code=400, detail="Give a contact or a phone number with at least 7 digits")
+
+    rows = (await session.execute(
+        select(Beneficiary.id, Beneficiary.name, Beneficiary.contact_info, Beneficiary.age,
+               Beneficiary.gender, Beneficiary.location)
+        .where(Beneficiary.organization_id == organization_id, Beneficiary.is_active == True,
+               column.in_(blind_indexes(value)))
+        .order_by(Beneficiary.id)
+        .limit(LOOKUP_CANDIDATE_LIMIT)
+    )).all()
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "contact_info": row.contact_info,
+            "age": row.age,
+            "gender": row.gender,
+            "location": row.location,
+        }
+        for row in rows if normalize(row.contact_info) == value
+    ][:max(1, min(limit, MAX_LOOKUP_LIMIT))]
+
+
+def _stale_predicate(all_rows: bool) -> str:
+    if all_rows:
+        return "TRUE"
+    key_id = current_key_id()
+    if key_id is None:
+        return "contact_hash IS NULL"
+    return f"(contact_hash IS NULL OR contact_info NOT LIKE '{CIPHERTEXT_PREFIX}{key_id}:%')"
+
+
+async def rekey_contacts(organization_id: Optional[int] = None, all_rows: bool = False,
+                         batch_size: int = CONTACT_REKEY_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """Re-encrypt contacts under the current key and recompute their blind indexes"""
+    scope = "AND organization_id = :org_id " if organization_id is not None else ""
+    where = f"WHERE {_stale_predicate(all_rows)} {scope}"
+    if dry_run:
+        async with AsyncSessionLocal() as session:
+            pending = await session.scalar(
+                text(f"SELECT count(*) FROM beneficiaries {where}"), {"org_id": organization_id}
+            )
+        return {"pending": pending}
+
+    read = text(f"SELECT id, contact_info FROM beneficiaries {where}AND id > :after ORDER BY id LIMIT :batch_size")
+    summary = {"rows": 0, "batches": 0, "seconds": 0.0}
+    start, after = time.perf_counter(), 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                read, {"org_id": organization_id, "after": after, "batch_size": batch_size}
+            )).all()
+            if not rows:
+                break
+            ids, contacts, contact_digests, phone_digests = [], [], [], []
+            for row in rows:
+                plaintext = decrypt(row.contact_info)
+                hashes = contact_hashes(plaintext)
+                ids.append(row.id)
+                contacts.append(encrypt(plaintext))
+                contact_digests.append(hashes["contact_hash"])
+                phone_digests.append(hashes["phone_hash"])
+            await session.execute(text("SELECT set_config('sync.rekey', 'on', true)"))
+            await session.execute(REKEY_WRITE, {
+                "ids": ids, "contacts": contacts, "contact_hashes": contact_digests, "phone_hashes": phone_digests,
+            })
+            await session.commit()
+        after = rows[-1].id
+        summary["rows"] += len(rows)
+        summary["batches"] += 1
+        if summary["batches"] % 50 == 0:
+            logger.info(f"🔑 Re-keyed {summary['rows']} contacts (last id {after})")
+
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    logger.info(f"✅ Contact re-key finished: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    from shared.database import run_script
+
+    parser = argparse.ArgumentParser(description="Encrypted contact maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rekey = commands.add_parser("rekey", help="encrypt contacts under the current key and fill blind indexes")
+    rekey.add_argument("--organization-id", type=int)
+    rekey.add_argument("--all", action="store_true", help="rewrite every row, e.g. after a blind index key change")
+    rekey.add_argument("--batch-size", type=int, default=CONTACT_REKEY_BATCH_SIZE)
+    rekey.add_argument("--dry-run", action="store_true", help="only count rows that need re-keying")
+    args = parser.parse_args()
+
+    run_script(rekey_contacts(args.organization_id, args.all, args.batch_size, args.dry_run))
@@ -0,0 +1,371 @@
+"""Duplicate detection for beneficiaries, using blocking keys.
+
+Comparing every pair of beneficiaries is O(n²). Instead each beneficiary gets
+a few blocking keys, and only beneficiaries sharing a key are compared:
+- ``n:`` phonetic (Soundex) codes of the first and last name tokens, order-insensitive
+- ``p:`` the blind index of the normalized phone number (last 9 digits), so
+  the key table holds no phone numbers
+- ``l:`` normalized location, estimated birth year and a name initial
+
+Candidate pairs are scored with a weighted similarity model. Jaro-Winkler is
+used on names and locations, with exact phone equality and age distance.
+Pairs above ``DEDUP_MATCH_THRESHOLD`` are grouped into clusters with
+union-find.
+
+Two modes share the ``beneficiary_block_keys`` index:
+- incremental: ``find_matches`` looks up one registration's keys through the
+  primary key index and scores a handful of candidates, in milliseconds
+- batch: ``DedupScanner.scan`` streams the whole organization, rebuilds the
+  index and replaces the pending ``duplicate_matches``
+
+Blocks larger than ``DEDUP_MAX_BLOCK_SIZE`` (very common names) are skipped in
+batch mode, so the work stays close to linear.
+"""
+import logging
+import os
+import re
+import time
+import unicodedata
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, delete, insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+
+from shared.bulk import BulkWriter
+from shared.database import AsyncSessionLocal
+from shared.models import Beneficiary, BeneficiaryBlockKey, DuplicateMatch, DuplicateMatchStatus
+from shared.pii import blind_index, normalize_phone
+from shared.tasks import OrganizationTaskRunner
+from union_find import UnionFind
+
+try:
+    from rapidfuzz.distance import JaroWinkler as _RapidJaroWinkler
+except ImportError:  # pure-Python fallback below
+    _RapidJaroWinkler = None
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MATCH_THRESHOLD = float(os.getenv("DEDUP_MATCH_THRESHOLD", 0.85))
+DEDUP_MAX_BLOCK_SIZE = int(os.getenv("DEDUP_MAX_BLOCK_SIZE", 500))
+DEDUP_MAX_CANDIDATES = int(os.getenv("DEDUP_MAX_CANDIDATES", 1000))
+DEDUP_BATCH_SIZE = int(os.getenv("DEDUP_BATCH_SIZE", 10000))
+WEIGHTS = {"name": 0.5, "contact": 0.25, "age": 0.1, "location": 0.15}
+AGE_TOLERANCE = 5
+
+_NON_ALNUM = re.compile(r"[^a-z0-9 ]+")
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"), **dict.fromkeys("dt", "3"),
+    "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+
+# ==================== NORMALIZATION ====================
+
+def normalize_text(value: Optional[str]) -> str:
+    """Lowercase ASCII words: accents stripped, punctuation dropped"""
+    if not value:
+        return ""
+    ascii_text = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode()
+    return " ".join(_NON_ALNUM.sub(" ", ascii_text.lower()).split())
+
+
+def soundex(word: str) -> str:
+    if not word:
+        return ""
+    if word[0].isdigit():
+        return word[:4]
+    code, previous = word[0].upper(), _SOUNDEX_CODES.get(word[0], "")
+    for ch in word[1:]:
+        digit = _SOUNDEX_CODES.get(ch, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if ch not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def _jaro_winkler(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    a_matched, b_matched = [False] * len(a), [False] * len(b)
+    matches = 0
+    for i, ch in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == ch:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    transpositions, j = 0, 0
+    for i, ch in enumerate(a):
+        if a_matched[i]:
+            while not b_matched[j]:
+                j += 1
+            transpositions += ch != b[j]
+            j += 1
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions / 2) / matches) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    if _RapidJaroWinkler is not None:
+        return _RapidJaroWinkler.similarity(a, b)
+    return _jaro_winkler(a, b)
+
+
+# ==================== KEYS AND SCORING ====================
+
+class DedupRecord:
+    __slots__ = ("id", "name", "sorted_name", "phone", "age", "location", "birth_year")
+
+    def __init__(self, id: Optional[int], name: str, contact_info: Optional[str], age: Optional[int],
+                 location: Optional[str], registered_at: Optional[datetime] = None):
+        self.id = id
+        self.name = normalize_text(name)
+        self.sorted_name = " ".join(sorted(self.name.split()))
+        self.phone = normalize_phone(contact_info)
+        self.age = age
+        self.location = normalize_text(location)
+        year = (registered_at or datetime.utcnow()).year
+        self.birth_year = year - age if age is not None else None
+
+    @classmethod
+    def from_row(cls, row) -> "DedupRecord":
+        return cls(row.id, row.name, row.contact_info, row.age, row.location, row.created_at)
+
+
+def block_keys(record: DedupRecord) -> Set[str]:
+    keys = set()
+    tokens = record.name.split()
+    if tokens:
+        first, last = soundex(tokens[0]), soundex(tokens[-1])
+        keys.add("n:" + "".join(sorted({first, last})))
+    if record.phone:
+        keys.add("p:" + blind_index(record.phone))
+    if record.location and record.birth_year is not None and tokens:
+        # Large settlements need the initial to keep blocks small; the smallest
+        # initial survives swapped name order. Ages recorded a year apart still
+        # share one of the two keys.
+        initial = min(tokens)[0]
+        keys.add(f"l:{record.location}:{record.birth_year}:{initial}")
+        keys.add(f"l:{record.location}:{record.birth_year + 1}:{initial}")
+    return keys
+
+
+def score(a: DedupRecord, b: DedupRecord) -> float:
+    """Weighted similarity in [0, 1]; fields missing on either side don't count"""
+    parts = {
+        "name": max(jaro_winkler(a.name, b.name), jaro_winkler(a.sorted_name, b.sorted_name)),
+    }
+    if a.phone and b.phone:
+        parts["contact"] = 1.0 if a.phone == b.phone else 0.0
+    if a.age is not None and b.age is not None:
+        difference = abs(a.birth_year - b.birth_year)
+        parts["age"] = max(0.0, 1 - difference / AGE_TOLERANCE)
+    if a.location and b.location:
+        parts["location"] = jaro_winkler(a.location, b.location)
+    weight = sum(WEIGHTS[field] for field in parts)
+    return sum(WEIGHTS[field] * value for field, value in parts.items()) / weight
+
+
+# ==================== INCREMENTAL ====================
+
+async def find_matches(
+    session,
+    organization_id: int,
+    name: str,
+    contact_info: Optional[str] = None,
+    age: Optional[int] = None,
+    location: Optional[str] = None,
+    exclude_id: Optional[int] = None,
+    limit: int = 10
+) -> List[Tuple[Beneficiary, float]]:
+    """Existing beneficiaries that look like this registration, best first"""
+    record = DedupRecord(exclude_id, name, contact_info, age, location)
+    keys = block_keys(record)
+    if not keys:
+        return []
+
+    candidate_ids = (
+        select(BeneficiaryBlockKey.beneficiary_id)
+        .where(BeneficiaryBlockKey.organization_id == organization_id, BeneficiaryBlockKey.block_key.in_(keys))
+        .distinct()
+        .limit(DEDUP_MAX_CANDIDATES)
+    )
+    query = select(Beneficiary).where(Beneficiary.id.in_(candidate_ids), Beneficiary.is_active == True)
+    if exclude_id is not None:
+        query = query.where(Beneficiary.id != exclude_id)
+    candidates = (await session.execute(query)).scalars().all()
+
+    matches = []
+    for beneficiary in candidates:
+        similarity = score(record, DedupRecord.from_row(beneficiary))
+        if similarity >= DEDUP_MATCH_THRESHOLD:
+            matches.append((beneficiary, round(similarity, 4)))
+    matches.sort(key=lambda match: -match[1])
+    return matches[:limit]
+
+
+async def index_beneficiaries(session, organization_id: int, rows: Iterable) -> int:
+    """Add blocking keys for new or edited beneficiaries; the caller commits"""
+    rows = list(rows)
+    if not rows:
+        return 0
+    await session.execute(
+        delete(BeneficiaryBlockKey).where(BeneficiaryBlockKey.beneficiary_id.in_([row.id for row in rows]))
+    )
+    values = [
+        {"organization_id": organization_id, "block_key": key, "beneficiary_id": row.id}
+        for row in rows for key in block_keys(DedupRecord.from_row(row))
+    ]
+    if values:
+        await session.execute(pg_insert(BeneficiaryBlockKey).on_conflict_do_nothing(), values)
+    return len(values)
+
+
+# ==================== BATCH ====================
+
+def _candidate_pairs(blocks: Dict[str, List[int]]) -> Tuple[Set[Tuple[int, int]], int]:
+    pairs: Set[Tuple[int, int]] = set()
+    skipped = 0
+    for ids in blocks.values():
+        if len(ids) > DEDUP_MAX_BLOCK_SIZE:
+            skipped += 1
+            continue
+        pairs.update(combinations(sorted(ids), 2))
+    return pairs, skipped
+
+
+def _score_pairs(records: Dict[int, DedupRecord], pairs: Iterable[Tuple[int, int]]) -> List[Tuple[int, int, float]]:
+    matches = []
+    for a, b in pairs:
+        similarity = score(records[a], records[b])
+        if similarity >= DEDUP_MATCH_THRESHOLD:
+            matches.append((a, b, round(similarity, 4)))
+    return matches
+
+
+class DedupScanner(OrganizationTaskRunner):
+    """Batch duplicate scans in the background, one at a time per organization"""
+
+    description = "Duplicate scan"
+
+    async def run(self, organization_id: int) -> dict:
+        return await self.scan(organization_id)
+
+    async def scan(self, organization_id: int) -> dict:
+        """Rebuild the blocking index and pending matches for one organization"""
+        started = time.perf_counter()
+        records: Dict[int, DedupRecord] = {}
+        blocks: Dict[str, List[int]] = {}
+
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(
+                select(Beneficiary.id, Beneficiary.name, Beneficiary.contact_info, Beneficiary.age,
+                       Beneficiary.location, Beneficiary.created_at)
+                .where(Beneficiary.organization_id == organization_id, Beneficiary.is_active == True)
+                .execution_options(yield_per=DEDUP_BATCH_SIZE)
+            )
+            async for batch in result.partitions():
+                for row in batch:
+                    record = DedupRecord.from_row(row)
+                    records[row.id] = record
+                    for key in block_keys(record):
+                        blocks.setdefault(key, []).append(row.id)
+
+        # Insert-only refresh: keys of unchanged rows are identical, so the
+        # incremental index stays usable while the scan runs
+        await BulkWriter(
+            BeneficiaryBlockKey,
+            conflict_columns=["organization_id", "block_key", "beneficiary_id"],
+            update_columns=[],
+            batch_size=DEDUP_BATCH_SIZE * 5
+        ).write(
+            {"organization_id": organization_id, "block_key": key, "beneficiary_id": beneficiary_id}
+            for key, ids in blocks.items() for beneficiary_id in ids
+        )
+
+        pairs, skipped_blocks = await run_in_threadpool(_candidate_pairs, blocks)
+        del blocks
+        matches = await run_in_threadpool(_score_pairs, records, pairs)
+        candidate_count = len(pairs)
+        del pairs
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                delete(DuplicateMatch).where(
+                    DuplicateMatch.organization_id == organization_id,
+                    DuplicateMatch.status == DuplicateMatchStatus.PENDING
+                )
+            )
+            reviewed = {
+                (row.beneficiary_id, row.duplicate_id): row
+                for row in await session.execute(
+                    select(DuplicateMatch.id, DuplicateMatch.beneficiary_id, DuplicateMatch.duplicate_id,
+                           DuplicateMatch.status, DuplicateMatch.cluster_id)
+                    .where(DuplicateMatch.organization_id == organization_id)
+                )
+            }
+            confirmed = [row for row in reviewed.values() if row.status == DuplicateMatchStatus.CONFIRMED]
+
+            # Confirmed pairs hold clusters together; rejected ones never come back
+            clusters = UnionFind()
+            clusters.union_all((row.beneficiary_id, row.duplicate_id) for row in confirmed)
+            new_matches = [match for match in matches if (match[0], match[1]) not in reviewed]
+            clusters.union_all((a, b) for a, b, _ in new_matches)
+            labels = clusters.labels()
+
+            now = datetime.utcnow()
+            for offset in range(0, len(new_matches), DEDUP_BATCH_SIZE):
+                await session.execute(insert(DuplicateMatch), [
+                    {
+                        "organization_id": organization_id, "beneficiary_id": a, "duplicate_id": b,
+                        "score": similarity, "cluster_id": labels[a],
+                        "status": DuplicateMatchStatus.PENDING, "created_at": now,
+                    }
+                    for a, b, similarity in new_matches[offset:offset + DEDUP_BATCH_SIZE]
+                ])
+            moved = [
+                {"match_id": row.id, "new_cluster_id": labels[row.beneficiary_id]}
+                for row in confirmed if row.cluster_id != labels[row.beneficiary_id]
+            ]
+            if moved:
+                matches_table = DuplicateMatch.__table__
+                await session.execute(
+                    update(matches_table)
+                    .where(matches_table.c.id == bindparam("match_id"))
+                    .values(cluster_id=bindparam("new_cluster_id")),
+                    moved
+                )
+            await session.commit()
+
+        summary = {
+            "status": "completed",
+            "beneficiaries": len(records),
+            "candidate_pairs": candidate_count,
+            "skipped_blocks": skipped_blocks,
+            "matches": len(new_matches),
+            "clusters": len({labels[a] for a, _, _ in new_matches}),
+            "seconds": round(time.perf_counter() - started, 1),
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+        logger.info(f"🔍 Duplicate scan for organization {organization_id}: {summary}")
+        return summary
+
+
+dedup_scanner = DedupScanner()
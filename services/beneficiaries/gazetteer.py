@@ -0,0 +1,350 @@
+"""Admin-boundary gazetteer, location matching and per-node rollups.
+
+The gazetteer is a local CSV with one row per boundary, loaded into
+``location_nodes``:
+
+    code,name,level,parent_code,alt_names
+    KE,Kenya,country,,
+    KE-43,Turkana,admin1,KE,
+    KE-43-04,Turkana West,admin2,KE-43,
+    KE-43-04-01,Kakuma,settlement,KE-43-04,Kakuma Camp;Kakuma Refugee Camp
+
+Free-text ``location`` values are matched against node names and alt names
+when beneficiaries are written: exact normalized names first, then the
+closest name above ``LOCATION_MATCH_THRESHOLD``. Values like
+"Kakuma, Turkana" are split on , / > | and the other parts pick between
+nodes with the same name by their ancestors. Ambiguous values stay unmatched.
+The matcher reloads the nodes at the start of every import job.
+
+``location_rollups`` holds active beneficiary counts per organization, node,
+gender and age band, including every descendant. Statement-level triggers
+(migration 14) keep it current for every write path, including COPY imports,
+so a breakdown reads one row group per child node.
+
+    python gazetteer.py load gazetteer.csv
+    python gazetteer.py attach [--organization-id 3]
+    python gazetteer.py rebuild-rollups [--organization-id 3]
+"""
+import argparse
+import csv
+import logging
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal
+from shared.migrations import LOCATION_ROLLUP_UPSERT
+from shared.models import Beneficiary, LocationNode
+from dedup import normalize_text
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:  # pragma: no cover - optional speedup
+    process = None
+    import difflib
+
+logger = logging.getLogger(__name__)
+
+LOCATION_MATCH_THRESHOLD = float(os.getenv("LOCATION_MATCH_THRESHOLD", 0.85))
+LOCATION_FUZZY_CANDIDATES = int(os.getenv("LOCATION_FUZZY_CANDIDATES", 5))
+LOCATION_SCOPED_THRESHOLD = float(os.getenv("LOCATION_SCOPED_THRESHOLD", 0.7))
+LOCATION_CACHE_SIZE = int(os.getenv("LOCATION_CACHE_SIZE", 100000))
+LOCATION_RELOAD_SECONDS = int(os.getenv("LOCATION_RELOAD_SECONDS", 300))
+LOCATION_BATCH_SIZE = int(os.getenv("LOCATION_BATCH_SIZE", 5000))
+LEVELS = {"country": 0, "admin1": 1, "admin2": 2, "settlement": 3}
+
+_SEPARATORS = re.compile(r"[,/>|]")
+
+WRITE_LOCATION_IDS = text("""
+    UPDATE beneficiaries AS b SET location_id = v.location_id
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:location_ids AS INTEGER[])) AS v(id, location_id)
+    WHERE b.id = v.id
+""")
+
+WRITE_NODE_PATHS = text("""
+    UPDATE location_nodes AS n SET parent_id = v.parent_id, path = v.path
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:parent_ids AS INTEGER[]), CAST(:paths AS VARCHAR[]))
+        AS v(id, parent_id, path)
+    WHERE n.id = v.id AND (n.parent_id IS DISTINCT FROM v.parent_id OR n.path <> v.path)
+""")
+
+BREAKDOWN_QUERY = """
+    SELECT n.id, n.code, n.name, n.level, r.gender, r.age_band, r.count
+    FROM location_nodes n
+    JOIN location_rollups r ON r.location_id = n.id AND r.organization_id = :org_id
+    WHERE {parent} AND r.count > 0
+    ORDER BY n.name, n.id
+"""
+
+
+# ==================== MATCHING ====================
+
+def _similarity(a: str, b: str) -> float:
+    if process is not None:
+        return fuzz.ratio(a, b) / 100
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+class LocationMatcher:
+    """In-memory index of location_nodes for matching free-text locations"""
+
+    def __init__(self):
+        self._nodes: Dict[int, Tuple[int, List[int]]] = {}  # id -> (level, ancestor ids)
+        self._names: Dict[int, Set[str]] = {}
+        self._by_name: Dict[str, List[int]] = {}
+        self._children: Dict[int, List[int]] = {}
+        self._keys: List[str] = []
+        self._loaded_at: Optional[float] = None
+        self.match = lru_cache(maxsize=LOCATION_CACHE_SIZE)(self._resolve)
+
+    async def load(self):
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(LocationNode.id, LocationNode.name, LocationNode.alt_names,
+                       LocationNode.level, LocationNode.path)
+            )).all()
+        self.index(rows)
+        self._loaded_at = time.monotonic()
+        logger.info(f"🗺️ Location matcher loaded {len(rows)} gazetteer nodes")
+
+    async def refresh(self):
+        """Reload when older than LOCATION_RELOAD_SECONDS; for small, frequent writes"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > LOCATION_RELOAD_SECONDS:
+            await self.load()
+
+    def index(self, rows):
+        nodes, names, by_name, children = {}, {}, {}, {}
+        for row in rows:
+            ancestors = [int(part) for part in row.path.split("/") if part and int(part) != row.id]
+            nodes[row.id] = (row.level, ancestors)
+            if ancestors:
+                children.setdefault(ancestors[-1], []).append(row.id)
+            names[row.id] = {normalize_text(name) for name in [row.name, *(row.alt_names or [])]} - {""}
+            for name in names[row.id]:
+                by_name.setdefault(name, []).append(row.id)
+        self._nodes, self._names, self._by_name, self._children = nodes, names, by_name, children
+        self._keys = list(by_name)
+        self.match.cache_clear()
+
+    def _candidates(self, part: str) -> List[Tuple[int, float]]:
+        if part in self._by_name:
+            return [(node_id, 1.0) for node_id in self._by_name[part]]
+        # A few close names, so ancestors in the rest of the value can pick the right one
+        if process is not None:
+            close = [
+                (key, similarity / 100) for key, similarity, _ in process.extract(
+                    part, self._keys, scorer=fuzz.ratio, limit=LOCATION_FUZZY_CANDIDATES,
+                    score_cutoff=LOCATION_MATCH_THRESHOLD * 100
+                )
+            ]
+        else:
+            close = [
+                (key, difflib.SequenceMatcher(None, part, key).ratio())
+                for key in difflib.get_close_matches(part, self._keys, n=LOCATION_FUZZY_CANDIDATES,
+                                                     cutoff=LOCATION_MATCH_THRESHOLD)
+            ]
+        return [(node_id, similarity) for key, similarity in close for node_id in self._by_name[key]]
+
+    def _closest_child(self, part: str, parent_id: int) -> Optional[Tuple[int, float]]:
+        best = None
+        for child_id in self._children.get(parent_id, []):
+            for name in self._names[child_id]:
+                similarity = _similarity(part, name)
+                if similarity >= LOCATION_SCOPED_THRESHOLD and (not best or similarity > best[1]):
+                    best = (child_id, similarity)
+        return best
+
+    def _resolve(self, value: Optional[str]) -> Optional[int]:
+        parts = [normalize_text(part) for part in _SEPARATORS.split(value or "")]
+        parts = [part for part in parts if part]
+        if not parts or not self._nodes:
+            return None
+
+        ranked, unmatched = {}, []
+        for part in parts:
+            others = [other for other in parts if other != part]
+            candidates = self._candidates(part)
+            if not candidates:
+                unmatched.append(part)
+            for node_id, similarity in candidates:
+                level, ancestors = self._nodes[node_id]
+                ancestor_names = set().union(*(self._names[a] for a in ancestors)) if ancestors else set()
+                support = sum(1 for other in others if other in ancestor_names)
+                # Ancestor agreement first, then closeness, then the most specific level
+                rank = (support, round(similarity, 3), level)
+                ranked[node_id] = max(rank, ranked.get(node_id, rank))
+        # "Kakumaa, Turkana West": a looser match among the children of a matched parent
+        for part in unmatched:
+            for parent_id, (support, _, _) in list(ranked.items()):
+                child = self._closest_child(part, parent_id)
+                if child:
+                    rank = (support + 1, round(child[1], 3), self._nodes[child[0]][0])
+                    ranked[child[0]] = max(rank, ranked.get(child[0], rank))
+        if not ranked:
+            return None
+        ordered = sorted(ranked.items(), key=lambda item: item[1], reverse=True)
+        if len(ordered) > 1 and ordered[0][1] == ordered[1][1]:
+            return None
+        return ordered[0][0]
+
+    def attach(self, records: List[dict]):
+        """Set location_id on write-ready beneficiary records"""
+        for record in records:
+            record["location_id"] = self.match(record.get("location"))
+
+
+location_matcher = LocationMatcher()
+
+
+# ==================== LOADING AND MAINTENANCE ====================
+
+def read_gazetteer(csv_path: str) -> List[dict]:
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        rows = []
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            level = (row.get("level") or "").strip().lower()
+            if level not in LEVELS and not level.isdigit():
+                raise ValueError(f"Line {line}: unknown level {row.get('level')!r}")
+            rows.append({
+                "code": row["code"].strip(),
+                "name": row["name"].strip(),
+                "level": LEVELS.get(level, int(level) if level.isdigit() else 0),
+                "parent_code": (row.get("parent_code") or "").strip() or None,
+                "alt_names": [name.strip() for name in (row.get("alt_names") or "").split(";") if name.strip()],
+            })
+    return sorted(rows, key=lambda row: row["level"])
+
+
+async def load_gazetteer(csv_path: str) -> dict:
+    """Upsert gazetteer nodes by code and recompute parents and paths"""
+    rows = await run_in_threadpool(read_gazetteer, csv_path)
+    codes = {row["code"] for row in rows}
+    missing = {row["parent_code"] for row in rows if row["parent_code"] and row["parent_code"] not in codes}
+    if missing:
+        raise ValueError(f"Unknown parent codes: {', '.join(sorted(missing)[:10])}")
+
+    async with AsyncSessionLocal() as session:
+        previous = dict((await session.execute(select(LocationNode.id, LocationNode.path))).all())
+        ids: Dict[str, int] = {}
+        for start in range(0, len(rows), LOCATION_BATCH_SIZE):
+            batch = [
+                {key: row[key] for key in ("code", "name", "level", "alt_names")}
+                for row in rows[start:start + LOCATION_BATCH_SIZE]
+            ]
+            statement = pg_insert(LocationNode).values(batch)
+            statement = statement.on_conflict_do_update(
+                index_elements=["code"],
+                set_={key: statement.excluded[key] for key in ("name", "level", "alt_names")}
+            ).returning(LocationNode.id, LocationNode.code)
+            ids.update({code: node_id for node_id, code in (await session.execute(statement)).all()})
+
+        # Rows are sorted by level, so parents get their paths first
+        paths: Dict[str, str] = {}
+        parent_ids = []
+        for row in rows:
+            parent = row["parent_code"]
+            paths[row["code"]] = f"{paths[parent]}/{ids[row['code']]}" if parent else str(ids[row["code"]])
+            parent_ids.append(ids[parent] if parent else None)
+        await session.execute(WRITE_NODE_PATHS, {
+            "ids": [ids[row["code"]] for row in rows],
+            "parent_ids": parent_ids,
+            "paths": [paths[row["code"]] for row in rows],
+        })
+        await session.commit()
+
+    moved = sum(1 for row in rows if previous.get(ids[row["code"]]) not in (None, "", paths[row["code"]]))
+    if moved:
+        # Counts were added to the old ancestors
+        logger.warning(f"⚠️ {moved} gazetteer nodes moved in the hierarchy, rebuilding location rollups")
+        await rebuild_rollups()
+    return {"nodes": len(rows), "new": sum(1 for node_id in ids.values() if node_id not in previous), "moved": moved}
+
+
+async def attach_locations(organization_id: Optional[int] = None) -> dict:
+    """Backfill location_id for beneficiaries that don't have one yet"""
+    await location_matcher.load()
+    started = time.perf_counter()
+    matched = unmatched = 0
+    last_id = 0
+    while True:
+        query = select(Beneficiary.id, Beneficiary.location).where(
+            Beneficiary.location_id.is_(None), Beneficiary.location.is_not(None), Beneficiary.id > last_id
+        )
+        if organization_id is not None:
+            query = query.where(Beneficiary.organization_id == organization_id)
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(query.order_by(Beneficiary.id).limit(LOCATION_BATCH_SIZE))).all()
+            if not rows:
+                break
+            location_ids = await run_in_threadpool(lambda: [location_matcher.match(row.location) for row in rows])
+            found = [(row.id, location_id) for row, location_id in zip(rows, location_ids) if location_id]
+            if found:
+                await session.execute(WRITE_LOCATION_IDS, {
+                    "ids": [row_id for row_id, _ in found],
+                    "location_ids": [location_id for _, location_id in found],
+                })
+                await session.commit()
+        matched += len(found)
+        unmatched += len(rows) - len(found)
+        last_id = rows[-1].id
+    return {"matched": matched, "unmatched": unmatched, "seconds": round(time.perf_counter() - started, 2)}
+
+
+async def rebuild_rollups(organization_id: Optional[int] = None):
+    """Recount location_rollups from beneficiaries; writers wait for the rebuild"""
+    scope = "organization_id = :org_id AND " if organization_id is not None else ""
+    async with AsyncSessionLocal() as session:
+        await session.execute(text("LOCK TABLE beneficiaries IN SHARE MODE"))
+        await session.execute(
+            text(f"DELETE FROM location_rollups{' WHERE organization_id = :org_id' if scope else ''}"),
+            {"org_id": organization_id}
+        )
+        await session.execute(text(LOCATION_ROLLUP_UPSERT.format(deltas=(
+            f"SELECT organization_id, location_id, gender, age, 1 AS delta FROM beneficiaries "
+            f"WHERE {scope}is_active AND location_id IS NOT NULL"
+        ))), {"org_id": organization_id})
+        await session.commit()
+    logger.info(f"✅ Location rollups rebuilt for {f'organization {organization_id}' if scope else 'all organizations'}")
+
+
+async def location_breakdown(session, organization_id: int, parent_id: Optional[int]) -> List[dict]:
+    """Child nodes of ``parent_id`` (top level when None) with counts by gender and age band"""
+    children: Dict[int, dict] = {}
+    # Separate predicates so both use the parent_id index
+    parent = "n.parent_id IS NULL" if parent_id is None else "n.parent_id = :parent_id"
+    query = text(BREAKDOWN_QUERY.format(parent=parent))
+    for row in await session.execute(query, {"org_id": organization_id, "parent_id": parent_id}):
+        child = children.setdefault(row.id, {
+            "id": row.id, "code": row.code, "name": row.name, "level": row.level,
+            "total": 0, "by_gender": {}, "by_age_band": {},
+        })
+        child["total"] += row.count
+        child["by_gender"][row.gender] = child["by_gender"].get(row.gender, 0) + row.count
+        child["by_age_band"][row.age_band] = child["by_age_band"].get(row.age_band, 0) + row.count
+    return list(children.values())
+
+
+if __name__ == "__main__":
+    from shared.database import run_script
+
+    parser = argparse.ArgumentParser(description="Gazetteer loading and location maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("load", help="load or update location_nodes from a gazetteer CSV").add_argument("csv_path")
+    for name, help_text in (("attach", "match beneficiaries without a location_id"),
+                            ("rebuild-rollups", "recount location_rollups")):
+        commands.add_parser(name, help=help_text).add_argument("--organization-id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "load":
+        run_script(load_gazetteer(args.csv_path))
+    elif args.command == "attach":
+        run_script(attach_locations(args.organization_id))
+    else:
+        run_script(rebuild_rollups(args.organization_id))
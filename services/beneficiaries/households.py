@@ -0,0 +1,434 @@
+"""Households, groups and typed links between beneficiaries.
+
+Each beneficiary belongs to at most one household (``households.kind`` is
+household or group). Both "everyone in this household" and "households in
+this location" are index range scans: (organization_id, household_id) on
+beneficiaries and (organization_id, location_id, id) on households. A
+household's location is the most common location of its members.
+
+Households come from two places:
+- manual: created and edited through the API; their membership is fixed
+- linked: derived by ``assign_households``. Beneficiaries joined by a
+  household-forming link (``HOUSEHOLD_RELATIONS``) or sharing an imported
+  ``household_ref`` form connected components (union-find over the edges). A
+  component containing a manual household joins it. Otherwise it keeps the
+  linked household most of its members already had, or gets a new one.
+
+The batch streams the organization's edges once and resolves components in
+memory, so 1M links take seconds. Imports with a household column queue a run
+when they finish.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, or_, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal, db_router
+from shared.models import Beneficiary, BeneficiaryLink, Household, LocationNode
+from shared.schemas import BeneficiaryLinkRequest, HouseholdRequest
+from shared.tasks import OrganizationTaskRunner
+from union_find import UnionFind
+
+logger = logging.getLogger(__name__)
+
+HOUSEHOLD_BATCH_SIZE = int(os.getenv("HOUSEHOLD_BATCH_SIZE", 10000))
+MAX_LINKS_PER_REQUEST = 1000
+MAX_MEMBERS_PER_REQUEST = 1000
+MAX_LIST_LIMIT = 500
+
+HOUSEHOLD_KINDS = {"household", "group"}
+# Relations that put both beneficiaries in the same household
+HOUSEHOLD_RELATIONS = {"spouse", "parent", "child", "sibling", "caregiver", "dependant", "household_member"}
+RELATIONS = HOUSEHOLD_RELATIONS | {"relative", "other"}
+
+# Member count and most common member location, for all or some households.
+# Read and written separately: right after a bulk assignment the planner's
+# statistics still show household_id as all NULL, and joining the aggregate
+# back to households in one UPDATE then picks a nested loop that rescans it
+# for every household.
+HOUSEHOLD_STATS = """
+    SELECT household_id, count(*) AS members, mode() WITHIN GROUP (ORDER BY location_id) AS location_id
+    FROM beneficiaries
+    WHERE organization_id = :org_id AND household_id IS NOT NULL AND is_active {members}
+    GROUP BY household_id
+"""
+WRITE_HOUSEHOLD_STATS = text("""
+    UPDATE households h SET member_count = v.member_count, location_id = v.location_id, updated_at = :now
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:member_counts AS INTEGER[]), CAST(:location_ids AS INTEGER[]))
+         AS v(id, member_count, location_id)
+    WHERE h.id = v.id
+""")
+
+# Arrays keep the bind count at four however many households a batch creates
+CREATE_HOUSEHOLDS = text("""
+    INSERT INTO households (organization_id, kind, source, anchor_id, member_count, created_at, updated_at)
+    SELECT :org_id, 'household', 'linked', v.anchor_id, v.member_count, :now, :now
+    FROM unnest(CAST(:anchor_ids AS INTEGER[]), CAST(:member_counts AS INTEGER[])) AS v(anchor_id, member_count)
+    RETURNING id, anchor_id
+""")
+MOVE_MEMBERS = text("""
+    UPDATE beneficiaries b SET household_id = v.household_id
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:household_ids AS INTEGER[])) AS v(id, household_id)
+    WHERE b.id = v.id
+""")
+
+
+def household_response(household: Household) -> dict:
+    return {
+        "id": household.id,
+        "name": household.name,
+        "kind": household.kind,
+        "source": household.source,
+        "location_id": household.location_id,
+        "member_count": household.member_count,
+        "created_at": household.created_at.isoformat(),
+        "updated_at": household.updated_at.isoformat(),
+    }
+
+
+async def refresh_households(session, organization_id: int, household_ids: Optional[List[int]] = None):
+    """Recompute member_count and location_id, writing only households that changed"""
+    members, households = "", [Household.organization_id == organization_id]
+    if household_ids is not None:
+        household_ids = [hid for hid in set(household_ids) if hid is not None]
+        if not household_ids:
+            return
+        members = "AND household_id = ANY(CAST(:ids AS INTEGER[]))"
+        households.append(Household.id.in_(household_ids))
+
+    stats = {
+        row.household_id: (row.members, row.location_id)
+        for row in await session.execute(text(HOUSEHOLD_STATS.format(members=members)),
+                                         {"org_id": organization_id, "ids": household_ids})
+    }
+    changed = [
+        (row.id, *stats.get(row.id, (0, None)))
+        for row in await session.execute(
+            select(Household.id, Household.member_count, Household.location_id).where(*households)
+        )
+        if (row.member_count, row.location_id) != stats.get(row.id, (0, None))
+    ]
+    now = datetime.utcnow()
+    for offset in range(0, len(changed), HOUSEHOLD_BATCH_SIZE):
+        chunk = changed[offset:offset + HOUSEHOLD_BATCH_SIZE]
+        await session.execute(WRITE_HOUSEHOLD_STATS, {
+            "now": now,
+            "ids": [hid for hid, _, _ in chunk],
+            "member_counts": [count for _, count, _ in chunk],
+            "location_ids": [location_id for _, _, location_id in chunk],
+        })
+
+
+async def _organization_beneficiaries(session, organization_id: int, ids: List[int]) -> Dict[int, Optional[int]]:
+    """{id: current household_id}; 404 unless every id is an active beneficiary of the organization"""
+    ids = list(dict.fromkeys(ids))
+    rows = dict((await session.execute(
+        select(Beneficiary.id, Beneficiary.household_id).where(
+            Beneficiary.id.in_(ids), Beneficiary.organization_id == organization_id, Beneficiary.is_active == True
+        )
+    )).all())
+    missing = [i for i in ids if i not in rows]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Beneficiaries not found: {missing[:10]}")
+    return rows
+
+
+async def load_household(session, organization_id: int, household_id: int) -> Household:
+    household = await session.get(Household, household_id)
+    if not household or household.organization_id != organization_id:
+        raise HTTPException(status_code=404, detail="Household not found")
+    return household
+
+
+# ==================== MANUAL HOUSEHOLDS ====================
+
+async def create_household(session, organization_id: int, request: HouseholdRequest) -> Household:
+    if request.kind not in HOUSEHOLD_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(sorted(HOUSEHOLD_KINDS))}")
+    household = Household(organization_id=organization_id, name=request.name, kind=request.kind)
+    session.add(household)
+    await session.flush()
+    if request.member_ids:
+        await add_members(session, organization_id, household.id, request.member_ids)
+    return household
+
+
+async def add_members(session, organization_id: int, household_id: int, member_ids: List[int]) -> int:
+    """Move beneficiaries into a household; the household becomes manual, so the batch keeps it"""
+    if len(member_ids) > MAX_MEMBERS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_MEMBERS_PER_REQUEST} members per request")
+    household = await load_household(session, organization_id, household_id)
+    current = await _organization_beneficiaries(session, organization_id, member_ids)
+    moved = [i for i, hid in current.items() if hid != household_id]
+    if moved:
+        await session.execute(
+            update(Beneficiary).where(Beneficiary.id.in_(moved)).values(household_id=household_id)
+        )
+    household.source = "manual"
+    await refresh_households(session, organization_id, [household_id, *current.values()])
+    return len(moved)
+
+
+async def remove_member(session, organization_id: int, household_id: int, beneficiary_id: int):
+    household = await load_household(session, organization_id, household_id)
+    removed = await session.scalar(
+        update(Beneficiary)
+        .where(Beneficiary.id == beneficiary_id, Beneficiary.organization_id == organization_id,
+               Beneficiary.household_id == household_id)
+        .values(household_id=None)
+        .returning(Beneficiary.id)
+    )
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Beneficiary is not in this household")
+    household.source = "manual"
+    await refresh_households(session, organization_id, [household_id])
+
+
+async def household_members(session, organization_id: int, household_id: int) -> List[dict]:
+    """Active members, via (organization_id, household_id)"""
+    rows = await session.execute(
+        select(Beneficiary.id, Beneficiary.name, Beneficiary.age, Beneficiary.gender, Beneficiary.location)
+        .where(Beneficiary.organization_id == organization_id, Beneficiary.household_id == household_id,
+               Beneficiary.is_active == True)
+        .order_by(Beneficiary.id)
+    )
+    return [
+        {"id": row.id, "name": row.name, "age": row.age, "gender": row.gender, "location": row.location}
+        for row in rows
+    ]
+
+
+async def list_households(session, organization_id: int, location_id: Optional[int] = None,
+                          kind: Optional[str] = None, after: Optional[int] = None, limit: int = 100) -> List[Household]:
+    """Households by id, optionally those located in a gazetteer node or any of its descendants"""
+    query = select(Household).where(Household.organization_id == organization_id)
+    if location_id is not None:
+        node = await session.get(LocationNode, location_id)
+        if not node:
+            raise HTTPException(status_code=404, detail="Location not found")
+        # location_nodes is small; each matching node is one range of ix_households_org_location
+        subtree = select(LocationNode.id).where(
+            or_(LocationNode.id == node.id, LocationNode.path.startswith(f"{node.path}/"))
+        )
+        query = query.where(Household.location_id.in_(subtree))
+    if kind is not None:
+        query = query.where(Household.kind == kind)
+    if after is not None:
+        query = query.where(Household.id > after)
+    limit = max(1, min(limit, MAX_LIST_LIMIT))
+    return (await session.execute(query.order_by(Household.id).limit(limit))).scalars().all()
+
+
+# ==================== LINKS ====================
+
+async def add_links(session, organization_id: int, links: List[BeneficiaryLinkRequest],
+                    user_id: Optional[int] = None) -> int:
+    """Store links, skipping ones that already exist; returns how many were new"""
+    if len(links) > MAX_LINKS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_LINKS_PER_REQUEST} links per request")
+    for link in links:
+        if link.relation not in RELATIONS:
+            raise HTTPException(status_code=400, detail=f"relation must be one of {', '.join(sorted(RELATIONS))}")
+        if link.beneficiary_id == link.related_id:
+            raise HTTPException(status_code=400, detail="A beneficiary can't be linked to itself")
+    if not links:
+        return 0
+    await _organization_beneficiaries(
+        session, organization_id, [i for link in links for i in (link.beneficiary_id, link.related_id)]
+    )
+    now = datetime.utcnow()
+    inserted = await session.execute(
+        pg_insert(BeneficiaryLink).values([
+            {"organization_id": organization_id, "beneficiary_id": link.beneficiary_id, "related_id": link.related_id,
+             "relation": link.relation, "created_by": user_id, "created_at": now}
+            for link in links
+        ]).on_conflict_do_nothing().returning(BeneficiaryLink.id)
+    )
+    return len(inserted.all())
+
+
+async def beneficiary_links(session, organization_id: int, beneficiary_id: int) -> List[dict]:
+    """Links from and to a beneficiary, each from that beneficiary's side"""
+    rows = await session.execute(
+        select(BeneficiaryLink).where(
+            BeneficiaryLink.organization_id == organization_id,
+            or_(BeneficiaryLink.beneficiary_id == beneficiary_id, BeneficiaryLink.related_id == beneficiary_id)
+        ).order_by(BeneficiaryLink.id)
+    )
+    return [
+        {
+            "id": link.id,
+            "beneficiary_id": link.beneficiary_id,
+            "related_id": link.related_id,
+            "relation": link.relation,
+            "direction": "outgoing" if link.beneficiary_id == beneficiary_id else "incoming",
+            "created_at": link.created_at.isoformat(),
+        }
+        for link in rows.scalars()
+    ]
+
+
+async def delete_link(session, organization_id: int, link_id: int):
+    deleted = await session.scalar(
+        delete(BeneficiaryLink)
+        .where(BeneficiaryLink.id == link_id, BeneficiaryLink.organization_id == organization_id)
+        .returning(BeneficiaryLink.id)
+    )
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Link not found")
+
+
+# ==================== BATCH ASSIGNMENT ====================
+
+def plan_households(components: UnionFind, current: Dict[int, int], sources: Dict[int, str]
+                    ) -> Tuple[Dict[int, Optional[int]], List[List[int]], Set[int], int]:
+    """Resolve components into household changes.
+
+    ``components`` holds beneficiary ids, and manual households as negative
+    ids joined to their members. Returns (beneficiary -> new household id or
+    None, member lists needing a new household, linked households left
+    empty, components spanning several manual households).
+    """
+    moves: Dict[int, Optional[int]] = {}
+    new_groups: List[List[int]] = []
+    claimed: Set[int] = set()
+    grouped: Set[int] = set()
+    conflicts = 0
+
+    for members in components.components(min_size=2):
+        manual = sorted(-m for m in members if m < 0)
+        people = [m for m in members if m > 0]
+        grouped.update(people)
+        if manual:
+            # Manual memberships stay; the rest join the oldest manual household
+            conflicts += len(manual) > 1
+            for person in people:
+                if sources.get(current.get(person)) != "manual":
+                    moves[person] = manual[0]
+            continue
+        votes = Counter(current[person] for person in people if person in current)
+        target = next((hid for hid, _ in votes.most_common() if hid not in claimed), None)
+        if target is None:
+            new_groups.append(sorted(people))
+            continue
+        claimed.add(target)
+        for person in people:
+            moves[person] = target
+
+    for person in current:
+        if person not in grouped:
+            moves[person] = None
+    moves = {person: hid for person, hid in moves.items() if current.get(person) != hid}
+    stale = {hid for hid, source in sources.items() if source == "linked"} - claimed
+    return moves, new_groups, stale, conflicts
+
+
+async def assign_households(organization_id: int) -> dict:
+    """Recompute linked households for one organization in a single transaction"""
+    started = time.perf_counter()
+    components = UnionFind()
+    edges = 0
+
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(
+            select(BeneficiaryLink.beneficiary_id, BeneficiaryLink.related_id)
+            .where(BeneficiaryLink.organization_id == organization_id,
+                   BeneficiaryLink.relation.in_(HOUSEHOLD_RELATIONS))
+            .execution_options(yield_per=HOUSEHOLD_BATCH_SIZE)
+        )
+        async for batch in result.partitions():
+            components.union_all(batch)
+            edges += len(batch)
+
+        # Imported rows sharing a household_ref are chained to the first one seen
+        first_by_ref: Dict[str, int] = {}
+        result = await session.stream(
+            select(Beneficiary.id, Beneficiary.household_ref)
+            .where(Beneficiary.organization_id == organization_id, Beneficiary.household_ref.isnot(None),
+                   Beneficiary.is_active == True)
+            .execution_options(yield_per=HOUSEHOLD_BATCH_SIZE)
+        )
+        async for batch in result.partitions():
+            for beneficiary_id, ref in batch:
+                components.union(first_by_ref.setdefault(ref, beneficiary_id), beneficiary_id)
+            edges += len(batch)
+
+        sources = dict((await session.execute(
+            select(Household.id, Household.source).where(Household.organization_id == organization_id)
+        )).all())
+        current: Dict[int, int] = {}
+        result = await session.stream(
+            select(Beneficiary.id, Beneficiary.household_id)
+            .where(Beneficiary.organization_id == organization_id, Beneficiary.household_id.isnot(None))
+            .execution_options(yield_per=HOUSEHOLD_BATCH_SIZE)
+        )
+        async for batch in result.partitions():
+            for beneficiary_id, household_id in batch:
+                current[beneficiary_id] = household_id
+                if sources.get(household_id) == "manual":
+                    components.union(beneficiary_id, -household_id)
+
+        moves, new_groups, stale, conflicts = await run_in_threadpool(plan_households, components, current, sources)
+        del components
+
+        now = datetime.utcnow()
+        for offset in range(0, len(new_groups), HOUSEHOLD_BATCH_SIZE):
+            groups = new_groups[offset:offset + HOUSEHOLD_BATCH_SIZE]
+            created = await session.execute(CREATE_HOUSEHOLDS, {
+                "org_id": organization_id, "now": now,
+                "anchor_ids": [members[0] for members in groups],
+                "member_counts": [len(members) for members in groups],
+            })
+            household_by_anchor = dict((row.anchor_id, row.id) for row in created)
+            for members in groups:
+                for person in members:
+                    moves[person] = household_by_anchor[members[0]]
+
+        changes = list(moves.items())
+        for offset in range(0, len(changes), HOUSEHOLD_BATCH_SIZE):
+            chunk = changes[offset:offset + HOUSEHOLD_BATCH_SIZE]
+            await session.execute(MOVE_MEMBERS, {
+                "ids": [person for person, _ in chunk], "household_ids": [hid for _, hid in chunk],
+            })
+        stale = list(stale)
+        for offset in range(0, len(stale), HOUSEHOLD_BATCH_SIZE):
+            await session.execute(delete(Household).where(Household.id.in_(stale[offset:offset + HOUSEHOLD_BATCH_SIZE])))
+        await refresh_households(session, organization_id)
+        await session.commit()
+    db_router.mark_write(organization_id)
+
+    summary = {
+        "status": "completed",
+        "edges": edges,
+        "households_created": len(new_groups),
+        "households_removed": len(stale),
+        "beneficiaries_moved": len(moves),
+        "manual_conflicts": conflicts,
+        "seconds": round(time.perf_counter() - started, 1),
+        "finished_at": datetime.utcnow().isoformat(),
+    }
+    logger.info(f"🏠 Household assignment for organization {organization_id}: {summary}")
+    return summary
+
+
+class HouseholdAssigner(OrganizationTaskRunner):
+    """Household assignment in the background, one at a time per organization.
+
+    Links added during a run are picked up by the queued rerun.
+    """
+
+    description = "Household assignment"
+
+    async def run(self, organization_id: int) -> dict:
+        return await assign_households(organization_id)
+
+
+household_assigner = HouseholdAssigner()
@@ -0,0 +1,462 @@
+"""Streaming bulk import of beneficiaries from CSV, XLSX and JSON files.
+
+An upload is written to disk and recorded as an ``ImportJob``. The file is then
+processed in the background, ``IMPORT_CHUNK_SIZE`` rows at a time:
+1. Rows are read lazily: csv.DictReader, openpyxl read-only mode, and NDJSON or
+   ijson for JSON arrays. Parsing runs in the threadpool.
+2. Each chunk is validated column by column.
+3. Valid rows are written through the COPY-based ``BulkWriter``.
+4. The job's checkpoint (``processed_rows``) is advanced.
+
+Memory use depends on the chunk size, not the file size.
+
+Jobs are resumable. A failed or interrupted job restarts from its checkpoint.
+The chunk it was working on is replayed, and the unique
+(import_id, import_row) key turns already-written rows into no-ops.
+``Organization.max_beneficiaries`` is checked before every chunk against the
+maintained usage counter (``shared.quotas``). A job that hits it, or loses the
+last seats to a concurrent writer, stops with status ``quota_exceeded``. Its
+checkpoint stays before the first row it could not write, so resuming once the
+limit is raised imports the rest.
+"""
+import asyncio
+import csv
+import json
+import logging
+import math
+import os
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, or_, update
+from sqlmodel import select
+
+from shared.bulk import BulkWriter
+from shared.database import AsyncSessionLocal
+from shared.models import Beneficiary, ImportJob, ImportJobStatus
+from shared.pii import contact_hashes
+from shared.quotas import is_quota_error, remaining_beneficiaries
+from dedup import index_beneficiaries
+from gazetteer import location_matcher
+from households import household_assigner
+from scoring import scoring_runner
+
+logger = logging.getLogger(__name__)
+
+IMPORT_STORAGE_DIR = os.getenv("IMPORT_STORAGE_DIR", "/var/lib/evidflow/imports")
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 100))
+IMPORT_STALE_SECONDS = int(os.getenv("IMPORT_STALE_SECONDS", 120))
+MAX_UPLOAD_BYTES = int(os.getenv("IMPORT_MAX_UPLOAD_BYTES", 512 * 1024 * 1024))
+
+FILE_TYPES = {"csv", "excel", "json"}
+TARGET_FIELDS = {"name", "contact_info", "age", "gender", "location", "household_ref"}
+REQUIRED_FIELDS = {"name", "contact_info"}
+DEMOGRAPHICS_PREFIX = "demographics."
+GENDERS = {
+    "m": "male", "male": "male", "man": "male",
+    "f": "female", "female": "female", "woman": "female",
+    "o": "other", "other": "other", "x": "other",
+}
+MAX_AGE = 130
+
+
+def validate_mapping(mapping: Dict[str, str]) -> Dict[str, str]:
+    """Check a {source column: target field} mapping; targets may be demographics.<key>"""
+    if not mapping:
+        raise HTTPException(status_code=400, detail="Column mapping is required")
+    for source, target in mapping.items():
+        if target in TARGET_FIELDS:
+            continue
+        if target.startswith(DEMOGRAPHICS_PREFIX) and len(target) > len(DEMOGRAPHICS_PREFIX):
+            continue
+        raise HTTPException(status_code=400, detail=f"Unknown target field {target!r} for column {source!r}")
+    missing = REQUIRED_FIELDS - set(mapping.values())
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Mapping must include {', '.join(sorted(missing))}")
+    return mapping
+
+
+# ==================== READERS ====================
+
+def _csv_rows(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+
+def _excel_rows(path: str) -> Iterator[Dict[str, Any]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else "" for cell in next(rows, [])]
+        for values in rows:
+            if any(value is not None for value in values):
+                yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def _json_rows(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == b"[":
+            import ijson
+            yield from ijson.items(f, "item", use_float=True)
+        else:
+            # NDJSON: one object per line
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+READERS = {"csv": _csv_rows, "excel": _excel_rows, "json": _json_rows}
+
+
+def open_rows(path: str, file_type: str) -> Iterator[Dict[str, Any]]:
+    return READERS[file_type](path)
+
+
+def estimate_total_rows(path: str, file_type: str) -> Optional[int]:
+    """Row count for progress reporting, without parsing the file"""
+    if file_type == "excel":
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+            return max(max_row - 1, 0) if max_row else None
+        finally:
+            workbook.close()
+
+    lines = 0
+    with open(path, "rb") as f:
+        first = f.read(1)
+        if file_type == "json" and first.strip() == b"[":
+            return None
+        f.seek(0)
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            lines += block.count(b"\n")
+    # Quoted CSV fields may contain newlines, so this is an estimate
+    return max(lines - 1, 0) if file_type == "csv" else lines
+
+
+# ==================== VALIDATION ====================
+
+def _numeric(values: List[Any]) -> np.ndarray:
+    def to_float(value):
+        if value is None or value == "":
+            return math.nan
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return -math.inf
+    return np.fromiter((to_float(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def _demographic_value(value: Any) -> Any:
+    if isinstance(value, str):
+        stripped = value.strip()
+        try:
+            return int(stripped)
+        except ValueError:
+            try:
+                return float(stripped)
+            except ValueError:
+                return stripped
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def validate_chunk(
+    rows: List[Dict[str, Any]],
+    mapping: Dict[str, str],
+    first_row: int,
+    organization_id: int,
+    import_id: str
+) -> Tuple[List[Dict[str, Any]], List[Tuple[int, str]]]:
+    """Map and validate a chunk column by column; returns (records, (row number, error) pairs)"""
+    size = len(rows)
+    columns: Dict[str, List[Any]] = {}
+    for source, target in mapping.items():
+        columns[target] = [row.get(source) for row in rows]
+
+    problems: List[List[str]] = [[] for _ in range(size)]
+
+    texts = {}
+    for field in ("name", "contact_info", "location", "household_ref"):
+        values = [str(v).strip() if v is not None else "" for v in columns.get(field, [None] * size)]
+        if field in REQUIRED_FIELDS:
+            for i in np.flatnonzero(np.fromiter((not v for v in values), dtype=bool, count=size)):
+                problems[i].append(f"{field} is required")
+        texts[field] = values
+
+    ages = _numeric(columns.get("age", [None] * size))
+    bad_ages = (ages == -math.inf) | (ages < 0) | (ages > MAX_AGE) | (~np.isnan(ages) & (ages != np.floor(ages)))
+    for i in np.flatnonzero(bad_ages):
+        problems[i].append(f"age {columns['age'][i]!r} is not a whole number between 0 and {MAX_AGE}")
+
+    genders = []
+    for i, value in enumerate(columns.get("gender", [None] * size)):
+        key = str(value).strip().lower() if value is not None else ""
+        if key and key not in GENDERS:
+            problems[i].append(f"gender {value!r} is not recognised")
+        genders.append(GENDERS.get(key))
+
+    demographic_columns = [
+        (target[len(DEMOGRAPHICS_PREFIX):], values)
+        for target, values in columns.items() if target.startswith(DEMOGRAPHICS_PREFIX)
+    ]
+
+    records, errors = [], []
+    for i in range(size):
+        row_number = first_row + i
+        if problems[i]:
+            errors.append((row_number, "; ".join(problems[i])))
+            continue
+        demographics = {}
+        for key, values in demographic_columns:
+            value = values[i]
+            if value is not None and value != "":
+                demographics[key] = _demographic_value(value)
+        records.append({
+            "name": texts["name"][i],
+            "contact_info": texts["contact_info"][i],
+            **contact_hashes(texts["contact_info"][i]),
+            "location": texts["location"][i] or None,
+            "household_ref": texts["household_ref"][i] or None,
+            "age": None if np.isnan(ages[i]) else int(ages[i]),
+            "gender": genders[i],
+            "demographics": demographics,
+            "organization_id": organization_id,
+            "import_id": import_id,
+            "import_row": row_number,
+        })
+    return records, errors
+
+
+# ==================== JOBS ====================
+
+async def save_upload(upload: UploadFile, import_id: str, file_type: str) -> str:
+    """Stream the upload to disk in 1 MB blocks"""
+    os.makedirs(IMPORT_STORAGE_DIR, exist_ok=True)
+    extension = {"csv": "csv", "excel": "xlsx", "json": "json"}[file_type]
+    path = os.path.join(IMPORT_STORAGE_DIR, f"{import_id}.{extension}")
+    written = 0
+    with open(path, "wb") as f:
+        while True:
+            block = await upload.read(1024 * 1024)
+            if not block:
+                break
+            written += len(block)
+            if written > MAX_UPLOAD_BYTES:
+                f.close()
+                os.remove(path)
+                raise HTTPException(status_code=413, detail="Import file is too large")
+            await run_in_threadpool(f.write, block)
+    return path
+
+
+def new_import_id() -> str:
+    return uuid.uuid4().hex
+
+
+class ImportRunner:
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, import_id: str):
+        if import_id in self._tasks:
+            return
+        task = asyncio.create_task(self.run(import_id))
+        self._tasks[import_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(import_id, None))
+
+    async def resume_stale(self):
+        """Pick up pending jobs and running jobs whose worker went away"""
+        stale = datetime.utcnow() - timedelta(seconds=IMPORT_STALE_SECONDS)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(ImportJob.id).where(or_(
+                    ImportJob.status == ImportJobStatus.PENDING,
+                    (ImportJob.status == ImportJobStatus.RUNNING) & (ImportJob.updated_at < stale)
+                ))
+            )
+            import_ids = list(result.scalars())
+        for import_id in import_ids:
+            logger.info(f"🔁 Resuming import {import_id}")
+            self.start(import_id)
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _claim(self, import_id: str) -> Optional[ImportJob]:
+        """Mark the job running unless a live worker already has it"""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=IMPORT_STALE_SECONDS)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(ImportJob)
+                .where(
+                    ImportJob.id == import_id,
+                    or_(
+                        ImportJob.status.in_([ImportJobStatus.PENDING, ImportJobStatus.FAILED]),
+                        (ImportJob.status == ImportJobStatus.RUNNING) & (ImportJob.updated_at < stale)
+                    )
+                )
+                .values(status=ImportJobStatus.RUNNING, updated_at=now, finished_at=None)
+                .returning(ImportJob)
+                .execution_options(synchronize_session=False)
+            )
+            job = result.scalar_one_or_none()
+            await session.commit()
+            return job
+
+    async def remaining_capacity(self, organization_id: int) -> int:
+        async with AsyncSessionLocal() as session:
+            return await remaining_beneficiaries(session, organization_id)
+
+    async def run(self, import_id: str):
+        job = await self._claim(import_id)
+        if not job:
+            return
+
+        try:
+            await self._process(job)
+        except asyncio.CancelledError:
+            # Shutdown: leave the job RUNNING; it goes stale and is resumed
+            raise
+        except Exception as e:
+            logger.error(f"❌ Import {import_id} failed: {e}")
+            await self._update(import_id, status=ImportJobStatus.FAILED, finished_at=datetime.utcnow(),
+                               error_increment=1, extra_errors=[f"Import stopped: {e}"])
+
+    async def _process(self, job: ImportJob):
+        if job.total_rows is None:
+            total_rows = await run_in_threadpool(estimate_total_rows, job.file_path, job.file_type)
+            await self._update(job.id, total_rows=total_rows)
+
+        # Fresh per job, so gazetteer updates apply without a restart
+        await location_matcher.load()
+
+        rows = open_rows(job.file_path, job.file_type)
+        processed = job.processed_rows
+        # Skip what earlier attempts already checkpointed
+        await run_in_threadpool(lambda: next(islice(rows, processed, processed), None))
+
+        writer = BulkWriter(
+            Beneficiary,
+            conflict_columns=["import_id", "import_row"],
+            conflict_where="import_id IS NOT NULL",
+            update_columns=[],
+            batch_size=IMPORT_CHUNK_SIZE,
+            # One batch per chunk, so every rejected row is listed
+            max_errors=IMPORT_CHUNK_SIZE,
+            fail_batch_on=is_quota_error
+        )
+        error_count = len(job.errors or [])
+        status = ImportJobStatus.COMPLETED
+
+        while True:
+            chunk = await run_in_threadpool(lambda: list(islice(rows, IMPORT_CHUNK_SIZE)))
+            if not chunk:
+                break
+            first_row = processed + 1
+            records, problems = await run_in_threadpool(
+                validate_chunk, chunk, job.mapping, first_row, job.organization_id, job.id
+            )
+
+            await run_in_threadpool(location_matcher.attach, records)
+
+            capacity = await self.remaining_capacity(job.organization_id)
+            rejected = [records[capacity]["import_row"]] if len(records) > capacity else []
+            records = records[:capacity]
+
+            result = await writer.write(records)
+            for e in result.errors:
+                if is_quota_error(e.message):
+                    # A concurrent writer took the last seats after the capacity check
+                    rejected.append(records[e.index]["import_row"])
+                else:
+                    problems.append((records[e.index]["import_row"], e.message))
+
+            last_row = processed + len(chunk)
+            if rejected:
+                # Checkpoint before the first rejected row, so a resume imports it
+                status = ImportJobStatus.QUOTA_EXCEEDED
+                last_row = min(rejected) - 1
+                problems = [(row, message) for row, message in problems if row <= last_row]
+            errors = [f"Row {row}: {message}" for row, message in sorted(problems)]
+            if rejected:
+                errors.append(f"Rows {last_row + 1}+: organization has reached its beneficiary limit")
+            await self._index_for_dedup(job, first_row, last_row)
+
+            processed = last_row
+            await self._update(
+                job.id,
+                processed_rows=processed,
+                imported_increment=result.inserted,
+                error_increment=len(errors),
+                extra_errors=errors[:max(IMPORT_MAX_ERRORS - error_count, 0)]
+            )
+            error_count += len(errors)
+            if status == ImportJobStatus.QUOTA_EXCEEDED:
+                break
+
+        # Exact count: rows replayed after a resume were skipped, not re-inserted
+        async with AsyncSessionLocal() as session:
+            imported = await session.scalar(
+                select(func.count()).select_from(Beneficiary).where(Beneficiary.import_id == job.id)
+            )
+        await self._update(
+            job.id, status=status, imported_count=imported,
+            total_rows=processed if status == ImportJobStatus.COMPLETED else None,
+            finished_at=datetime.utcnow()
+        )
+        logger.info(f"✅ Import {job.id} {status.value}: {imported} beneficiaries from {processed} rows")
+        if imported:
+            scoring_runner.start(job.organization_id)
+            if "household_ref" in job.mapping.values():
+                household_assigner.start(job.organization_id)
+
+    async def _index_for_dedup(self, job: ImportJob, first_row: int, last_row: int):
+        """Add the chunk's rows to the duplicate-detection index; a batch scan repairs any gap"""
+        try:
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(
+                    select(Beneficiary.id, Beneficiary.name, Beneficiary.contact_info, Beneficiary.age,
+                           Beneficiary.location, Beneficiary.created_at)
+                    .where(Beneficiary.import_id == job.id, Beneficiary.import_row.between(first_row, last_row))
+                )).all()
+                await index_beneficiaries(session, job.organization_id, rows)
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Import {job.id}: duplicate index update failed for rows {first_row}-{last_row}: {e}")
+
+    async def _update(self, import_id: str, imported_increment: int = 0, error_increment: int = 0,
+                      extra_errors: Optional[List[str]] = None, **values):
+        values = {key: value for key, value in values.items() if value is not None}
+        async with AsyncSessionLocal() as session:
+            job = await session.get(ImportJob, import_id, with_for_update=True)
+            for key, value in values.items():
+                setattr(job, key, value)
+            job.imported_count += imported_increment
+            job.error_count += error_increment
+            if extra_errors:
+                job.errors = (job.errors or []) + extra_errors[:max(IMPORT_MAX_ERRORS - len(job.errors or []), 0)]
+            job.updated_at = datetime.utcnow()
+            await session.commit()
+
+
+import_runner = ImportRunner()
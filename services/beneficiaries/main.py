@@ -1,12 +1,89 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlmodel import select
+from typing import List, Optional
+import json
 import logging
 import os
 from datetime import datetime
 
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Beneficiaries Service", version="1.0.0")
 
+# Import shared modules
+import sys
+sys.path.append('/app')
+from shared.database import get_session, get_read_session, QueryStatsMiddleware
+from shared.migrations import check_schema_version
+from shared.quotas import usage_reconciler
+from shared.models import (
+    DuplicateMatch, DuplicateMatchStatus, ImportJob, ImportJobStatus, LocationNode, Organization, OrganizationUsage,
+    VulnerabilityModel
+)
+from shared.schemas import (
+    BeneficiaryLinkRequest, DataImportResponse, DuplicateCheckRequest, DuplicateReviewRequest, HouseholdMembersRequest,
+    HouseholdRequest, VulnerabilityModelRequest
+)
+from shared.cookie_auth import cookie_auth
+from shared.api_keys import GATEWAY_API_KEY_HEADER, claims_from_gateway_headers
+from contacts import lookup_contacts
+from dedup import dedup_scanner, find_matches
+from gazetteer import location_breakdown
+from households import (
+    add_links, add_members, beneficiary_links, create_household, delete_link, household_assigner, household_members,
+    household_response, list_households, load_household, remove_member
+)
+from exporter import FORMATS, build_export_query, check_format, export_rows, parse_columns
+from scoring import scoring_runner, validate_model
+from search import normalize_query, search_beneficiaries
+from sync import SYNC_PAGE_SIZE, accepts_zstd, apply_changes, compress, decompress, parse_upload, pull_changes
+from importer import FILE_TYPES, import_runner, new_import_id, save_upload, validate_mapping
+
+app.add_middleware(QueryStatsMiddleware)
+
+WRITE_ROLES = {"org_owner", "org_admin", "meal_officer"}
+
+
+def get_claims(request: Request, scope: str) -> dict:
+    """Claims from a gateway-verified API key, else from the access token cookie"""
+    if request.headers.get(GATEWAY_API_KEY_HEADER):
+        return claims_from_gateway_headers(request, scope)
+    claims = cookie_auth.get_token_claims(request)
+    if not claims.get("org_id"):
+        raise HTTPException(status_code=400, detail="User must belong to an organization")
+    if scope.endswith(":write") and str(claims.get("role", "")).lower() not in WRITE_ROLES:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return claims
+
+
+def import_response(job: ImportJob) -> dict:
+    return DataImportResponse(
+        import_id=job.id,
+        status=job.status.value,
+        total_rows=job.total_rows or 0,
+        processed_rows=job.processed_rows,
+        imported_count=job.imported_count,
+        error_count=job.error_count,
+        errors=job.errors or []
+    ).dict()
+
+
+@app.on_event("startup")
+async def startup_event():
+    await check_schema_version()
+    await import_runner.resume_stale()
+    usage_reconciler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await import_runner.stop()
+    await dedup_scanner.stop()
+    await scoring_runner.stop()
+    await household_assigner.stop()
+    await usage_reconciler.stop()
+
 @app.get("/health")
 async def health_check():
     return {
@@ -15,6 +92,654 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/quota")
+async def get_beneficiary_quota(request: Request):
+    """Beneficiary quota and current usage, from the maintained counters"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_session():
+            organization = await session.get(Organization, claims["org_id"])
+            if not organization:
+                raise HTTPException(status_code=404, detail="Organization not found")
+            usage = await session.get(OrganizationUsage, claims["org_id"])
+            active = usage.active_beneficiaries if usage else 0
+            return {
+                "max_beneficiaries": organization.max_beneficiaries,
+                "active_beneficiaries": active,
+                "remaining": max(organization.max_beneficiaries - active, 0),
+                "reconciled_at": usage.reconciled_at.isoformat() if usage and usage.reconciled_at else None,
+            }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Quota lookup error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get quota"})
+
+# ==================== IMPORT ENDPOINTS ====================
+
+@app.post("/imports", status_code=202)
+async def create_import(
+    request: Request,
+    file: UploadFile = File(...),
+    file_type: str = Form(...),
+    mapping: str = Form(...),
+    organization_id: int = Form(None)
+):
+    """Upload a CSV, XLSX or JSON file and import it in the background"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+        if organization_id is not None and organization_id != claims["org_id"]:
+            raise HTTPException(status_code=403, detail="Cannot import into another organization")
+
+        file_type = file_type.lower()
+        if file_type not in FILE_TYPES:
+            raise HTTPException(status_code=400, detail=f"file_type must be one of {', '.join(sorted(FILE_TYPES))}")
+        try:
+            column_mapping = json.loads(mapping)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="mapping must be a JSON object")
+        if not isinstance(column_mapping, dict):
+            raise HTTPException(status_code=400, detail="mapping must be a JSON object")
+        validate_mapping(column_mapping)
+
+        import_id = new_import_id()
+        file_path = await save_upload(file, import_id, file_type)
+
+        async for session in get_session():
+            if not await session.get(Organization, claims["org_id"]):
+                raise HTTPException(status_code=404, detail="Organization not found")
+            job = ImportJob(
+                id=import_id,
+                organization_id=claims["org_id"],
+                created_by=claims.get("uid"),
+                file_type=file_type,
+                file_path=file_path,
+                mapping=column_mapping
+            )
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+
+        import_runner.start(import_id)
+        logger.info(f"📥 Import {import_id} queued for organization {claims['org_id']}")
+        return import_response(job)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Import upload error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to start import"})
+
+@app.get("/imports/{import_id}")
+async def get_import(import_id: str, request: Request):
+    """Progress and first errors of an import"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        # Progress is written on the primary; polling must not see a lagging replica
+        async for session in get_session():
+            job = await session.get(ImportJob, import_id)
+            if not job or job.organization_id != claims["org_id"]:
+                raise HTTPException(status_code=404, detail="Import not found")
+            return import_response(job)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Import status error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get import"})
+
+@app.post("/imports/{import_id}/resume", status_code=202)
+async def resume_import(import_id: str, request: Request):
+    """Restart a failed import from its last checkpoint"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+
+        async for session in get_session():
+            job = await session.get(ImportJob, import_id)
+            if not job or job.organization_id != claims["org_id"]:
+                raise HTTPException(status_code=404, detail="Import not found")
+            if job.status not in (ImportJobStatus.FAILED, ImportJobStatus.QUOTA_EXCEEDED):
+                raise HTTPException(status_code=409, detail=f"Import is {job.status.value}")
+            if job.status == ImportJobStatus.QUOTA_EXCEEDED:
+                # Let the runner claim it again once the limit has been raised
+                job.status = ImportJobStatus.FAILED
+                await session.commit()
+                await session.refresh(job)
+
+        import_runner.start(import_id)
+        return import_response(job)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Import resume error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to resume import"})
+
+# ==================== VULNERABILITY SCORING ENDPOINTS ====================
+
+def model_response(model: VulnerabilityModel) -> dict:
+    return {
+        "version": model.version,
+        "applied_version": model.applied_version,
+        "factors": model.factors,
+        "thresholds": model.thresholds,
+        "updated_at": model.updated_at.isoformat()
+    }
+
+@app.get("/vulnerability/model")
+async def get_vulnerability_model(request: Request):
+    """The organization's scoring model"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_session():
+            model = (await session.execute(
+                select(VulnerabilityModel).where(VulnerabilityModel.organization_id == claims["org_id"])
+            )).scalar_one_or_none()
+            if not model:
+                raise HTTPException(status_code=404, detail="No scoring model configured")
+            return model_response(model)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Get scoring model error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get scoring model"})
+
+@app.put("/vulnerability/model")
+async def put_vulnerability_model(model_data: VulnerabilityModelRequest, request: Request):
+    """Replace the scoring model and rescore every beneficiary in the background"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+        validate_model(model_data.factors, model_data.thresholds)
+
+        async for session in get_session():
+            model = (await session.execute(
+                select(VulnerabilityModel)
+                .where(VulnerabilityModel.organization_id == claims["org_id"])
+                .with_for_update()
+            )).scalar_one_or_none()
+            if model:
+                model.version += 1
+            else:
+                model = VulnerabilityModel(organization_id=claims["org_id"])
+                session.add(model)
+            model.factors = model_data.factors
+            model.thresholds = model_data.thresholds
+            model.updated_by = claims.get("uid")
+            model.updated_at = datetime.utcnow()
+            await session.commit()
+            await session.refresh(model)
+
+        scoring_runner.start(claims["org_id"], full=True)
+        logger.info(f"📊 Scoring model v{model.version} saved for organization {claims['org_id']}")
+        return model_response(model)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Save scoring model error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to save scoring model"})
+
+@app.post("/vulnerability/recompute", status_code=202)
+async def recompute_vulnerability(request: Request, full: bool = False):
+    """Rescore beneficiaries changed since their last score (or all with full=true)"""
+    claims = get_claims(request, "beneficiaries:write")
+    scoring_runner.start(claims["org_id"], full=full)
+    return {"status": "started"}
+
+@app.get("/vulnerability/recompute")
+async def get_vulnerability_recompute(request: Request):
+    """State of the organization's latest scoring pass on this instance"""
+    claims = get_claims(request, "beneficiaries:read")
+    if scoring_runner.is_running(claims["org_id"]):
+        return {"status": "running"}
+    return scoring_runner.last_results.get(claims["org_id"], {"status": "not_started"})
+
+# ==================== SEARCH ENDPOINTS ====================
+
+@app.get("/beneficiaries/search")
+async def beneficiary_search(request: Request, q: str, limit: int = Query(20, ge=1, le=100)):
+    """Typo-tolerant search over name and location, or an exact phone number"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+        query = normalize_query(q)
+
+        async for session in get_read_session(claims["org_id"]):
+            results = await search_beneficiaries(session, claims["org_id"], query, limit)
+            return {"query": query, "results": results}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Search error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Search failed"})
+
+@app.get("/beneficiaries/lookup")
+async def beneficiary_lookup(request: Request, contact: Optional[str] = None, phone: Optional[str] = None,
+                             limit: int = Query(20, ge=1, le=100)):
+    """Exact match on an encrypted contact, or on the phone number in it"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+        if (contact is None) == (phone is None):
+            raise HTTPException(status_code=400, detail="Give exactly one of contact or phone")
+
+        async for session in get_read_session(claims["org_id"]):
+            return {"results": await lookup_contacts(session, claims["org_id"], contact, phone, limit)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Contact lookup error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Lookup failed"})
+
+# ==================== HOUSEHOLD ENDPOINTS ====================
+
+@app.post("/households", status_code=201)
+async def create_household_endpoint(household_data: HouseholdRequest, request: Request):
+    """Create a manual household or group, optionally with members"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+
+        async for session in get_session(claims["org_id"]):
+            household = await create_household(session, claims["org_id"], household_data)
+            await session.commit()
+            await session.refresh(household)
+            return household_response(household)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Create household error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to create household"})
+
+@app.get("/households")
+async def get_households(request: Request, location_id: Optional[int] = None, kind: Optional[str] = None,
+                         after: Optional[int] = None, limit: int = Query(100, ge=1, le=500)):
+    """Households by id, optionally within a location and its descendants; page with after=<last id>"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_read_session(claims["org_id"]):
+            households = await list_households(session, claims["org_id"], location_id, kind, after, limit)
+            return {
+                "households": [household_response(household) for household in households],
+                "next_after": households[-1].id if len(households) == limit else None,
+            }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ List households error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to list households"})
+
+@app.get("/households/assign")
+async def get_household_assignment(request: Request):
+    """State of the organization's latest household assignment on this instance"""
+    claims = get_claims(request, "beneficiaries:read")
+    if household_assigner.is_running(claims["org_id"]):
+        return {"status": "running"}
+    return household_assigner.last_results.get(claims["org_id"], {"status": "not_started"})
+
+@app.post("/households/assign", status_code=202)
+async def start_household_assignment(request: Request):
+    """Recompute linked households from beneficiary links and imported household refs"""
+    claims = get_claims(request, "beneficiaries:write")
+    started = household_assigner.start(claims["org_id"])
+    return {"status": "started" if started else "queued"}
+
+@app.get("/households/{household_id}")
+async def get_household(household_id: int, request: Request):
+    """A household with its active members"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_read_session(claims["org_id"]):
+            household = await load_household(session, claims["org_id"], household_id)
+            return {
+                **household_response(household),
+                "members": await household_members(session, claims["org_id"], household_id),
+            }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Get household error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get household"})
+
+@app.post("/households/{household_id}/members")
+async def add_household_members(household_id: int, members: HouseholdMembersRequest, request: Request):
+    """Move beneficiaries into a household"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+
+        async for session in get_session(claims["org_id"]):
+            moved = await add_members(session, claims["org_id"], household_id, members.member_ids)
+            await session.commit()
+            return {"moved": moved}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Add household members error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to add household members"})
+
+@app.delete("/households/{household_id}/members/{beneficiary_id}", status_code=204)
+async def remove_household_member(household_id: int, beneficiary_id: int, request: Request):
+    """Take a beneficiary out of a household"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+
+        async for session in get_session(claims["org_id"]):
+            await remove_member(session, claims["org_id"], household_id, beneficiary_id)
+            await session.commit()
+            return Response(status_code=204)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Remove household member error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to remove household member"})
+
+@app.post("/beneficiaries/links")
+async def create_beneficiary_links(links: List[BeneficiaryLinkRequest], request: Request, assign: bool = False):
+    """Add typed links between beneficiaries; assign=true also recomputes linked households"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+
+        async for session in get_session(claims["org_id"]):
+            created = await add_links(session, claims["org_id"], links, claims.get("uid"))
+            await session.commit()
+        if assign and created:
+            household_assigner.start(claims["org_id"])
+        return {"created": created, "skipped": len(links) - created}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Create links error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to create links"})
+
+@app.get("/beneficiaries/{beneficiary_id}/links")
+async def get_beneficiary_links(beneficiary_id: int, request: Request):
+    """Links from and to a beneficiary"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_read_session(claims["org_id"]):
+            return {"links": await beneficiary_links(session, claims["org_id"], beneficiary_id)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Get links error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get links"})
+
+@app.delete("/beneficiaries/links/{link_id}", status_code=204)
+async def delete_beneficiary_link(link_id: int, request: Request):
+    """Remove a link; linked households change on the next assignment"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+
+        async for session in get_session(claims["org_id"]):
+            await delete_link(session, claims["org_id"], link_id)
+            await session.commit()
+            return Response(status_code=204)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Delete link error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to delete link"})
+
+# ==================== LOCATION ENDPOINTS ====================
+
+@app.get("/locations/breakdown")
+async def get_location_breakdown(request: Request, parent_id: Optional[int] = None):
+    """Beneficiary counts by gender and age band for each child of a location node"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_read_session(claims["org_id"]):
+            parent = None
+            if parent_id is not None:
+                parent = await session.get(LocationNode, parent_id)
+                if not parent:
+                    raise HTTPException(status_code=404, detail="Location not found")
+            return {
+                "parent": {"id": parent.id, "code": parent.code, "name": parent.name, "level": parent.level}
+                if parent else None,
+                "children": await location_breakdown(session, claims["org_id"], parent_id),
+            }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Location breakdown error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get location breakdown"})
+
+# ==================== SYNC ENDPOINTS ====================
+
+@app.get("/sync/beneficiaries")
+async def pull_beneficiary_changes(request: Request, token: Optional[str] = None,
+                                   limit: int = Query(SYNC_PAGE_SIZE, ge=1)):
+    """NDJSON page of beneficiary changes since a sync token"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_read_session(claims["org_id"]):
+            body, next_token, has_more = await pull_changes(session, claims["org_id"], token, limit)
+
+        headers = {"X-Sync-Token": next_token, "X-Sync-Has-More": str(has_more).lower(), "Vary": "Accept-Encoding"}
+        if accepts_zstd(request.headers.get("accept-encoding")):
+            body = compress(body)
+            headers["Content-Encoding"] = "zstd"
+        return Response(content=body, media_type="application/x-ndjson", headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Sync pull error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to get changes"})
+
+@app.post("/sync/beneficiaries")
+async def push_beneficiary_changes(request: Request):
+    """Apply a batch of offline edits (NDJSON) with conflict detection"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+        body = await request.body()
+        if request.headers.get("content-encoding", "").lower() == "zstd":
+            body = decompress(body)
+        changes = parse_upload(body)
+
+        async for session in get_session(claims["org_id"]):
+            results = await apply_changes(session, claims["org_id"], changes)
+            await session.commit()
+
+        if any(result["status"] == "applied" for result in results):
+            scoring_runner.start(claims["org_id"])
+        logger.info(f"🔄 Sync upload for organization {claims['org_id']}: {len(changes)} changes")
+        return {
+            "applied": sum(1 for result in results if result["status"] == "applied"),
+            "conflicts": sum(1 for result in results if result["status"] == "conflict"),
+            "errors": sum(1 for result in results if result["status"] == "error"),
+            "results": results,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Sync upload error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to apply changes"})
+
+# ==================== EXPORT ENDPOINTS ====================
+
+@app.get("/exports/beneficiaries")
+async def export_beneficiaries(
+    request: Request,
+    format: str = "csv",
+    columns: Optional[str] = None,
+    location: Optional[str] = None,
+    gender: Optional[str] = None,
+    min_age: Optional[int] = Query(None, ge=0),
+    max_age: Optional[int] = Query(None, ge=0),
+    filter: List[str] = Query([]),
+    include_inactive: bool = False
+):
+    """Stream the organization's beneficiaries as CSV, NDJSON or Parquet"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+        export_format = check_format(format)
+        selected = parse_columns(columns)
+        query = build_export_query(
+            claims["org_id"], selected,
+            location=location, gender=gender, min_age=min_age, max_age=max_age,
+            filters=filter, include_inactive=include_inactive
+        )
+
+        media_type, extension = FORMATS[export_format]
+        filename = f"beneficiaries-{datetime.utcnow():%Y%m%d-%H%M%S}.{extension}"
+        return StreamingResponse(
+            export_rows(query, selected, export_format, claims["org_id"]),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Export error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to export beneficiaries"})
+
+# ==================== DUPLICATE DETECTION ENDPOINTS ====================
+
+@app.post("/duplicates/check")
+async def check_duplicates(check: DuplicateCheckRequest, request: Request):
+    """Existing beneficiaries that look like this registration"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+
+        async for session in get_session():
+            matches = await find_matches(
+                session, claims["org_id"], check.name, check.contact_info, check.age, check.location,
+                exclude_id=check.exclude_id
+            )
+            return {
+                "matches": [
+                    {
+                        "id": beneficiary.id,
+                        "name": beneficiary.name,
+                        "contact_info": beneficiary.contact_info,
+                        "age": beneficiary.age,
+                        "location": beneficiary.location,
+                        "score": similarity
+                    }
+                    for beneficiary, similarity in matches
+                ]
+            }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Duplicate check error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to check duplicates"})
+
+@app.post("/duplicates/scan", status_code=202)
+async def scan_duplicates(request: Request):
+    """Start a batch duplicate scan of the whole organization, or queue one behind a running scan"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+        started = dedup_scanner.start(claims["org_id"])
+        return {"status": "started" if started else "queued"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Duplicate scan error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to start duplicate scan"})
+
+@app.get("/duplicates/scan")
+async def get_duplicate_scan(request: Request):
+    """State of the organization's latest batch scan on this instance"""
+    claims = get_claims(request, "beneficiaries:read")
+    if dedup_scanner.is_running(claims["org_id"]):
+        return {"status": "running"}
+    return dedup_scanner.last_results.get(claims["org_id"], {"status": "not_started"})
+
+@app.get("/duplicates")
+async def list_duplicates(request: Request, status: str = "pending", limit: int = Query(50, ge=1, le=500)):
+    """Duplicate clusters with their scored pairs"""
+    try:
+        claims = get_claims(request, "beneficiaries:read")
+        try:
+            match_status = DuplicateMatchStatus(status)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="status must be pending, confirmed or rejected")
+
+        async for session in get_session():
+            cluster_ids = (
+                select(DuplicateMatch.cluster_id)
+                .where(DuplicateMatch.organization_id == claims["org_id"], DuplicateMatch.status == match_status)
+                .distinct()
+                .order_by(DuplicateMatch.cluster_id)
+                .limit(limit)
+            )
+            result = await session.execute(
+                select(DuplicateMatch)
+                .where(
+                    DuplicateMatch.organization_id == claims["org_id"],
+                    DuplicateMatch.status == match_status,
+                    DuplicateMatch.cluster_id.in_(cluster_ids)
+                )
+                .order_by(DuplicateMatch.cluster_id, DuplicateMatch.score.desc())
+            )
+            clusters = {}
+            for match in result.scalars():
+                cluster = clusters.setdefault(match.cluster_id, {"cluster_id": match.cluster_id, "beneficiary_ids": set(), "pairs": []})
+                cluster["beneficiary_ids"].update((match.beneficiary_id, match.duplicate_id))
+                cluster["pairs"].append({
+                    "id": match.id,
+                    "beneficiary_id": match.beneficiary_id,
+                    "duplicate_id": match.duplicate_id,
+                    "score": match.score
+                })
+            for cluster in clusters.values():
+                cluster["beneficiary_ids"] = sorted(cluster["beneficiary_ids"])
+            return {"clusters": list(clusters.values())}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Duplicate list error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to list duplicates"})
+
+@app.patch("/duplicates/{match_id}")
+async def review_duplicate(match_id: int, review: DuplicateReviewRequest, request: Request):
+    """Confirm or reject a candidate pair"""
+    try:
+        claims = get_claims(request, "beneficiaries:write")
+        if review.status not in (DuplicateMatchStatus.CONFIRMED.value, DuplicateMatchStatus.REJECTED.value):
+            raise HTTPException(status_code=400, detail="status must be confirmed or rejected")
+
+        async for session in get_session():
+            match = await session.get(DuplicateMatch, match_id)
+            if not match or match.organization_id != claims["org_id"]:
+                raise HTTPException(status_code=404, detail="Duplicate match not found")
+            match.status = DuplicateMatchStatus(review.status)
+            match.reviewed_by = claims.get("uid")
+            match.reviewed_at = datetime.utcnow()
+            await session.commit()
+            return {"id": match.id, "status": match.status.value}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Duplicate review error: {e}")
+        return JSONResponse(status_code=500, content={"detail": "Failed to review duplicate"})
+
 @app.get("/")
 async def root():
     return {"message": "Beneficiaries Service is running"}
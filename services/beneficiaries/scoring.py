@@ -0,0 +1,255 @@
+"""Vulnerability scoring with a configurable per-organization model.
+
+A model is a list of weighted factors plus level thresholds:
+
+    {"factors": [
+        {"field": "age", "type": "ranges", "ranges": [[0, 5, 1.0], [60, 130, 0.8]], "weight": 2},
+        {"field": "demographics.household_size", "type": "linear", "min": 1, "max": 10, "weight": 1.5},
+        {"field": "demographics.disability", "type": "boolean", "weight": 3},
+        {"field": "demographics.displacement_status", "type": "categorical",
+         "values": {"IDP": 1.0, "refugee": 0.8}, "weight": 2}
+     ],
+     "thresholds": {"high": 70, "medium": 40}}
+
+Each factor maps its field to [0, 1]. The score is the weighted mean scaled to
+0-100, and the level is the highest threshold the score reaches. Missing
+values count as 0.
+
+Beneficiaries are scored in batches of ``SCORING_BATCH_SIZE``. Only the
+columns and demographics keys the model uses are selected; each factor is
+evaluated with NumPy over the whole batch, and the batch is written back with
+one ``UPDATE ... FROM unnest(...)``. Writing a score sets ``scored_at`` but not
+``updated_at``, so an incremental run only picks up rows edited since their
+last score (``ix_beneficiaries_unscored``). A model change triggers a full run
+that walks the organization's (created_at, id) index.
+"""
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text, tuple_, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal
+from shared.json_filters import FIELD_PATTERN
+from shared.models import Beneficiary, VulnerabilityModel
+from shared.tasks import OrganizationTaskRunner
+
+logger = logging.getLogger(__name__)
+
+SCORING_BATCH_SIZE = int(os.getenv("SCORING_BATCH_SIZE", 20000))
+COLUMN_FIELDS = {"age", "gender", "location"}
+DEMOGRAPHICS_PREFIX = "demographics."
+FACTOR_TYPES = {"ranges", "linear", "boolean", "categorical"}
+TRUE_VALUES = {"true", "1", "yes", "y"}
+MAX_FACTORS = 50
+
+WRITE_SCORES = text("""
+    UPDATE beneficiaries AS b
+    SET vulnerability_score = v.score, vulnerability_level = v.level,
+        scored_at = :scored_at, score_model_version = :version
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:scores AS DOUBLE PRECISION[]), CAST(:levels AS VARCHAR[]))
+        AS v(id, score, level)
+    WHERE b.id = v.id
+""")
+
+
+def _invalid(message: str):
+    raise HTTPException(status_code=400, detail=f"Invalid scoring model: {message}")
+
+
+def validate_model(factors: List[Dict[str, Any]], thresholds: Dict[str, float]):
+    """Reject malformed factor definitions with 400"""
+    if not factors:
+        _invalid("at least one factor is required")
+    if len(factors) > MAX_FACTORS:
+        _invalid(f"at most {MAX_FACTORS} factors are allowed")
+    for factor in factors:
+        field, kind = factor.get("field"), factor.get("type")
+        if field not in COLUMN_FIELDS and not (
+            isinstance(field, str) and field.startswith(DEMOGRAPHICS_PREFIX)
+            and FIELD_PATTERN.match(field[len(DEMOGRAPHICS_PREFIX):])
+        ):
+            _invalid(f"unknown field {field!r}")
+        if kind not in FACTOR_TYPES:
+            _invalid(f"{field}: type must be one of {', '.join(sorted(FACTOR_TYPES))}")
+        weight = factor.get("weight", 1)
+        if not isinstance(weight, (int, float)) or weight < 0:
+            _invalid(f"{field}: weight must be a non-negative number")
+        if kind == "ranges":
+            ranges = factor.get("ranges")
+            if not isinstance(ranges, list) or not ranges or not all(
+                isinstance(r, list) and len(r) == 3 and all(isinstance(x, (int, float)) for x in r) for r in ranges
+            ):
+                _invalid(f"{field}: ranges must be [[low, high, value], ...]")
+        elif kind == "linear":
+            low, high = factor.get("min"), factor.get("max")
+            if not isinstance(low, (int, float)) or not isinstance(high, (int, float)) or low == high:
+                _invalid(f"{field}: linear factors need distinct numeric min and max")
+        elif kind == "categorical":
+            values = factor.get("values")
+            if not isinstance(values, dict) or not all(isinstance(v, (int, float)) for v in values.values()):
+                _invalid(f"{field}: values must map categories to numbers")
+    if sum(factor.get("weight", 1) for factor in factors) <= 0:
+        _invalid("weights must not all be zero")
+    if not all(isinstance(v, (int, float)) for v in thresholds.values()):
+        _invalid("thresholds must be numbers")
+
+
+# ==================== EVALUATION ====================
+
+def _numbers(values: List[Any]) -> np.ndarray:
+    def to_float(value):
+        if value is None or value == "":
+            return math.nan
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return math.nan
+    return np.fromiter((to_float(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def evaluate_factor(factor: Dict[str, Any], values: List[Any]) -> np.ndarray:
+    """Factor contribution in [0, 1] for every row of a batch"""
+    kind = factor["type"]
+    if kind == "ranges":
+        numbers = _numbers(values)
+        result = np.zeros(len(values))
+        # Earlier ranges win where ranges overlap
+        for low, high, value in reversed(factor["ranges"]):
+            result = np.where((numbers >= low) & (numbers < high), value, result)
+        return np.clip(result, 0, 1)
+    if kind == "linear":
+        numbers = _numbers(values)
+        scaled = (numbers - factor["min"]) / (factor["max"] - factor["min"])
+        return np.nan_to_num(np.clip(scaled, 0, 1), nan=0.0)
+    if kind == "boolean":
+        return np.fromiter(
+            (str(value).strip().lower() in TRUE_VALUES if value is not None else False for value in values),
+            dtype=np.float64, count=len(values)
+        )
+    # categorical: case-insensitive lookup
+    mapping = {str(key).lower(): float(value) for key, value in factor["values"].items()}
+    return np.clip(np.fromiter(
+        (mapping.get(str(value).strip().lower(), 0.0) if value is not None else 0.0 for value in values),
+        dtype=np.float64, count=len(values)
+    ), 0, 1)
+
+
+def score_batch(
+    factors: List[Dict[str, Any]],
+    thresholds: Dict[str, float],
+    columns: Dict[str, List[Any]]
+) -> Tuple[np.ndarray, List[Optional[str]]]:
+    """Scores (0-100) and levels for a batch given as {field: values}"""
+    size = len(next(iter(columns.values()))) if columns else 0
+    total = np.zeros(size)
+    weight_sum = 0.0
+    for factor in factors:
+        weight = float(factor.get("weight", 1))
+        total += weight * evaluate_factor(factor, columns[factor["field"]])
+        weight_sum += weight
+    scores = np.round(total / weight_sum * 100, 2)
+
+    levels = np.full(size, None, dtype=object)
+    for level, minimum in sorted(thresholds.items(), key=lambda item: item[1]):
+        levels[scores >= minimum] = level
+    return scores, levels.tolist()
+
+
+# ==================== RUNS ====================
+
+def _field_expression(field: str):
+    if field.startswith(DEMOGRAPHICS_PREFIX):
+        path = field[len(DEMOGRAPHICS_PREFIX):].split(".")
+        document = type_coerce(Beneficiary.demographics, JSONB)
+        expression = document[path] if len(path) > 1 else document[path[0]]
+        return expression.astext.label(field)
+    return getattr(Beneficiary, field).label(field)
+
+
+class ScoringRunner(OrganizationTaskRunner):
+    """Scoring passes in the background, one at a time per organization"""
+
+    description = "Vulnerability scoring"
+
+    async def run(self, organization_id: int, full: bool = False) -> dict:
+        return await self.score_organization(organization_id, full)
+
+    async def score_organization(self, organization_id: int, full: bool = False) -> dict:
+        """Score stale beneficiaries, or all of them when ``full`` or the model changed"""
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as session:
+            model = (await session.execute(
+                select(VulnerabilityModel).where(VulnerabilityModel.organization_id == organization_id)
+            )).scalar_one_or_none()
+        if not model:
+            return {"status": "no_model"}
+
+        full = full or model.applied_version != model.version
+        fields = sorted({factor["field"] for factor in model.factors})
+        columns = [Beneficiary.id, Beneficiary.created_at] + [_field_expression(field) for field in fields]
+        scored = 0
+        position = None
+
+        while True:
+            query = select(*columns).where(Beneficiary.organization_id == organization_id)
+            if full:
+                # Walks ix_beneficiaries_org_created_id
+                if position:
+                    query = query.where(tuple_(Beneficiary.created_at, Beneficiary.id) > position)
+                query = query.order_by(Beneficiary.created_at, Beneficiary.id)
+            else:
+                # Matches the partial index predicate of ix_beneficiaries_unscored
+                query = query.where(text("(scored_at IS NULL OR scored_at < updated_at)"))
+                if position:
+                    query = query.where(Beneficiary.id > position[1])
+                query = query.order_by(Beneficiary.id)
+
+            # Rows edited after this moment stay stale and are picked up next time
+            read_at = datetime.utcnow()
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(query.limit(SCORING_BATCH_SIZE))).all()
+                if not rows:
+                    break
+                batch = {field: [row._mapping[field] for row in rows] for field in fields}
+                scores, levels = await run_in_threadpool(score_batch, model.factors, model.thresholds, batch)
+                await session.execute(WRITE_SCORES, {
+                    "ids": [row.id for row in rows],
+                    "scores": scores.tolist(),
+                    "levels": levels,
+                    "scored_at": read_at,
+                    "version": model.version,
+                })
+                await session.commit()
+            scored += len(rows)
+            position = (rows[-1].created_at, rows[-1].id)
+
+        if full:
+            async with AsyncSessionLocal() as session:
+                current = await session.get(VulnerabilityModel, model.id)
+                # A model edited mid-run keeps its newer version pending
+                if current and current.version == model.version:
+                    current.applied_version = model.version
+                    await session.commit()
+
+        summary = {
+            "status": "completed",
+            "mode": "full" if full else "incremental",
+            "model_version": model.version,
+            "scored": scored,
+            "seconds": round(time.perf_counter() - started, 2),
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+        logger.info(f"📊 Vulnerability scoring for organization {organization_id}: {summary}")
+        return summary
+
+
+scoring_runner = ScoringRunner()
@@ -0,0 +1,160 @@
+"""Fuzzy beneficiary search over name and location, plus exact phone lookup.
+
+A query matches a beneficiary in any of four ways:
+- every word is a prefix of a word in the full-text document
+  (``BENEFICIARY_SEARCH_DOCUMENT``: name and location)
+- the query is word-similar to the name, for typos and transliterations
+  (``pg_trgm`` ``<%``)
+- the query is word-similar to the location
+- the query is a phone number whose blind index (``shared.pii``) matches
+
+Contact details are encrypted, so phone numbers match exactly or not at all.
+Each branch uses its own (organization_id, ...) index and contributes at most ``SEARCH_CANDIDATE_LIMIT`` rows. Only that candidate
+set is ranked, so a short, common prefix costs the same as a rare one.
+
+Results are cached in Redis for ``SEARCH_CACHE_TTL_SECONDS`` per organization
+and normalized query, because type-ahead clients repeat the same prefixes.
+Redis errors fail open to the database.
+"""
+import json
+import logging
+import os
+import re
+from typing import List, Optional
+
+import redis.asyncio as redis
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from shared.models import BENEFICIARY_SEARCH_DOCUMENT
+from shared.pii import blind_indexes, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CANDIDATE_LIMIT = int(os.getenv("SEARCH_CANDIDATE_LIMIT", 500))
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", 60))
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv("SEARCH_SIMILARITY_THRESHOLD", 0.5))
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 100
+MAX_LIMIT = 100
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_PHONE = re.compile(r"\+?[\d\s().-]+")
+
+SEARCH_QUERY = text(f"""
+    WITH candidates AS (
+        (SELECT id FROM beneficiaries
+         WHERE organization_id = :org_id AND is_active
+           AND ({BENEFICIARY_SEARCH_DOCUMENT}) @@ to_tsquery('simple', :prefix_query)
+         LIMIT :candidates)
+        UNION
+        (SELECT id FROM beneficiaries
+         WHERE organization_id = :org_id AND is_active AND :query <% name
+         LIMIT :candidates)
+        UNION
+        (SELECT id FROM beneficiaries
+         WHERE organization_id = :org_id AND is_active AND :query <% location
+         LIMIT :candidates)
+        UNION
+        (SELECT id FROM beneficiaries
+         WHERE organization_id = :org_id AND is_active AND phone_hash = ANY(CAST(:phone_hashes AS VARCHAR[]))
+         LIMIT :candidates)
+    )
+    SELECT b.id, b.name, b.location, b.age, b.gender,
+           GREATEST(
+               ts_rank(({BENEFICIARY_SEARCH_DOCUMENT}), to_tsquery('simple', :prefix_query), 32),
+               word_similarity(:query, b.name),
+               0.8 * word_similarity(:query, coalesce(b.location, '')),
+               CASE WHEN b.phone_hash = ANY(CAST(:phone_hashes AS VARCHAR[])) THEN 1 ELSE 0 END
+           ) AS score
+    FROM beneficiaries b JOIN candidates USING (id)
+    ORDER BY score DESC, b.id
+    LIMIT :limit
+""")
+
+
+def normalize_query(query: Optional[str]) -> str:
+    normalized = " ".join((query or "").lower().split())[:MAX_QUERY_LENGTH]
+    if len(normalized) < MIN_QUERY_LENGTH or not _WORD.search(normalized):
+        raise HTTPException(status_code=400, detail=f"Search needs at least {MIN_QUERY_LENGTH} characters")
+    return normalized
+
+
+def phone_hashes(query: str) -> List[str]:
+    """Blind indexes to look up when the query is a phone number"""
+    return blind_indexes(normalize_phone(query)) if _PHONE.fullmatch(query) else []
+
+
+def prefix_tsquery(query: str) -> str:
+    """'moha ali' -> 'moha:* & ali:*'; words only, so user input can't inject tsquery syntax"""
+    return " & ".join(f"{word}:*" for word in _WORD.findall(query))
+
+
+class SearchCache:
+    def __init__(self):
+        self.ttl_seconds = SEARCH_CACHE_TTL_SECONDS
+        self._redis = redis.from_url(
+            os.getenv("REDIS_URL", "redis://redis:6379/0"),
+            socket_timeout=0.1,
+            socket_connect_timeout=0.1
+        )
+
+    def _key(self, organization_id: int, query: str, limit: int) -> str:
+        return f"search:beneficiaries:{organization_id}:{limit}:{query}"
+
+    async def get(self, organization_id: int, query: str, limit: int) -> Optional[List[dict]]:
+        if self.ttl_seconds <= 0:
+            return None
+        try:
+            cached = await self._redis.get(self._key(organization_id, query, limit))
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Search cache read skipped, Redis unavailable: {e}")
+            return None
+        return json.loads(cached) if cached else None
+
+    async def set(self, organization_id: int, query: str, limit: int, results: List[dict]):
+        if self.ttl_seconds <= 0:
+            return
+        try:
+            await self._redis.set(self._key(organization_id, query, limit), json.dumps(results), ex=self.ttl_seconds)
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Search cache write skipped, Redis unavailable: {e}")
+
+
+search_cache = SearchCache()
+
+
+async def search_beneficiaries(session, organization_id: int, query: str, limit: int = 20) -> List[dict]:
+    """Ranked matches for a normalized query within one organization"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    hashes = phone_hashes(query)
+    # Phone numbers stay out of Redis keys; exact lookups are cheap anyway
+    cacheable = not hashes
+    cached = await search_cache.get(organization_id, query, limit) if cacheable else None
+    if cached is not None:
+        return cached
+
+    # SET LOCAL only lasts for this transaction
+    await session.execute(text(f"SET LOCAL pg_trgm.word_similarity_threshold = {SEARCH_SIMILARITY_THRESHOLD:.2f}"))
+    result = await session.execute(SEARCH_QUERY, {
+        "org_id": organization_id,
+        "query": query,
+        "prefix_query": prefix_tsquery(query),
+        "phone_hashes": hashes,
+        "candidates": SEARCH_CANDIDATE_LIMIT,
+        "limit": limit,
+    })
+    results = [
+        {
+            "id": row.id,
+            "name": row.name,
+            "location": row.location,
+            "age": row.age,
+            "gender": row.gender,
+            "score": round(float(row.score), 4),
+        }
+        for row in result
+    ]
+    if cacheable:
+        await search_cache.set(organization_id, query, limit, results)
+    return results
@@ -0,0 +1,639 @@
+"""Versioned schema migrations for the shared Postgres database.
+
+Each migration runs exactly once and is recorded in ``schema_migrations``.
+The runner holds a Postgres advisory lock, so concurrent deploys wait for each
+other instead of racing. Most migrations run in a transaction. Migrations
+marked ``transactional=False`` run in autocommit mode so they can use
+``CREATE INDEX CONCURRENTLY``, which builds an index without blocking writes.
+Migrations with ``run_async`` manage their own transactions. They are used for
+online changes that backfill in batches. Every step is idempotent
+(``IF [NOT] EXISTS``, resumable backfills), so a migration that failed halfway
+can simply be run again.
+
+Services never run DDL at startup; they only call ``check_schema_version``.
+Run migrations as a deploy step:
+
+    python -m shared.migrations           # apply pending migrations
+    python -m shared.migrations --check   # exit 1 if migrations are pending
+
+If a concurrent index build fails, Postgres leaves an INVALID index behind.
+Drop it before re-running, because ``IF NOT EXISTS`` would otherwise skip it.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlmodel import SQLModel
+
+from shared.database import engine
+from shared.models import BENEFICIARY_SEARCH_DOCUMENT
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 7_311_000
+
+
+class Migration:
+    def __init__(
+        self,
+        version: int,
+        name: str,
+        statements: Sequence[str] = (),
+        run_sync: Optional[Callable] = None,
+        transactional: bool = True,
+        run_async: Optional[Callable[..., Awaitable]] = None
+    ):
+        self.version = version
+        self.name = name
+        self.statements = list(statements)
+        self.run_sync = run_sync
+        self.transactional = transactional
+        self.run_async = run_async
+
+    async def apply(self, conn):
+        if self.run_sync:
+            await conn.run_sync(self.run_sync)
+        for statement in self.statements:
+            await conn.execute(text(statement))
+
+
+def _create_missing_tables(sync_conn):
+    # Import for side effects: registers every table on SQLModel.metadata
+    import shared.models  # noqa: F401
+    SQLModel.metadata.create_all(sync_conn, checkfirst=True)
+
+
+def _create_tables(*names: str) -> Callable:
+    """run_sync step creating tables added to the models after the baseline"""
+    def create(sync_conn):
+        import shared.models  # noqa: F401
+        for name in names:
+            SQLModel.metadata.tables[name].create(sync_conn, checkfirst=True)
+    return create
+
+
+async def _column_type(conn, table: str, column: str) -> Optional[str]:
+    return await conn.scalar(
+        text("SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :column"),
+        {"table": table, "column": column}
+    )
+
+
+async def convert_json_to_jsonb(target_engine, table: str, column: str, index_name: str, batch_size: int = 5000):
+    """Convert a json column to jsonb with a GIN index without a long table lock.
+
+    ``ALTER COLUMN ... TYPE jsonb`` rewrites the table under an exclusive lock.
+    Instead, a jsonb shadow column is added and kept in sync by a trigger. It
+    is backfilled in short batches and indexed concurrently. The columns are
+    then swapped in one brief transaction.
+    """
+    shadow = f"{column}_jsonb"
+    sync_function = f"{table}_{shadow}_sync"
+
+    async with target_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if await _column_type(conn, table, column) == "jsonb":
+            await conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} USING gin ({column} jsonb_path_ops)"
+            ))
+            return
+
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {shadow} JSONB"))
+        await conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION {sync_function}() RETURNS trigger AS $$
+            BEGIN
+                NEW.{shadow} := NEW.{column}::jsonb;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """))
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {sync_function} ON {table}"))
+        await conn.execute(text(
+            f"CREATE TRIGGER {sync_function} BEFORE INSERT OR UPDATE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {sync_function}()"
+        ))
+
+        backfilled = 0
+        while True:
+            result = await conn.execute(text(f"""
+                UPDATE {table} SET {shadow} = {column}::jsonb
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE {shadow} IS NULL AND {column} IS NOT NULL
+                    ORDER BY id LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED
+                )
+            """), {"batch_size": batch_size})
+            backfilled += result.rowcount
+            if result.rowcount == 0:
+                break
+            await asyncio.sleep(0.05)
+        logger.info(f"🗄️ Backfilled {backfilled} {table}.{column} rows into jsonb")
+
+        await conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} USING gin ({shadow} jsonb_path_ops)"
+        ))
+
+    async with target_engine.begin() as conn:
+        await conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+        await conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        # Rows skipped above because they were locked at the time
+        await conn.execute(text(
+            f"UPDATE {table} SET {shadow} = {column}::jsonb WHERE {shadow} IS NULL AND {column} IS NOT NULL"
+        ))
+        await conn.execute(text(f"DROP TRIGGER {sync_function} ON {table}"))
+        await conn.execute(text(f"DROP FUNCTION {sync_function}()"))
+        await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+        await conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN {shadow} TO {column}"))
+
+
+def statement_triggers(table: str, name: str, bodies: Dict[str, str], declare: str = "") -> List[str]:
+    """DDL for AFTER ... FOR EACH STATEMENT triggers with transition tables.
+
+    ``bodies`` maps INSERT, UPDATE and DELETE to the SQL run once per statement.
+    It reads the affected rows from ``new_rows`` and/or ``old_rows``, so a
+    5,000-row COPY merge costs one aggregate query, not 5,000 trigger calls.
+    ``declare`` holds plpgsql variable declarations for the bodies.
+    """
+    transitions = {
+        "INSERT": "NEW TABLE AS new_rows",
+        "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        "DELETE": "OLD TABLE AS old_rows",
+    }
+    statements = []
+    for operation, body in bodies.items():
+        function = f"{name}_{operation.lower()}"
+        statements += [
+            f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+            f"{f'DECLARE {declare}' if declare else ''}\nBEGIN\n{body};\nRETURN NULL;\nEND\n$$",
+            f"DROP TRIGGER IF EXISTS {function} ON {table}",
+            f"CREATE TRIGGER {function} AFTER {operation} ON {table} REFERENCING {transitions[operation]} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()",
+        ]
+    return statements
+
+
+BENEFICIARY_AGE_BAND_FUNCTION = """
+    CREATE OR REPLACE FUNCTION beneficiary_age_band(age INTEGER) RETURNS VARCHAR LANGUAGE sql IMMUTABLE AS $$
+        SELECT CASE WHEN age IS NULL THEN 'unknown' WHEN age < 5 THEN '0-4' WHEN age < 18 THEN '5-17'
+                    WHEN age < 60 THEN '18-59' ELSE '60+' END
+    $$
+"""
+
+# Each counted row adds its delta to its location node and every ancestor
+# (node.path lists them). Upserting in key order keeps concurrent writers
+# from deadlocking on the shared ancestor rows.
+LOCATION_ROLLUP_UPSERT = """
+    INSERT INTO location_rollups AS r (organization_id, location_id, gender, age_band, count)
+    SELECT d.organization_id, ancestor.id, coalesce(d.gender, 'unknown'), beneficiary_age_band(d.age), sum(d.delta)
+    FROM ({deltas}) AS d
+    JOIN location_nodes node ON node.id = d.location_id
+    CROSS JOIN LATERAL unnest(string_to_array(node.path, '/')::integer[]) AS ancestor(id)
+    GROUP BY 1, 2, 3, 4
+    HAVING sum(d.delta) <> 0
+    ORDER BY 1, 2, 3, 4
+    ON CONFLICT (organization_id, location_id, gender, age_band) DO UPDATE SET count = r.count + EXCLUDED.count
+"""
+_ROLLUP_COUNTED = "is_active AND location_id IS NOT NULL"
+_ROLLUP_CHANGED = (
+    "new_rows n JOIN old_rows o ON o.id = n.id WHERE "
+    "(n.organization_id, n.location_id, n.gender, n.age, n.is_active) IS DISTINCT FROM "
+    "(o.organization_id, o.location_id, o.gender, o.age, o.is_active)"
+)
+LOCATION_ROLLUP_TRIGGERS = statement_triggers("beneficiaries", "location_rollups", {
+    "INSERT": LOCATION_ROLLUP_UPSERT.format(deltas=(
+        f"SELECT organization_id, location_id, gender, age, 1 AS delta FROM new_rows WHERE {_ROLLUP_COUNTED}"
+    )),
+    "UPDATE": LOCATION_ROLLUP_UPSERT.format(deltas=(
+        f"SELECT n.organization_id, n.location_id, n.gender, n.age, 1 AS delta FROM {_ROLLUP_CHANGED} "
+        f"AND n.is_active AND n.location_id IS NOT NULL "
+        f"UNION ALL "
+        f"SELECT o.organization_id, o.location_id, o.gender, o.age, -1 FROM {_ROLLUP_CHANGED} "
+        f"AND o.is_active AND o.location_id IS NOT NULL"
+    )),
+    "DELETE": LOCATION_ROLLUP_UPSERT.format(deltas=(
+        f"SELECT organization_id, location_id, gender, age, -1 AS delta FROM old_rows WHERE {_ROLLUP_COUNTED}"
+    )),
+})
+
+
+async def _partition_feedback(target_engine):
+    from shared.partitions import partition_by_month
+    await partition_by_month(target_engine, "feedback")
+
+
+async def _jsonb_documents(target_engine):
+    await convert_json_to_jsonb(target_engine, "beneficiaries", "demographics", "ix_beneficiaries_demographics")
+    await convert_json_to_jsonb(target_engine, "analytics_cache", "data", "ix_analytics_cache_data")
+
+
+# Writers never set sync_seq themselves. Updates that only touch scores within
+# the same level, cluster ids or timestamps keep the old number, so clients
+# don't download them again. Since migration 19 the contact is compared by its
+# blind index, and re-keying transactions (sync.rekey set) change nothing a
+# client can see.
+def _sync_seq_function(contact_column: str) -> str:
+    rekey_guard = (
+        "IF TG_OP = 'UPDATE' AND current_setting('sync.rekey', true) = 'on' THEN\n"
+        "            NEW.sync_seq := OLD.sync_seq;\n"
+        "        ELS"
+    ) if contact_column == "contact_hash" else ""
+    return f"""
+    CREATE OR REPLACE FUNCTION beneficiaries_sync_seq() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        {rekey_guard}IF TG_OP = 'INSERT' OR (NEW.organization_id, NEW.name, NEW.{contact_column}, NEW.age, NEW.gender, NEW.location,
+                                NEW.location_id, NEW.demographics, NEW.is_active, NEW.vulnerability_level)
+                IS DISTINCT FROM (OLD.organization_id, OLD.name, OLD.{contact_column}, OLD.age, OLD.gender, OLD.location,
+                                  OLD.location_id, OLD.demographics, OLD.is_active, OLD.vulnerability_level) THEN
+            NEW.sync_seq := next_sync_seq(NEW.organization_id);
+        ELSE
+            NEW.sync_seq := OLD.sync_seq;
+        END IF;
+        RETURN NEW;
+    END
+    $$
+    """
+
+
+# Every synced change takes the organization's next change number. One number
+# covers a whole transaction: the counter row stays locked until commit, so an
+# organization's transactions commit in sequence order and a client never
+# skips a number a slower transaction later commits under.
+SYNC_SEQUENCE_FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION next_sync_seq(org INTEGER) RETURNS BIGINT LANGUAGE plpgsql AS $$
+    DECLARE
+        setting TEXT := 'sync.seq_' || org;
+        seq BIGINT := nullif(current_setting(setting, true), '')::BIGINT;
+    BEGIN
+        IF seq IS NULL THEN
+            INSERT INTO sync_counters AS c (organization_id, last_seq) VALUES (org, 1)
+            ON CONFLICT (organization_id) DO UPDATE SET last_seq = c.last_seq + 1
+            RETURNING last_seq INTO seq;
+            PERFORM set_config(setting, seq::TEXT, true);
+        END IF;
+        RETURN seq;
+    END
+    $$
+    """,
+    _sync_seq_function("contact_info"),
+    "DROP TRIGGER IF EXISTS beneficiaries_sync_seq ON beneficiaries",
+    "CREATE TRIGGER beneficiaries_sync_seq BEFORE INSERT OR UPDATE ON beneficiaries "
+    "FOR EACH ROW EXECUTE FUNCTION beneficiaries_sync_seq()",
+]
+
+# Active beneficiaries and users per organization, for O(1) quota checks.
+# Counts change in the writing transaction. The counter row lock orders
+# concurrent writers, so a statement that takes an organization past
+# max_beneficiaries fails even when two imports race.
+BENEFICIARY_QUOTA_MESSAGE = "beneficiary limit reached"
+USAGE_UPSERT = """
+    WITH d AS (
+        SELECT organization_id, sum(delta) AS delta FROM ({deltas}) AS x
+        WHERE organization_id IS NOT NULL
+        GROUP BY 1
+        HAVING sum(delta) <> 0
+    ), applied AS (
+        INSERT INTO organization_usage AS u (organization_id, {counter})
+        SELECT organization_id, delta FROM d ORDER BY organization_id
+        ON CONFLICT (organization_id) DO UPDATE SET {counter} = u.{counter} + EXCLUDED.{counter}
+        RETURNING u.organization_id, u.{counter}
+    )
+    SELECT a.organization_id INTO exceeded
+    FROM applied a
+    JOIN d USING (organization_id)
+    JOIN organizations o ON o.id = a.organization_id
+    WHERE d.delta > 0 AND a.{counter} > o.{limit}
+    LIMIT 1
+"""
+USAGE_LIMIT_CHECK = """;
+    IF exceeded IS NOT NULL THEN
+        RAISE EXCEPTION 'Organization %: {message}', exceeded USING ERRCODE = 'check_violation';
+    END IF
+"""
+
+
+def _usage_triggers(table: str, counter: str, limit: str, message: Optional[str] = None) -> List[str]:
+    """Counter triggers on ``table``'s active rows; with ``message``, growth past ``limit`` raises"""
+    changed = (
+        "new_rows n JOIN old_rows o ON o.id = n.id WHERE "
+        "(n.organization_id, n.is_active) IS DISTINCT FROM (o.organization_id, o.is_active)"
+    )
+    deltas = {
+        "INSERT": "SELECT organization_id, 1 AS delta FROM new_rows WHERE is_active",
+        "UPDATE": (
+            f"SELECT n.organization_id, 1 AS delta FROM {changed} AND n.is_active "
+            f"UNION ALL SELECT o.organization_id, -1 FROM {changed} AND o.is_active"
+        ),
+        "DELETE": "SELECT organization_id, -1 AS delta FROM old_rows WHERE is_active",
+    }
+    check = USAGE_LIMIT_CHECK.format(message=message) if message else ""
+    return statement_triggers(table, f"{table}_usage", {
+        operation: USAGE_UPSERT.format(deltas=sql, counter=counter, limit=limit) + check
+        for operation, sql in deltas.items()
+    }, declare="exceeded INTEGER;")
+
+
+USAGE_TRIGGERS = [
+    *_usage_triggers("beneficiaries", "active_beneficiaries", "max_beneficiaries", BENEFICIARY_QUOTA_MESSAGE),
+    *_usage_triggers("users", "active_users", "max_users"),
+]
+USAGE_BACKFILL = """
+    INSERT INTO organization_usage (organization_id, active_beneficiaries, active_users, reconciled_at)
+    SELECT o.id,
+           (SELECT count(*) FROM beneficiaries b WHERE b.organization_id = o.id AND b.is_active),
+           (SELECT count(*) FROM users u WHERE u.organization_id = o.id AND u.is_active),
+           now() AT TIME ZONE 'utc'
+    FROM organizations o
+    ON CONFLICT (organization_id) DO UPDATE SET
+        active_beneficiaries = EXCLUDED.active_beneficiaries,
+        active_users = EXCLUDED.active_users,
+        reconciled_at = EXCLUDED.reconciled_at
+"""
+
+MIGRATIONS: List[Migration] = [
+    # Tables and indexes that exist in the models today. On an existing
+    # database this only adds missing tables; later migrations alter the rest.
+    Migration(1, "baseline", run_sync=_create_missing_tables),
+
+    # Refresh-token rotation: sessions belong to a family and are revoked as one.
+    # Sessions issued before rotation can't be refreshed, so revoke them outright.
+    Migration(2, "user_session_rotation", [
+        "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS family_id VARCHAR",
+        "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS rotated_at TIMESTAMP WITHOUT TIME ZONE",
+        "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMP WITHOUT TIME ZONE",
+        "UPDATE user_sessions SET family_id = 'legacy-' || id, revoked_at = COALESCE(revoked_at, NOW()) "
+        "WHERE family_id IS NULL",
+        "ALTER TABLE user_sessions ALTER COLUMN family_id SET NOT NULL",
+    ]),
+
+    # Lookups used by login, refresh, one-time codes, invitations and the outbox
+    Migration(3, "auth_lookup_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_sessions_user_id ON user_sessions (user_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_sessions_family_id ON user_sessions (family_id)",
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_user_sessions_refresh_token ON user_sessions (refresh_token)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_sessions_expires_at ON user_sessions (expires_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_email_verifications_live "
+        "ON email_verifications (email, verification_code) WHERE used_at IS NULL",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_email_verifications_expires_at ON email_verifications (expires_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_password_resets_live "
+        "ON password_resets (email, reset_code) WHERE used_at IS NULL",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_password_resets_expires_at ON password_resets (expires_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_organization_invitations_pending "
+        "ON organization_invitations (organization_id, email) WHERE status = 'PENDING'",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_organization_invitations_expires_at "
+        "ON organization_invitations (expires_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_email_outbox_due "
+        "ON email_outbox (next_attempt_at) WHERE status = 'PENDING'",
+        # Superseded by ix_email_outbox_due
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_email_outbox_status",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_email_outbox_next_attempt_at",
+    ], transactional=False),
+
+    # Foreign keys and tenant-scoped listings. (organization_id, created_at)
+    # also serves plain organization_id filters, so no separate index for those.
+    Migration(4, "tenant_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_organization_id ON users (organization_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_organization_memberships_user_id "
+        "ON organization_memberships (user_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_organization_memberships_organization_id "
+        "ON organization_memberships (organization_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_org_created "
+        "ON beneficiaries (organization_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_services_organization_id ON services (organization_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_indicators_service_id ON indicators (service_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_feedback_org_created ON feedback (organization_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_feedback_beneficiary_id ON feedback (beneficiary_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reports_org_created ON reports (organization_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payments_org_created ON payments (organization_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analytics_cache_org_key "
+        "ON analytics_cache (organization_id, cache_key)",
+    ], transactional=False),
+
+    # Keyset pagination orders by (created_at, id) within an organization;
+    # with id in the index a page is one bounded index range scan
+    Migration(5, "keyset_pagination_indexes", [
+        statement
+        for table in ("beneficiaries", "feedback", "reports", "payments")
+        for statement in (
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_org_created_id "
+            f"ON {table} (organization_id, created_at, id)",
+            f"DROP INDEX CONCURRENTLY IF EXISTS ix_{table}_org_created",
+        )
+    ], transactional=False),
+
+    # Demographic and analytics filters use JSONB containment and jsonpath
+    Migration(6, "jsonb_documents", run_async=_jsonb_documents),
+
+    # Feedback is append-only and read by organization and date range
+    Migration(7, "partition_feedback", run_async=_partition_feedback),
+
+    # Resumable bulk imports
+    Migration(8, "import_jobs", [
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS import_id VARCHAR",
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS import_row INTEGER",
+    ], run_sync=_create_tables("import_jobs")),
+    Migration(9, "beneficiary_import_row_index", [
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_import_row "
+        "ON beneficiaries (import_id, import_row) WHERE import_id IS NOT NULL",
+    ], transactional=False),
+
+    # Duplicate detection: blocking index and scored candidate pairs
+    Migration(10, "duplicate_detection", run_sync=_create_tables("beneficiary_block_keys", "duplicate_matches")),
+
+    # Fuzzy beneficiary search. btree_gin lets organization_id share the GIN
+    # indexes, so tenant scoping doesn't need a separate index scan.
+    Migration(11, "beneficiary_search", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_name_trgm "
+        "ON beneficiaries USING gin (organization_id, name gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_location_trgm "
+        "ON beneficiaries USING gin (organization_id, location gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_search "
+        f"ON beneficiaries USING gin (organization_id, ({BENEFICIARY_SEARCH_DOCUMENT}))",
+    ], transactional=False),
+
+    # Vulnerability scoring; the partial index finds rows needing a rescore
+    Migration(12, "vulnerability_scoring", [
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS vulnerability_level VARCHAR",
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS scored_at TIMESTAMP WITHOUT TIME ZONE",
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS score_model_version INTEGER",
+    ], run_sync=_create_tables("vulnerability_models")),
+    Migration(13, "beneficiary_unscored_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_unscored ON beneficiaries (organization_id, id) "
+        "WHERE scored_at IS NULL OR scored_at < updated_at",
+    ], transactional=False),
+
+    # Gazetteer hierarchy and trigger-maintained per-node counts
+    Migration(14, "location_hierarchy", [
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS location_id INTEGER REFERENCES location_nodes (id)",
+        BENEFICIARY_AGE_BAND_FUNCTION,
+        *LOCATION_ROLLUP_TRIGGERS,
+    ], run_sync=_create_tables("location_nodes", "location_rollups")),
+    Migration(15, "beneficiary_location_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_location_id "
+        "ON beneficiaries (organization_id, location_id)",
+    ], transactional=False),
+
+    # Delta sync for offline clients
+    Migration(16, "beneficiary_sync", [
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS client_ref VARCHAR",
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS sync_seq BIGINT NOT NULL DEFAULT 0",
+        *SYNC_SEQUENCE_FUNCTIONS,
+    ], run_sync=_create_tables("sync_counters")),
+    Migration(17, "beneficiary_sync_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_sync "
+        "ON beneficiaries (organization_id, sync_seq, id)",
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_client_ref "
+        "ON beneficiaries (organization_id, client_ref) WHERE client_ref IS NOT NULL",
+    ], transactional=False),
+
+    # Quota counters; creating the triggers locks out writers until the backfill commits
+    Migration(18, "organization_usage", [
+        *USAGE_TRIGGERS,
+        USAGE_BACKFILL,
+    ], run_sync=_create_tables("organization_usage")),
+
+    # Encrypted contact details with blind indexes; existing rows get their
+    # ciphertext and hashes from `python contacts.py rekey`
+    Migration(19, "contact_blind_indexes", [
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS contact_hash VARCHAR",
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS phone_hash VARCHAR",
+        _sync_seq_function("contact_hash"),
+    ]),
+    Migration(20, "contact_blind_index_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_contact_hash "
+        "ON beneficiaries (organization_id, contact_hash)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_phone_hash "
+        "ON beneficiaries (organization_id, phone_hash)",
+        # Rebuild the full-text index without the (now encrypted) contact
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_search_v2 "
+        f"ON beneficiaries USING gin (organization_id, ({BENEFICIARY_SEARCH_DOCUMENT}))",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_beneficiaries_search",
+        "ALTER INDEX IF EXISTS ix_beneficiaries_search_v2 RENAME TO ix_beneficiaries_search",
+    ], transactional=False),
+
+    # Households and typed links between beneficiaries
+    Migration(21, "households", [
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS household_id INTEGER REFERENCES households (id)",
+        "ALTER TABLE beneficiaries ADD COLUMN IF NOT EXISTS household_ref VARCHAR",
+    ], run_sync=_create_tables("households", "beneficiary_links")),
+    Migration(22, "beneficiary_household_index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_beneficiaries_household "
+        "ON beneficiaries (organization_id, household_id)",
+    ], transactional=False),
+]
+
+HEAD_VERSION = max(migration.version for migration in MIGRATIONS)
+
+CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW()
+)
+"""
+
+
+async def _applied_versions(conn) -> set:
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    return {row[0] for row in result}
+
+
+async def run_migrations() -> List[int]:
+    """Apply pending migrations in order; returns the versions applied"""
+    if engine.dialect.name != "postgresql":
+        # SQLite is only used for local runs; the models are the whole schema there
+        async with engine.begin() as conn:
+            await conn.run_sync(_create_missing_tables)
+        return []
+
+    applied_now = []
+    async with engine.connect() as lock_conn:
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await lock_conn.commit()
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(CREATE_VERSION_TABLE))
+                applied = await _applied_versions(conn)
+
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                logger.info(f"🗄️ Applying migration {migration.version}: {migration.name}")
+                if migration.run_async:
+                    await migration.run_async(engine)
+                    async with engine.begin() as conn:
+                        await _record(conn, migration)
+                elif migration.transactional:
+                    async with engine.begin() as conn:
+                        await migration.apply(conn)
+                        await _record(conn, migration)
+                else:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await migration.apply(conn)
+                        await _record(conn, migration)
+                applied_now.append(migration.version)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            await lock_conn.commit()
+
+    if applied_now:
+        logger.info(f"✅ Applied migrations {applied_now}, schema at version {HEAD_VERSION}")
+    else:
+        logger.info(f"✅ Schema already at version {HEAD_VERSION}")
+    return applied_now
+
+
+async def _record(conn, migration: Migration):
+    await conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+        {"version": migration.version, "name": migration.name}
+    )
+
+
+async def check_schema_version() -> bool:
+    """Read-only startup check: log loudly if migrations haven't been run"""
+    if engine.dialect.name != "postgresql":
+        return True
+    try:
+        async with engine.connect() as conn:
+            version = await conn.scalar(text("SELECT MAX(version) FROM schema_migrations"))
+    except Exception as e:
+        logger.error(f"❌ Could not read schema version, run `python -m shared.migrations`: {e}")
+        return False
+
+    if (version or 0) < HEAD_VERSION:
+        logger.error(
+            f"❌ Database schema is at version {version or 0}, code expects {HEAD_VERSION}; "
+            f"run `python -m shared.migrations`"
+        )
+        return False
+    if version > HEAD_VERSION:
+        logger.warning(f"⚠️ Database schema version {version} is newer than this build ({HEAD_VERSION})")
+    return True
+
+
+async def _main(check: bool) -> int:
+    try:
+        if check:
+            return 0 if await check_schema_version() else 1
+        await run_migrations()
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply versioned database migrations")
+    parser.add_argument("--check", action="store_true", help="only report whether migrations are pending")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    sys.exit(asyncio.run(_main(args.check)))
@@ -0,0 +1,67 @@
+"""Background jobs that run at most once at a time per organization.
+
+Subclasses set ``description`` and implement ``run(organization_id, **options)``
+returning a summary dict:
+
+    class DedupScanner(OrganizationTaskRunner):
+        description = "Duplicate scan"
+
+        async def run(self, organization_id: int) -> dict:
+            ...
+
+``start`` while the organization's job is running queues one rerun for when
+it ends, so work added mid-run is never missed. Options of queued starts are
+OR-ed together: a queued ``full=True`` isn't downgraded by a later plain start.
+"""
+import asyncio
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class OrganizationTaskRunner:
+    description = "Background task"
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._rerun: Dict[int, dict] = {}
+        self.last_results: Dict[int, dict] = {}
+
+    async def run(self, organization_id: int, **options) -> dict:
+        raise NotImplementedError
+
+    def is_running(self, organization_id: int) -> bool:
+        return organization_id in self._tasks
+
+    def start(self, organization_id: int, **options) -> bool:
+        """Start a run now (True), or queue one for when the current run ends (False)"""
+        if organization_id in self._tasks:
+            queued = self._rerun.setdefault(organization_id, {})
+            for key, value in options.items():
+                queued[key] = queued.get(key) or value
+            return False
+        task = asyncio.create_task(self._run(organization_id, options))
+        self._tasks[organization_id] = task
+        task.add_done_callback(lambda _: self._finished(organization_id))
+        return True
+
+    def _finished(self, organization_id: int):
+        self._tasks.pop(organization_id, None)
+        if organization_id in self._rerun:
+            self.start(organization_id, **self._rerun.pop(organization_id))
+
+    async def stop(self):
+        self._rerun.clear()
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, organization_id: int, options: dict):
+        try:
+            self.last_results[organization_id] = await self.run(organization_id, **options)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ {self.description} for organization {organization_id} failed: {e}")
+            self.last_results[organization_id] = {"status": "failed", "error": str(e)}
@@ -0,0 +1,316 @@
+"""Delta sync for offline field clients.
+
+Every change to a beneficiary that a client would show takes the
+organization's next change sequence number (``sync_seq``, set by triggers
+from migration 16). A sync token is the (sync_seq, id) of the last change a
+client received, so a pull is one range scan of ``ix_beneficiaries_sync`` and
+costs only as much as the changes since then. Each page is NDJSON, one change
+per line:
+
+    {"op":"upsert","id":42,"seq":1207,"name":"Amina Hassan",...}
+    {"op":"delete","id":43,"seq":1208}
+    {"token":"1208.43","has_more":false,"count":2}
+
+The trailer line carries the token for the next pull, so a client can detect a
+page cut short by a dropped connection. Deactivated beneficiaries are sent as
+deletes. A first sync (no token) skips them.
+
+Uploads are NDJSON batches of offline edits:
+
+    {"op":"upsert","client_ref":"tablet-7:118","data":{"name":"...","contact_info":"..."}}
+    {"op":"upsert","id":42,"base_seq":1207,"data":{"age":31}}
+    {"op":"delete","id":43,"base_seq":1208}
+
+Creates are idempotent on ``client_ref``, so a client can resend a batch after
+a timeout. Edits and deletes apply only while the row's ``sync_seq`` still
+equals ``base_seq``. Otherwise the result is a conflict carrying the server's
+current row, for the client to merge and resend. Both directions accept zstd
+(``Accept-Encoding`` / ``Content-Encoding``).
+"""
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+
+from shared.models import Beneficiary
+from shared.pii import contact_hashes
+from shared.quotas import remaining_beneficiaries
+from shared.schemas import SyncChange
+from dedup import index_beneficiaries
+from gazetteer import location_matcher
+from importer import GENDERS, MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", 1000))
+SYNC_MAX_PAGE_SIZE = int(os.getenv("SYNC_MAX_PAGE_SIZE", 5000))
+SYNC_MAX_UPLOAD_CHANGES = int(os.getenv("SYNC_MAX_UPLOAD_CHANGES", 1000))
+SYNC_MAX_UPLOAD_BYTES = int(os.getenv("SYNC_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+
+SYNC_FIELDS = [
+    "name", "contact_info", "age", "gender", "location", "location_id", "demographics",
+    "vulnerability_score", "vulnerability_level", "updated_at",
+]
+EDITABLE_FIELDS = {"name", "contact_info", "age", "gender", "location", "demographics"}
+REQUIRED_FIELDS = {"name", "contact_info"}
+OPERATIONS = {"upsert", "delete"}
+
+_SYNC_COLUMNS = [Beneficiary.id, Beneficiary.sync_seq, Beneficiary.is_active] + [
+    getattr(Beneficiary, field) for field in SYNC_FIELDS
+]
+
+
+# ==================== ENCODING ====================
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), default=_json_default).encode()
+
+
+def compress(body: bytes) -> bytes:
+    import pyarrow as pa
+
+    return pa.compress(body, codec="zstd", asbytes=True)
+
+
+def decompress(body: bytes) -> bytes:
+    import pyarrow as pa
+
+    # Bounded read: a small compressed body can expand without limit
+    data = pa.input_stream(pa.py_buffer(body), compression="zstd").read(SYNC_MAX_UPLOAD_BYTES + 1)
+    if len(data) > SYNC_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Sync upload is too large")
+    return data
+
+
+def accepts_zstd(accept_encoding: Optional[str]) -> bool:
+    return any(
+        part.split(";")[0].strip() == "zstd" and "q=0" not in part.replace(" ", "").split(";")[1:]
+        for part in (accept_encoding or "").lower().split(",")
+    )
+
+
+def parse_token(token: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not token:
+        return None
+    try:
+        seq, row_id = token.split(".")
+        return int(seq), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+def format_token(seq: int, row_id: int) -> str:
+    return f"{seq}.{row_id}"
+
+
+def change_line(row) -> Dict[str, Any]:
+    if not row.is_active:
+        return {"op": "delete", "id": row.id, "seq": row.sync_seq}
+    line = {"op": "upsert", "id": row.id, "seq": row.sync_seq}
+    for field in SYNC_FIELDS:
+        line[field] = row._mapping[field]
+    return line
+
+
+# ==================== PULL ====================
+
+async def pull_changes(session, organization_id: int, token: Optional[str], limit: int) -> Tuple[bytes, str, bool]:
+    """One NDJSON page of changes after ``token``; returns (body, next token, has more)"""
+    position = parse_token(token)
+    limit = max(1, min(limit, SYNC_MAX_PAGE_SIZE))
+    query = select(*_SYNC_COLUMNS).where(Beneficiary.organization_id == organization_id)
+    if position:
+        # Walks ix_beneficiaries_sync from the client's position
+        query = query.where(tuple_(Beneficiary.sync_seq, Beneficiary.id) > position)
+    else:
+        query = query.where(Beneficiary.is_active == True)
+    rows = (await session.execute(
+        query.order_by(Beneficiary.sync_seq, Beneficiary.id).limit(limit + 1)
+    )).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        next_token = format_token(rows[-1].sync_seq, rows[-1].id)
+    else:
+        next_token = token or format_token(0, 0)
+    lines = [dumps(change_line(row)) for row in rows]
+    lines.append(dumps({"token": next_token, "has_more": has_more, "count": len(rows)}))
+    return b"\n".join(lines) + b"\n", next_token, has_more
+
+
+# ==================== UPLOAD ====================
+
+def parse_upload(body: bytes) -> List[SyncChange]:
+    changes = []
+    for number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            changes.append(SyncChange(**json.loads(line)))
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Line {number}: {e}")
+        if len(changes) > SYNC_MAX_UPLOAD_CHANGES:
+            raise HTTPException(status_code=413, detail=f"At most {SYNC_MAX_UPLOAD_CHANGES} changes per upload")
+    return changes
+
+
+def _clean(change: SyncChange) -> Dict[str, Any]:
+    """Validated column values of an upsert; raises ValueError with the reason"""
+    unknown = set(change.data) - EDITABLE_FIELDS
+    if unknown:
+        raise ValueError(f"fields {', '.join(sorted(unknown))} cannot be synced")
+    values = dict(change.data)
+    for field in ("name", "contact_info", "location"):
+        if field in values:
+            values[field] = str(values[field]).strip() if values[field] is not None else None
+            if field in REQUIRED_FIELDS and not values[field]:
+                raise ValueError(f"{field} is required")
+    if "contact_info" in values:
+        values.update(contact_hashes(values["contact_info"]))
+    if values.get("age") is not None:
+        age = values["age"]
+        if isinstance(age, bool) or not isinstance(age, int) or not 0 <= age <= MAX_AGE:
+            raise ValueError(f"age must be a whole number between 0 and {MAX_AGE}")
+    if values.get("gender") is not None:
+        gender = GENDERS.get(str(values["gender"]).strip().lower())
+        if not gender:
+            raise ValueError(f"gender {values['gender']!r} is not recognised")
+        values["gender"] = gender
+    if "demographics" in values:
+        values["demographics"] = values["demographics"] or {}
+        if not isinstance(values["demographics"], dict):
+            raise ValueError("demographics must be an object")
+    if "location" in values:
+        values["location_id"] = location_matcher.match(values["location"])
+    return values
+
+
+async def _server_row(session, organization_id: int, row_id: int):
+    return (await session.execute(
+        select(*_SYNC_COLUMNS).where(Beneficiary.id == row_id, Beneficiary.organization_id == organization_id)
+    )).first()
+
+
+async def apply_changes(session, organization_id: int, changes: List[SyncChange]) -> List[dict]:
+    """Apply an upload in one transaction; the caller commits. One result per change"""
+    await location_matcher.refresh()
+    results: List[Optional[dict]] = [None] * len(changes)
+    creates: List[Tuple[int, Dict[str, Any]]] = []
+    now = datetime.utcnow()
+
+    for i, change in enumerate(changes):
+        if change.op not in OPERATIONS:
+            results[i] = {"status": "error", "detail": f"op must be one of {', '.join(sorted(OPERATIONS))}"}
+            continue
+        if change.id is None:
+            if change.op == "delete" or not change.client_ref:
+                results[i] = {"status": "error", "detail": "new beneficiaries need op upsert and a client_ref"}
+                continue
+        elif change.base_seq is None:
+            results[i] = {"status": "error", "id": change.id, "detail": "base_seq is required for edits"}
+            continue
+        try:
+            values = _clean(change) if change.op == "upsert" else {}
+        except ValueError as e:
+            results[i] = {"status": "error", "id": change.id, "client_ref": change.client_ref, "detail": str(e)}
+            continue
+        if change.id is None:
+            missing = REQUIRED_FIELDS - set(values)
+            if missing:
+                results[i] = {"status": "error", "client_ref": change.client_ref,
+                              "detail": f"{', '.join(sorted(missing))} required"}
+                continue
+            creates.append((i, values))
+            continue
+
+        # Compare-and-set on sync_seq: a concurrent edit makes this a conflict
+        if change.op == "delete":
+            values = {"is_active": False}
+        values["updated_at"] = now
+        seq = await session.scalar(
+            update(Beneficiary)
+            .where(Beneficiary.id == change.id, Beneficiary.organization_id == organization_id,
+                   Beneficiary.sync_seq == change.base_seq)
+            .values(**values)
+            .returning(Beneficiary.sync_seq)
+        )
+        if seq is not None:
+            results[i] = {"status": "applied", "id": change.id, "seq": seq}
+            continue
+        server = await _server_row(session, organization_id, change.id)
+        if server is None:
+            results[i] = {"status": "error", "id": change.id, "detail": "Beneficiary not found"}
+        else:
+            results[i] = {"status": "conflict", "id": change.id, "server": change_line(server)}
+
+    if creates:
+        await _create(session, organization_id, changes, creates, results)
+
+    edited = [result["id"] for result in results if result["status"] == "applied"]
+    if edited:
+        rows = (await session.execute(
+            select(Beneficiary.id, Beneficiary.name, Beneficiary.contact_info, Beneficiary.age,
+                   Beneficiary.location, Beneficiary.created_at)
+            .where(Beneficiary.id.in_(edited), Beneficiary.is_active == True)
+        )).all()
+        await index_beneficiaries(session, organization_id, rows)
+    return results
+
+
+async def _create(session, organization_id: int, changes: List[SyncChange],
+                  creates: List[Tuple[int, Dict[str, Any]]], results: List[Optional[dict]]):
+    refs = [changes[i].client_ref for i, _ in creates]
+    # Resent creates map to their existing rows and don't count against the quota
+    existing = dict((await session.execute(
+        select(Beneficiary.client_ref, Beneficiary.id).where(
+            Beneficiary.organization_id == organization_id, Beneficiary.client_ref.in_(refs)
+        )
+    )).all())
+    new = [(i, values) for i, values in creates if changes[i].client_ref not in existing]
+
+    # Holds the counter row until commit, so concurrent uploads can't overshoot
+    capacity = await remaining_beneficiaries(session, organization_id, lock=True)
+    for i, _ in new[capacity:]:
+        results[i] = {"status": "error", "client_ref": changes[i].client_ref,
+                      "detail": "Organization has reached its beneficiary limit"}
+    new = new[:capacity]
+
+    if new:
+        rows = [
+            {"demographics": {}, **values, "organization_id": organization_id, "client_ref": changes[i].client_ref}
+            for i, values in new
+        ]
+        # Same key set on every row, so one multi-row INSERT
+        columns = set().union(*rows)
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+        await session.execute(
+            pg_insert(Beneficiary).values(rows)
+            .on_conflict_do_nothing(index_elements=["organization_id", "client_ref"],
+                                    index_where=text("client_ref IS NOT NULL"))
+        )
+
+    # Also picks up rows a concurrent resend of the same batch created first
+    created = {
+        row.client_ref: row for row in (await session.execute(
+            select(Beneficiary.client_ref, Beneficiary.id, Beneficiary.sync_seq).where(
+                Beneficiary.organization_id == organization_id, Beneficiary.client_ref.in_(refs)
+            )
+        )).all()
+    }
+    for i, _ in creates:
+        ref = changes[i].client_ref
+        if results[i] is None and ref in created:
+            results[i] = {"status": "applied", "id": created[ref].id, "client_ref": ref, "seq": created[ref].sync_seq}
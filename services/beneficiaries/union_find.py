@@ -0,0 +1,54 @@
+"""Disjoint-set forest for grouping linked records into connected components."""
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+class UnionFind:
+    """Union by size with path halving; near-constant time per operation"""
+
+    def __init__(self, items: Iterable[Hashable] = ()):
+        self.parent: Dict[Hashable, Hashable] = {}
+        self.size: Dict[Hashable, int] = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Hashable):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item: Hashable) -> Hashable:
+        self.add(item)
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a: Hashable, b: Hashable) -> Hashable:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size.pop(root_b)
+        return root_a
+
+    def union_all(self, edges: Iterable[Tuple[Hashable, Hashable]]):
+        for a, b in edges:
+            self.union(a, b)
+
+    def components(self, min_size: int = 1) -> List[List[Hashable]]:
+        groups: Dict[Hashable, List[Hashable]] = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return [members for members in groups.values() if len(members) >= min_size]
+
+    def labels(self) -> Dict[Hashable, Hashable]:
+        """Map every item to the smallest member of its component"""
+        smallest: Dict[Hashable, Hashable] = {}
+        for item in self.parent:
+            root = self.find(item)
+            if root not in smallest or item < smallest[root]:
+                smallest[root] = item
+        return {item: smallest[self.find(item)] for item in self.parent}
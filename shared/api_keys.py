@@ -0,0 +1,190 @@
+from fastapi import HTTPException, status, Request
+from sqlalchemy import bindparam, update
+from sqlmodel import select
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+API_KEY_PREFIX = "evk_"
+API_KEY_SCOPES = {
+    "beneficiaries:read",
+    "beneficiaries:write",
+    "feedback:read",
+    "feedback:write",
+    "indicators:read",
+    "reports:read",
+    "analytics:read",
+}
+
+# Headers the gateway sets after verifying an API key; clients can't supply them
+GATEWAY_API_KEY_HEADER = "x-evid-api-key-id"
+GATEWAY_ORG_HEADER = "x-evid-org-id"
+GATEWAY_SCOPES_HEADER = "x-evid-scopes"
+
+
+def _hmac_key() -> bytes:
+    return (os.getenv("API_KEY_HMAC_SECRET") or os.getenv("SECRET_KEY") or "").encode()
+
+
+def generate_api_key() -> Tuple[str, str]:
+    """Return (prefix, full key); the secret half is shown to the caller once"""
+    prefix = f"{API_KEY_PREFIX}{secrets.token_hex(6)}"
+    return prefix, f"{prefix}.{secrets.token_urlsafe(32)}"
+
+
+def hash_api_key_secret(secret: str) -> str:
+    """Keyed HMAC-SHA256 of the secret: high-entropy input needs no slow hash"""
+    return hmac.new(_hmac_key(), secret.encode(), hashlib.sha256).hexdigest()
+
+
+def split_api_key(key: str) -> Optional[Tuple[str, str]]:
+    """Split "<prefix>.<secret>", or None if the value isn't an API key"""
+    if not key or not key.startswith(API_KEY_PREFIX):
+        return None
+    prefix, _, secret = key.partition(".")
+    if not secret or "." in secret:
+        return None
+    return prefix, secret
+
+
+def claims_from_gateway_headers(request: Request, scope: Optional[str] = None) -> dict:
+    """Claims for a request the gateway authenticated with an API key"""
+    key_id = request.headers.get(GATEWAY_API_KEY_HEADER)
+    org_id = request.headers.get(GATEWAY_ORG_HEADER)
+    if not key_id or not org_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="API key required")
+
+    scopes = [s for s in request.headers.get(GATEWAY_SCOPES_HEADER, "").split(",") if s]
+    if scope and scope not in scopes:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"API key lacks scope {scope}")
+
+    return {"type": "api_key", "key_id": int(key_id), "org_id": int(org_id), "scopes": scopes}
+
+
+class ApiKeyVerifier:
+    """Verifies API keys with one indexed lookup, cached in-process.
+
+    Cached entries hold the stored HMAC, not a verdict, so every call still
+    compares the presented secret in constant time. Only keys that exist are
+    cached, least recently used first out past ``cache_size``, so unknown
+    prefixes can't grow the cache. Revocation takes effect within
+    ``cache_seconds``. ``last_used_at`` is written behind in batches.
+    """
+
+    def __init__(self):
+        self.cache_seconds = int(os.getenv("API_KEY_CACHE_SECONDS", 30))
+        self.cache_size = int(os.getenv("API_KEY_CACHE_SIZE", 10000))
+        self.flush_interval = int(os.getenv("API_KEY_LAST_USED_FLUSH_SECONDS", 60))
+        self._cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._last_used: Dict[int, datetime] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def verify(self, session, key: str) -> Optional[dict]:
+        """Return the key's claims, or None if it is unknown, wrong, revoked or expired"""
+        parts = split_api_key(key)
+        if not parts:
+            return None
+        prefix, secret = parts
+
+        cached = self._cache.get(prefix)
+        if cached and cached[0] > time.monotonic():
+            entry = cached[1]
+            self._cache.move_to_end(prefix)
+        else:
+            entry = await self._load(session, prefix)
+            if entry is None:
+                self._cache.pop(prefix, None)
+            else:
+                self._cache[prefix] = (time.monotonic() + self.cache_seconds, entry)
+                self._cache.move_to_end(prefix)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        if entry is None or not hmac.compare_digest(entry["secret_hash"], hash_api_key_secret(secret)):
+            return None
+        if entry["expires_at"] and entry["expires_at"] <= datetime.utcnow():
+            return None
+
+        self._last_used[entry["key_id"]] = datetime.utcnow()
+        return {
+            "type": "api_key",
+            "key_id": entry["key_id"],
+            "org_id": entry["org_id"],
+            "scopes": entry["scopes"],
+        }
+
+    def invalidate(self, prefix: str):
+        self._cache.pop(prefix, None)
+
+    async def _load(self, session, prefix: str) -> Optional[dict]:
+        from shared.models import ApiKey
+
+        result = await session.execute(
+            select(
+                ApiKey.id, ApiKey.organization_id, ApiKey.secret_hash, ApiKey.scopes, ApiKey.expires_at
+            ).where(ApiKey.prefix == prefix, ApiKey.revoked_at.is_(None))
+        )
+        row = result.first()
+        if not row:
+            return None
+        return {
+            "key_id": row.id,
+            "org_id": row.organization_id,
+            "secret_hash": row.secret_hash,
+            "scopes": list(row.scopes or []),
+            "expires_at": row.expires_at,
+        }
+
+    async def flush_last_used(self, session_factory):
+        """Persist buffered last-used timestamps with one executemany UPDATE"""
+        if not self._last_used:
+            return
+        pending, self._last_used = self._last_used, {}
+
+        from shared.models import ApiKey
+
+        try:
+            async with session_factory() as session:
+                await session.execute(
+                    update(ApiKey.__table__)
+                    .where(ApiKey.__table__.c.id == bindparam("key_id"))
+                    .values(last_used_at=bindparam("used_at")),
+                    [{"key_id": key_id, "used_at": used_at} for key_id, used_at in pending.items()]
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"❌ Failed to record API key usage: {e}")
+            # Keep the newest timestamps for the next attempt
+            for key_id, used_at in pending.items():
+                if key_id not in self._last_used:
+                    self._last_used[key_id] = used_at
+
+    def start(self, session_factory):
+        """Start the write-behind loop for last_used_at"""
+        if self._flusher:
+            return
+
+        async def run():
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush_last_used(session_factory)
+
+        self._flusher = asyncio.create_task(run())
+
+    async def stop(self, session_factory):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush_last_used(session_factory)
+
+
+api_key_verifier = ApiKeyVerifier()
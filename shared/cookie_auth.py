@@ -12,7 +12,11 @@ class CookieAuth:
     def __init__(self):
         self.secret_key = os.getenv("SECRET_KEY")
         self.algorithm = "HS256"
-        self.access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440))
+        # Access tokens are short-lived and carry all authorization claims, so services
+        # can authorize without a database lookup; revocation latency is bounded by
+        # this lifetime. Refresh tokens rotate on every use (see UserSession).
+        self.access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
+        self.refresh_token_expire_days = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
         
         # Production cookie settings
         self.access_token_cookie_name = "evid_access_token"
@@ -32,10 +36,20 @@ class CookieAuth:
     def create_refresh_token(self, data: dict) -> str:
         """Create refresh token"""
         to_encode = data.copy()
-        expire = datetime.utcnow() + timedelta(days=7)
+        expire = datetime.utcnow() + timedelta(days=self.refresh_token_expire_days)
         to_encode.update({"exp": expire, "type": "refresh"})
         return jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
     
+    def build_token_claims(self, user) -> dict:
+        """Authorization claims embedded in every access token"""
+        return {
+            "sub": user.email,
+            "uid": user.id,
+            "role": user.role,
+            "org_id": user.organization_id,
+            "verified": user.is_verified,
+        }
+    
     def verify_token(self, token: str) -> dict:
         """Verify and decode JWT token"""
         try:
@@ -70,7 +84,7 @@ class CookieAuth:
             httponly=self.cookie_httponly,
             secure=self.cookie_secure,
             samesite=self.cookie_samesite,
-            max_age=7 * 24 * 60 * 60,
+            max_age=self.refresh_token_expire_days * 24 * 60 * 60,
             domain=self.cookie_domain,
             path="/"
         )
@@ -80,6 +94,30 @@ class CookieAuth:
         response.delete_cookie(self.access_token_cookie_name, domain=self.cookie_domain, path="/")
         response.delete_cookie(self.refresh_token_cookie_name, domain=self.cookie_domain, path="/")
     
+    def get_token_claims(self, request: Request, allow_temp: bool = False) -> dict:
+        """Authorize purely from the access token cookie, without a database lookup"""
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        
+        token = self.get_token_from_cookie(request)
+        if not token:
+            raise credentials_exception
+        
+        payload = self.verify_token(token)
+        if not payload or payload.get("type") != "access" or payload.get("sub") is None:
+            raise credentials_exception
+        
+        if payload.get("temp") and not allow_temp:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Email verification required"
+            )
+        
+        return payload
+    
     async def get_current_user(
         self,
         request: Request,
@@ -107,7 +145,7 @@ class CookieAuth:
             raise credentials_exception
         
         # Get user from database
-        from app.models import User
+        from shared.models import User
         result = await session.execute(select(User).where(User.email == email))
         user = result.scalar_one_or_none()
         if user is None:
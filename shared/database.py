@@ -1,22 +1,36 @@
+from contextvars import ContextVar
+from collections import Counter as StatementCounter
+from typing import Awaitable, Dict, List, Optional
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import NullPool
 from sqlmodel import SQLModel
+from starlette.datastructures import MutableHeaders
+import asyncio
 import os
+import random
+import re
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        poolclass=NullPool,
+        connect_args={
+            "ssl": "require"
+        } if "ssl=require" in (url or "") else {}
+    )
+
 # Create async engine for Aiven PostgreSQL
-engine = create_async_engine(
-    os.getenv("DATABASE_URL"),
-    echo=False,
-    future=True,
-    poolclass=NullPool,
-    connect_args={
-        "ssl": "require"
-    } if "ssl=require" in os.getenv("DATABASE_URL", "") else {}
-)
+engine = _create_engine(os.getenv("DATABASE_URL"))
 
 # Create async session factory
 AsyncSessionLocal = sessionmaker(
@@ -25,9 +39,14 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
-async def get_session() -> AsyncSession:
-    """Dependency for getting async database session"""
+async def get_session(tenant=None) -> AsyncSession:
+    """Dependency for getting async database session.
+
+    Pass the tenant being written to; each commit then keeps that tenant's
+    reads on the primary (see ``ReplicaRouter.mark_write``).
+    """
     async with AsyncSessionLocal() as session:
+        session.info["tenant"] = tenant
         try:
             yield session
         finally:
@@ -39,3 +58,290 @@ async def create_db_and_tables():
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
     logger.info("✅ Database tables created successfully!")
+
+def run_script(main: Awaitable) -> None:
+    """Run a ``python -m`` maintenance command: await ``main``, print its result, dispose of the engine"""
+    async def run():
+        try:
+            return await main
+        finally:
+            await engine.dispose()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    result = asyncio.run(run())
+    if result is not None:
+        print(result)
+
+# ==================== QUERY INSTRUMENTATION ====================
+#
+# Every statement executed while a request is being sampled is attributed to
+# that request through a contextvar (SQLAlchemy carries it into its greenlet).
+# Unsampled requests pay for one contextvar lookup per statement.
+
+QUERY_STATS_SAMPLE_RATE = float(os.getenv(
+    "QUERY_STATS_SAMPLE_RATE", "0.1" if os.getenv("ENVIRONMENT") == "production" else "1.0"
+))
+QUERY_STATS_REPEAT_THRESHOLD = int(os.getenv("QUERY_STATS_REPEAT_THRESHOLD", 10))
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements issued per sampled request",
+    ["route"],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    "db_query_seconds_per_request",
+    "Time spent in SQL statements per sampled request",
+    ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+DB_REPEATED_STATEMENTS = Counter(
+    "db_repeated_statement_requests_total",
+    "Sampled requests that repeated one statement shape past the N+1 threshold",
+    ["route"]
+)
+
+# Expanded IN lists differ only in their number of placeholders; asyncpg
+# renders each one with a cast, e.g. $1::INTEGER or $2::TIMESTAMP WITHOUT TIME ZONE
+_PLACEHOLDER = r"(?:\$\d+(?:::\w+(?: \w+)*(?:\[\])?)?|\?|%\(\w+\)s)"
+_IN_LIST = re.compile(rf"\((?:\s*{_PLACEHOLDER}\s*,)+\s*{_PLACEHOLDER}\s*\)")
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "slowest_seconds", "slowest_statement", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.statements = StatementCounter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def repeated_shapes(self, threshold: int):
+        """Statement shapes executed more than ``threshold`` times, most frequent first"""
+        if self.count <= threshold:
+            return []
+        shapes = StatementCounter()
+        for statement, count in self.statements.items():
+            shapes[_IN_LIST.sub("(...)", statement)] += count
+        return [(shape, count) for shape, count in shapes.most_common() if count > threshold]
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries", '
+            f"db-slowest;dur={self.slowest_seconds * 1000:.1f}"
+        )
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    """Stats for the request being handled, or None if it isn't sampled"""
+    return _query_stats.get()
+
+
+# Registered on the Engine class so replica engines are instrumented too
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _query_stats.get() is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    stats = _query_stats.get()
+    started = getattr(context, "_query_started", None)
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware that samples requests and reports their SQL usage.
+
+    Adds a ``Server-Timing`` header outside production, feeds the per-request
+    histograms, and warns when one statement shape repeats past the N+1
+    threshold.
+    """
+
+    def __init__(self, app, sample_rate: Optional[float] = None, repeat_threshold: Optional[int] = None,
+                 server_timing: Optional[bool] = None):
+        self.app = app
+        self.sample_rate = QUERY_STATS_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.repeat_threshold = QUERY_STATS_REPEAT_THRESHOLD if repeat_threshold is None else repeat_threshold
+        self.server_timing = (os.getenv("ENVIRONMENT") != "production") if server_timing is None else server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing if self.server_timing else send)
+        finally:
+            _query_stats.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope, stats: QueryStats):
+        # Route templates keep label cardinality bounded; unmatched paths share one label
+        route = getattr(scope.get("route"), "path", "unmatched")
+        DB_QUERIES_PER_REQUEST.labels(route=route).observe(stats.count)
+        DB_SECONDS_PER_REQUEST.labels(route=route).observe(stats.seconds)
+
+        repeated = stats.repeated_shapes(self.repeat_threshold)
+        if repeated:
+            DB_REPEATED_STATEMENTS.labels(route=route).inc()
+            shape, count = repeated[0]
+            logger.warning(
+                f"⚠️ Possible N+1 on {scope['method']} {route}: statement ran {count}x "
+                f"({stats.count} queries, {stats.seconds * 1000:.1f}ms): {shape[:200]}"
+            )
+
+
+# ==================== READ REPLICAS ====================
+
+DB_READ_ROUTING = Counter(
+    "db_read_routing_total",
+    "Read sessions by target database and routing reason",
+    ["target", "reason"]
+)
+
+# Seconds of replay delay; a replica with nothing to replay is never behind,
+# even when the primary has been idle for a while
+REPLICA_LAG_QUERY = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+""")
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = _create_engine(url)
+        self.sessionmaker = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.lag_seconds: Optional[float] = None
+        self.checked_at = 0.0
+        self.name = self.engine.url.host or self.engine.url.database or url
+
+
+class ReplicaRouter:
+    """Sends read-only sessions to a healthy replica and everything else to the primary.
+
+    Replicas come from DATABASE_REPLICA_URLS (comma separated); without any,
+    reads use the primary. Replica lag is re-checked at most every
+    ``lag_check_seconds``; lagging or unreachable replicas are skipped. After
+    ``mark_write(tenant)`` that tenant's reads stay on the primary for
+    ``sticky_seconds`` so users see their own writes. Sessions from
+    ``get_session(tenant)`` mark their tenant on every commit; code committing
+    through ``AsyncSessionLocal`` directly calls ``mark_write`` itself.
+    Stickiness is tracked per process, so it covers requests served by the
+    same instance.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(url) for url in urls]
+        self.max_lag_seconds = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+        self.lag_check_seconds = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 5))
+        self.sticky_seconds = float(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+        self._last_write: Dict[str, float] = {}
+        self._next = 0
+        self._lag_lock = asyncio.Lock()
+
+    def mark_write(self, tenant):
+        """Pin the tenant's reads to the primary for the stickiness window"""
+        if tenant is None or not self.replicas:
+            return
+        now = time.monotonic()
+        if len(self._last_write) > 10000:
+            self._last_write = {
+                key: at for key, at in self._last_write.items() if now - at < self.sticky_seconds
+            }
+        self._last_write[str(tenant)] = now
+
+    async def read_sessionmaker(self, tenant=None):
+        if not self.replicas:
+            return AsyncSessionLocal
+        if tenant is not None:
+            written_at = self._last_write.get(str(tenant))
+            if written_at is not None and time.monotonic() - written_at < self.sticky_seconds:
+                DB_READ_ROUTING.labels(target="primary", reason="sticky").inc()
+                return AsyncSessionLocal
+
+        await self._refresh_lag()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica.lag_seconds is not None and replica.lag_seconds <= self.max_lag_seconds:
+                DB_READ_ROUTING.labels(target="replica", reason="healthy").inc()
+                return replica.sessionmaker
+
+        DB_READ_ROUTING.labels(target="primary", reason="replica_lag").inc()
+        return AsyncSessionLocal
+
+    async def _refresh_lag(self):
+        now = time.monotonic()
+        if all(now - replica.checked_at < self.lag_check_seconds for replica in self.replicas):
+            return
+        # One request refreshes; concurrent ones route on the previous reading
+        if self._lag_lock.locked():
+            return
+        async with self._lag_lock:
+            await asyncio.gather(*(
+                self._check_lag(replica) for replica in self.replicas
+                if now - replica.checked_at >= self.lag_check_seconds
+            ))
+
+    async def _check_lag(self, replica: Replica):
+        try:
+            async with replica.engine.connect() as conn:
+                lag = await asyncio.wait_for(conn.scalar(REPLICA_LAG_QUERY), timeout=1.0)
+            # Never replayed anything: lag unknown, treat as unhealthy
+            replica.lag_seconds = float(lag) if lag is not None else None
+        except Exception as e:
+            replica.lag_seconds = None
+            logger.warning(f"⚠️ Replica {replica.name} lag check failed: {e}")
+        replica.checked_at = time.monotonic()
+        if replica.lag_seconds is not None and replica.lag_seconds > self.max_lag_seconds:
+            logger.warning(f"⚠️ Replica {replica.name} is {replica.lag_seconds:.1f}s behind, reading from primary")
+
+
+db_router = ReplicaRouter([url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()])
+
+
+# AsyncSession commits through its sync Session, so the hook lives there
+@event.listens_for(Session, "after_commit")
+def _mark_tenant_write(session):
+    db_router.mark_write(session.info.get("tenant"))
+
+
+async def get_read_session(tenant=None) -> AsyncSession:
+    """Session for read-only work; may be served by a replica.
+
+    Reads for ``tenant`` stay on the primary shortly after a write to it, as
+    long as the write committed through ``get_session(tenant)`` or called
+    ``db_router.mark_write(tenant)``.
+    """
+    session_factory = await db_router.read_sessionmaker(tenant)
+    async with session_factory() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
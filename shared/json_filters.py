@@ -0,0 +1,125 @@
+"""Filters over JSONB document columns, compiled to GIN-indexable predicates.
+
+Filters are strings such as ``household_size >= 5``,
+``displacement_status = 'IDP'`` or ``vulnerabilities.disability in ('visual', 'hearing')``.
+Dicts of the form ``{"field": ..., "op": ..., "value": ...}`` are also accepted.
+Dotted fields address nested keys.
+
+    query = select(Beneficiary).where(*compile_filters(Beneficiary.demographics, filters))
+
+Equality and ``in`` compile to containment (``@>``). Everything else compiles
+to a jsonpath match (``@@`` / ``@?``). A ``jsonb_path_ops`` GIN index supports
+all three operators. Containment narrows the index most, so put equality
+filters first when combining them with ranges.
+"""
+from fastapi import HTTPException
+from sqlalchemy import cast, not_, or_, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB, JSONPATH
+from typing import Any, Dict, Iterable, List, Union
+import ast
+import json
+import re
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+FILTER_PATTERN = re.compile(
+    r"^\s*(?P<field>[A-Za-z0-9_.]+)\s*(?P<op>>=|<=|!=|==|=|>|<|\bnot in\b|\bin\b|\bexists\b)\s*(?P<value>.*?)\s*$",
+    re.IGNORECASE
+)
+RANGE_OPERATORS = {">": ">", ">=": ">=", "<": "<", "<=": "<="}
+MAX_FILTERS = 20
+MAX_IN_VALUES = 100
+
+
+class JsonFilter:
+    def __init__(self, field: str, op: str, value: Any = None):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return f"JsonFilter({self.field!r}, {self.op!r}, {self.value!r})"
+
+
+def _invalid(message: str):
+    raise HTTPException(status_code=400, detail=f"Invalid filter: {message}")
+
+
+def _parse_value(raw: str):
+    lowered = raw.lower()
+    if lowered in ("true", "false", "null"):
+        return {"true": True, "false": False, "null": None}[lowered]
+    try:
+        return ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        # Bare words are strings: status = IDP
+        if re.fullmatch(r"[A-Za-z0-9_\- ]+", raw):
+            return raw
+        _invalid(f"can't read value {raw!r}")
+
+
+def parse_filter(spec: Union[str, Dict[str, Any]]) -> JsonFilter:
+    """Parse one filter string or dict; rejects anything malformed with 400"""
+    if isinstance(spec, dict):
+        field, op, value = spec.get("field"), str(spec.get("op", "=")).lower(), spec.get("value")
+    else:
+        match = FILTER_PATTERN.match(spec or "")
+        if not match:
+            _invalid(f"can't parse {spec!r}")
+        field, op = match.group("field"), match.group("op").lower()
+        value = None if op == "exists" else _parse_value(match.group("value"))
+
+    if not field or not FIELD_PATTERN.match(field):
+        _invalid(f"bad field name {field!r}")
+    op = "=" if op == "==" else op
+    if op in ("in", "not in"):
+        # "status in ('IDP')" reads as a one-element list
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            value = [value]
+        if not isinstance(value, (list, tuple, set)) or not value or len(value) > MAX_IN_VALUES:
+            _invalid(f"{field} {op} needs a list of 1-{MAX_IN_VALUES} values")
+        value = list(value)
+    elif op in RANGE_OPERATORS:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            _invalid(f"{field} {op} needs a number or string")
+    elif op not in ("=", "!=", "exists"):
+        _invalid(f"unknown operator {op!r}")
+    return JsonFilter(field, op, value)
+
+
+def _nested(field: str, value: Any) -> dict:
+    document = value
+    for key in reversed(field.split(".")):
+        document = {key: document}
+    return document
+
+
+def _jsonpath(field: str) -> str:
+    return "$" + "".join(f'."{key}"' for key in field.split("."))
+
+
+def compile_filter(column, json_filter: JsonFilter):
+    """SQLAlchemy predicate for one filter against a JSONB column"""
+    # Model columns are JSON-with-a-JSONB-variant; use the JSONB operators
+    column = type_coerce(column, JSONB)
+    field, op, value = json_filter.field, json_filter.op, json_filter.value
+    if op == "=":
+        return column.contains(_nested(field, value))
+    if op == "!=":
+        return not_(column.contains(_nested(field, value)))
+    if op == "in":
+        return or_(*(column.contains(_nested(field, item)) for item in value))
+    if op == "not in":
+        return not_(or_(*(column.contains(_nested(field, item)) for item in value)))
+    if op == "exists":
+        return column.op("@?")(cast(_jsonpath(field), JSONPATH))
+    # json.dumps yields valid jsonpath literals for numbers and strings
+    predicate = f"{_jsonpath(field)} {RANGE_OPERATORS[op]} {json.dumps(value)}"
+    return column.op("@@")(cast(predicate, JSONPATH))
+
+
+def compile_filters(column, filters: Iterable[Union[str, Dict[str, Any]]]) -> List:
+    """Predicates for every filter, to be ANDed together in ``.where()``"""
+    filters = list(filters or [])
+    if len(filters) > MAX_FILTERS:
+        _invalid(f"at most {MAX_FILTERS} filters are allowed")
+    return [compile_filter(column, parse_filter(spec)) for spec in filters]
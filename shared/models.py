@@ -2,7 +2,22 @@ from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import JSON, Text
+from sqlalchemy import JSON, BigInteger, Text, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from shared.pii import EncryptedText
+
+# Queryable documents: JSONB on Postgres (containment operators, GIN indexes),
+# plain JSON elsewhere
+JSONB_DOCUMENT = JSON().with_variant(JSONB(), "postgresql")
+
+# Full-text document behind beneficiary search. The GIN expression index from
+# migration 11 is only used by queries that repeat this exact expression.
+# Contact details are encrypted and searched through their blind indexes instead.
+BENEFICIARY_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(location, '')), 'B')"
+)
 
 class UserRole(str, Enum):
     SUPER_ADMIN = "SUPER_ADMIN"
@@ -35,6 +50,23 @@ class ReportFormat(str, Enum):
     WORD = "word"
     HTML = "html"
 
+class EmailOutboxStatus(str, Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+class ImportJobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    QUOTA_EXCEEDED = "quota_exceeded"
+
+class DuplicateMatchStatus(str, Enum):
+    PENDING = "pending"
+    CONFIRMED = "confirmed"
+    REJECTED = "rejected"
+
 class FeedbackCategory(str, Enum):
     GENERAL = "general"
     SERVICE_DELIVERY = "service_delivery"
@@ -53,7 +85,7 @@ class User(SQLModel, table=True):
     role: UserRole
     is_active: bool = Field(default=True)
     is_verified: bool = Field(default=False)
-    organization_id: Optional[int] = Field(default=None, foreign_key="organizations.id")
+    organization_id: Optional[int] = Field(default=None, foreign_key="organizations.id", index=True)
     temp_tier_selection: Optional[str] = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -61,15 +93,20 @@ class User(SQLModel, table=True):
     organization: Optional["Organization"] = Relationship(back_populates="users")
     sessions: List["UserSession"] = Relationship(back_populates="user")
 
+# One row per issued refresh token. Tokens from a single login share a family_id;
+# presenting an already rotated or revoked token revokes the whole family.
 class UserSession(SQLModel, table=True):
     __tablename__ = "user_sessions"
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="users.id")
-    access_token: str
-    refresh_token: Optional[str] = None
-    expires_at: datetime
+    user_id: int = Field(foreign_key="users.id", index=True)
+    family_id: str = Field(index=True)
+    access_token: str  # jti of the access token issued alongside
+    refresh_token: Optional[str] = Field(default=None, unique=True, index=True)  # refresh token jti
+    expires_at: datetime = Field(index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    rotated_at: Optional[datetime] = None
+    revoked_at: Optional[datetime] = None
     
     user: User = Relationship(back_populates="sessions")
 
@@ -100,14 +137,18 @@ class OrganizationMembership(SQLModel, table=True):
     __tablename__ = "organization_memberships"
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="users.id")
-    organization_id: int = Field(foreign_key="organizations.id")
+    user_id: int = Field(foreign_key="users.id", index=True)
+    organization_id: int = Field(foreign_key="organizations.id", index=True)
     role: str
     is_active: bool = Field(default=True)
     joined_at: datetime = Field(default_factory=datetime.utcnow)
 
 class OrganizationInvitation(SQLModel, table=True):
     __tablename__ = "organization_invitations"
+    __table_args__ = (
+        # Only pending invitations are looked up by email; history stays out of the index
+        Index("ix_organization_invitations_pending", "organization_id", "email", postgresql_where=text("status = 'PENDING'")),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True)
@@ -116,25 +157,84 @@ class OrganizationInvitation(SQLModel, table=True):
     organization_id: int = Field(foreign_key="organizations.id")
     token: str = Field(unique=True, index=True)
     status: InvitationStatus = Field(default=InvitationStatus.PENDING)
-    expires_at: datetime
+    expires_at: datetime = Field(index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     accepted_at: Optional[datetime] = None
     
     organization: Organization = Relationship(back_populates="invitations")
 
+# Machine credentials of the form "<prefix>.<secret>". Only an HMAC of the secret
+# is stored; the prefix is unique so verification is a single indexed lookup.
+class ApiKey(SQLModel, table=True):
+    __tablename__ = "api_keys"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    organization_id: int = Field(foreign_key="organizations.id", index=True)
+    name: str
+    prefix: str = Field(unique=True, index=True)
+    secret_hash: str
+    scopes: List[str] = Field(default=[], sa_type=JSON)
+    created_by: int = Field(foreign_key="users.id")
+    expires_at: Optional[datetime] = None
+    last_used_at: Optional[datetime] = None
+    revoked_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class Beneficiary(SQLModel, table=True):
     __tablename__ = "beneficiaries"
+    __table_args__ = (
+        Index("ix_beneficiaries_org_created_id", "organization_id", "created_at", "id"),
+        Index(
+            "ix_beneficiaries_demographics", "demographics",
+            postgresql_using="gin", postgresql_ops={"demographics": "jsonb_path_ops"}
+        ),
+        # Rows whose vulnerability score is missing or stale
+        Index(
+            "ix_beneficiaries_unscored", "organization_id", "id",
+            postgresql_where=text("scored_at IS NULL OR scored_at < updated_at")
+        ),
+        Index("ix_beneficiaries_location_id", "organization_id", "location_id"),
+        # Exact contact lookups go through blind indexes (shared.pii)
+        Index("ix_beneficiaries_contact_hash", "organization_id", "contact_hash"),
+        Index("ix_beneficiaries_phone_hash", "organization_id", "phone_hash"),
+        Index("ix_beneficiaries_household", "organization_id", "household_id"),
+        # Delta sync pages through (sync_seq, id); offline creates are idempotent on client_ref
+        Index("ix_beneficiaries_sync", "organization_id", "sync_seq", "id"),
+        Index(
+            "ix_beneficiaries_client_ref", "organization_id", "client_ref",
+            unique=True, postgresql_where=text("client_ref IS NOT NULL")
+        ),
+        # Trigram and full-text search indexes need extensions and live in migration 11
+        # Resumed imports replay their last chunk; this key makes the replay a no-op
+        Index(
+            "ix_beneficiaries_import_row", "import_id", "import_row",
+            unique=True, postgresql_where=text("import_id IS NOT NULL")
+        ),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
-    contact_info: str
+    contact_info: str = Field(sa_type=EncryptedText)  # ciphertext at rest
+    contact_hash: Optional[str] = None  # blind index of the normalized contact
+    phone_hash: Optional[str] = None  # blind index of the phone number in it, if any
     age: Optional[int] = None
     gender: Optional[str] = None
     location: Optional[str] = None
-    demographics: Optional[Dict[str, Any]] = Field(default={}, sa_type=JSON)
+    location_id: Optional[int] = Field(default=None, foreign_key="location_nodes.id")  # matched gazetteer node
+    household_id: Optional[int] = Field(default=None, foreign_key="households.id")
+    household_ref: Optional[str] = None  # household key from imported data; equal refs share a household
+    demographics: Optional[Dict[str, Any]] = Field(default={}, sa_type=JSONB_DOCUMENT)
     vulnerability_score: Optional[float] = Field(default=0.0)
+    vulnerability_level: Optional[str] = None
+    scored_at: Optional[datetime] = None  # rescored when updated_at moves past this
+    score_model_version: Optional[int] = None
     organization_id: int = Field(foreign_key="organizations.id")
     is_active: bool = Field(default=True)
+    import_id: Optional[str] = None  # import job that created the row
+    import_row: Optional[int] = None  # row number within the imported file
+    client_ref: Optional[str] = None  # id a sync client gave the row it created offline
+    # Organization change sequence of the last synced change, set by triggers (migration 16)
+    sync_seq: int = Field(default=0, sa_type=BigInteger, sa_column_kwargs={"server_default": "0"})
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -149,7 +249,7 @@ class Service(SQLModel, table=True):
     description: Optional[str] = None
     category: str
     is_active: bool = Field(default=True)
-    organization_id: int = Field(foreign_key="organizations.id")
+    organization_id: int = Field(foreign_key="organizations.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
@@ -165,17 +265,23 @@ class Indicator(SQLModel, table=True):
     current_value: float = Field(default=0.0)
     target_value: float = Field(default=0.0)
     unit: str = Field(default="")
-    service_id: int = Field(foreign_key="services.id")
+    service_id: int = Field(foreign_key="services.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
     service: Service = Relationship(back_populates="indicators")
 
+# Partitioned by month on created_at in Postgres (shared/partitions.py), where
+# the primary key is (id, created_at)
 class Feedback(SQLModel, table=True):
     __tablename__ = "feedback"
+    __table_args__ = (
+        Index("ix_feedback_org_created_id", "organization_id", "created_at", "id"),
+        Index("ix_feedback_created_at_brin", "created_at", postgresql_using="brin"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
-    beneficiary_id: int = Field(foreign_key="beneficiaries.id")
+    beneficiary_id: int = Field(foreign_key="beneficiaries.id", index=True)
     rating: int = Field(ge=1, le=5)
     comments: Optional[str] = None
     category: FeedbackCategory = Field(default=FeedbackCategory.GENERAL)
@@ -187,6 +293,9 @@ class Feedback(SQLModel, table=True):
 
 class Report(SQLModel, table=True):
     __tablename__ = "reports"
+    __table_args__ = (
+        Index("ix_reports_org_created_id", "organization_id", "created_at", "id"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
@@ -203,26 +312,53 @@ class Report(SQLModel, table=True):
 
 class EmailVerification(SQLModel, table=True):
     __tablename__ = "email_verifications"
+    __table_args__ = (
+        Index("ix_email_verifications_live", "email", "verification_code", postgresql_where=text("used_at IS NULL")),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True)
     verification_code: str = Field(index=True)
-    expires_at: datetime
+    expires_at: datetime = Field(index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     used_at: Optional[datetime] = None
 
 class PasswordReset(SQLModel, table=True):
     __tablename__ = "password_resets"
+    __table_args__ = (
+        Index("ix_password_resets_live", "email", "reset_code", postgresql_where=text("used_at IS NULL")),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True)
     reset_code: str = Field(index=True)
-    expires_at: datetime
+    expires_at: datetime = Field(index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     used_at: Optional[datetime] = None
 
+# Emails written in the same transaction as the row that triggers them and
+# delivered to the email service by the auth service's outbox dispatcher.
+class EmailOutbox(SQLModel, table=True):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("ix_email_outbox_due", "next_attempt_at", postgresql_where=text("status = 'PENDING'")),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    endpoint: str  # email service route, e.g. "/send-verification"
+    payload: Dict[str, Any] = Field(default={}, sa_type=JSON)
+    status: EmailOutboxStatus = Field(default=EmailOutboxStatus.PENDING)
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = Field(default=None, sa_type=Text)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
 class Payment(SQLModel, table=True):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_org_created_id", "organization_id", "created_at", "id"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     organization_id: int = Field(foreign_key="organizations.id")
@@ -237,10 +373,152 @@ class Payment(SQLModel, table=True):
 
 class AnalyticsCache(SQLModel, table=True):
     __tablename__ = "analytics_cache"
+    __table_args__ = (
+        Index("ix_analytics_cache_org_key", "organization_id", "cache_key"),
+        Index("ix_analytics_cache_data", "data", postgresql_using="gin", postgresql_ops={"data": "jsonb_path_ops"}),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     organization_id: int = Field(foreign_key="organizations.id")
     cache_key: str = Field(index=True)
-    data: Dict[str, Any] = Field(default={}, sa_type=JSON)
+    data: Dict[str, Any] = Field(default={}, sa_type=JSONB_DOCUMENT)
     expires_at: datetime
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Bulk beneficiary import; processed_rows is the resume checkpoint
+class ImportJob(SQLModel, table=True):
+    __tablename__ = "import_jobs"
+    
+    id: str = Field(primary_key=True)
+    organization_id: int = Field(foreign_key="organizations.id", index=True)
+    created_by: Optional[int] = Field(default=None, foreign_key="users.id")
+    file_type: str
+    file_path: str
+    mapping: Dict[str, str] = Field(default={}, sa_type=JSON)
+    status: ImportJobStatus = Field(default=ImportJobStatus.PENDING, index=True)
+    total_rows: Optional[int] = None
+    processed_rows: int = Field(default=0)
+    imported_count: int = Field(default=0)
+    error_count: int = Field(default=0)
+    errors: List[str] = Field(default=[], sa_type=JSON)  # first errors only
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+# Blocking index for duplicate detection: candidates share at least one key
+class BeneficiaryBlockKey(SQLModel, table=True):
+    __tablename__ = "beneficiary_block_keys"
+    
+    organization_id: int = Field(foreign_key="organizations.id", primary_key=True)
+    block_key: str = Field(primary_key=True)
+    beneficiary_id: int = Field(foreign_key="beneficiaries.id", primary_key=True, index=True)
+
+# Likely duplicate pair; cluster_id is the smallest beneficiary id in its connected group
+class DuplicateMatch(SQLModel, table=True):
+    __tablename__ = "duplicate_matches"
+    __table_args__ = (
+        Index("ix_duplicate_matches_pair", "beneficiary_id", "duplicate_id", unique=True),
+        Index("ix_duplicate_matches_org_cluster", "organization_id", "cluster_id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    organization_id: int = Field(foreign_key="organizations.id")
+    beneficiary_id: int = Field(foreign_key="beneficiaries.id")  # always the smaller id
+    duplicate_id: int = Field(foreign_key="beneficiaries.id", index=True)
+    score: float
+    cluster_id: int
+    status: DuplicateMatchStatus = Field(default=DuplicateMatchStatus.PENDING)
+    reviewed_by: Optional[int] = Field(default=None, foreign_key="users.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    reviewed_at: Optional[datetime] = None
+
+# Per-organization vulnerability scoring model; version bumps on every change
+class VulnerabilityModel(SQLModel, table=True):
+    __tablename__ = "vulnerability_models"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    organization_id: int = Field(foreign_key="organizations.id", unique=True, index=True)
+    version: int = Field(default=1)
+    factors: List[Dict[str, Any]] = Field(default=[], sa_type=JSON)
+    thresholds: Dict[str, float] = Field(default={}, sa_type=JSON)
+    applied_version: Optional[int] = None  # version every beneficiary was last fully rescored with
+    updated_by: Optional[int] = Field(default=None, foreign_key="users.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Admin-boundary gazetteer: country (0) -> admin1 -> admin2 -> settlement (3).
+# path is the chain of ancestor ids ("12/40/311"), so subtrees are prefix matches.
+class LocationNode(SQLModel, table=True):
+    __tablename__ = "location_nodes"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    code: str = Field(unique=True, index=True)  # p-code from the gazetteer
+    name: str
+    alt_names: List[str] = Field(default=[], sa_type=JSON)
+    level: int
+    parent_id: Optional[int] = Field(default=None, foreign_key="location_nodes.id", index=True)
+    path: str = Field(default="", index=True)
+
+# Active beneficiaries per organization and location node, including descendants.
+# Maintained by statement-level triggers on beneficiaries (migration 14).
+class LocationRollup(SQLModel, table=True):
+    __tablename__ = "location_rollups"
+    
+    organization_id: int = Field(foreign_key="organizations.id", primary_key=True)
+    location_id: int = Field(foreign_key="location_nodes.id", primary_key=True)
+    gender: str = Field(primary_key=True)
+    age_band: str = Field(primary_key=True)
+    count: int = Field(default=0)
+
+# Last change sequence number handed out per organization for delta sync
+class SyncCounter(SQLModel, table=True):
+    __tablename__ = "sync_counters"
+    
+    organization_id: int = Field(foreign_key="organizations.id", primary_key=True)
+    last_seq: int = Field(default=0, sa_type=BigInteger)
+
+# Active rows behind the plan quotas. Maintained by triggers in the writing
+# transaction (migration 18) and recounted by shared.quotas.reconcile_usage.
+class OrganizationUsage(SQLModel, table=True):
+    __tablename__ = "organization_usage"
+    
+    organization_id: int = Field(foreign_key="organizations.id", primary_key=True)
+    active_beneficiaries: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    active_users: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    reconciled_at: Optional[datetime] = None
+
+# Household or other group of beneficiaries; each beneficiary belongs to at most one.
+# Manual ones are managed through the API; linked ones are derived from
+# beneficiary_links and household_ref by the batch assignment.
+class Household(SQLModel, table=True):
+    __tablename__ = "households"
+    __table_args__ = (
+        Index("ix_households_org_location", "organization_id", "location_id", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    organization_id: int = Field(foreign_key="organizations.id")
+    name: Optional[str] = None
+    kind: str = Field(default="household")  # household, group
+    source: str = Field(default="manual")  # manual, linked
+    anchor_id: Optional[int] = None  # smallest member id when a linked household was created
+    location_id: Optional[int] = Field(default=None, foreign_key="location_nodes.id")  # most common member location
+    member_count: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Typed relationship between two beneficiaries, e.g. (child, parent)
+class BeneficiaryLink(SQLModel, table=True):
+    __tablename__ = "beneficiary_links"
+    __table_args__ = (
+        Index("ix_beneficiary_links_pair", "beneficiary_id", "related_id", "relation", unique=True),
+        Index("ix_beneficiary_links_org", "organization_id", "id"),
+    )
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    organization_id: int = Field(foreign_key="organizations.id")
+    beneficiary_id: int = Field(foreign_key="beneficiaries.id")
+    related_id: int = Field(foreign_key="beneficiaries.id", index=True)
+    relation: str  # what related_id is to beneficiary_id: spouse, parent, child, ...
+    created_by: Optional[int] = Field(default=None, foreign_key="users.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
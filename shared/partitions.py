@@ -0,0 +1,253 @@
+"""Monthly range partitioning for append-heavy tables.
+
+Tables in ``PARTITIONED_TABLES`` are partitioned by ``created_at``, one
+partition per calendar month (``feedback_y2025m03``). Queries filtering on
+organization and a date range only scan the months they touch, and each
+partition carries a BRIN index on ``created_at``.
+
+``maintain_partitions`` runs with auth housekeeping and can also be run as
+``python -m shared.partitions``. It does three things:
+- creates partitions ``PARTITION_MONTHS_AHEAD`` months in advance
+- detaches partitions older than ``PARTITION_ARCHIVE_AFTER_MONTHS`` into the
+  ``archive`` schema, where they stay queryable but leave the hot table
+- drops archived partitions older than ``PARTITION_RETENTION_MONTHS``
+  (0 keeps them forever)
+
+Retention therefore drops whole tables instead of running large DELETEs.
+
+Existing tables are converted by ``partition_by_month`` (migration 7). Their
+rows become one ``<table>_legacy`` partition covering everything before the
+cutover month, so nothing is copied.
+"""
+from sqlalchemy import text
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = "archive"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+PARTITION_ARCHIVE_AFTER_MONTHS = int(os.getenv("PARTITION_ARCHIVE_AFTER_MONTHS", 24))
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", 0))
+
+# Indexes every partition carries: (name on the partitioned table, definition)
+PARTITIONED_TABLES: Dict[str, List[Tuple[str, str]]] = {
+    "feedback": [
+        ("ix_feedback_org_created_id", "(organization_id, created_at, id)"),
+        ("ix_feedback_beneficiary_id", "(beneficiary_id)"),
+        ("ix_feedback_created_at_brin", "USING brin (created_at)"),
+    ],
+}
+
+# Archived partitions lose their bounds; the upper bound is kept in a comment
+ARCHIVE_COMMENT = "partition of {table} until {upper}"
+ARCHIVE_COMMENT_PATTERN = re.compile(r"^partition of (\w+) until (.+)$")
+BOUND_PATTERN = re.compile(r"FOR VALUES FROM \((.+?)\) TO \((.+?)\)")
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def _parse_bound(bound: str) -> Optional[datetime]:
+    if bound.upper() == "MINVALUE":
+        return None
+    return datetime.fromisoformat(bound.strip("'"))
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    relkind = await conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table})
+    return relkind == "p"
+
+
+async def list_partitions(conn, table: str) -> List[Tuple[str, Optional[datetime], datetime]]:
+    """(name, lower bound or None for MINVALUE, upper bound), oldest first"""
+    result = await conn.execute(text("""
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:table)
+    """), {"table": table})
+    partitions = []
+    for name, bound in result:
+        match = BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: p[2])
+
+
+async def ensure_partitions(conn, table: str, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Create any missing monthly partitions up to ``months_ahead`` months from now"""
+    partitions = await list_partitions(conn, table)
+    current = month_start(datetime.utcnow())
+    covered_until = max((upper for _, _, upper in partitions), default=current)
+    created = []
+    month = max(current, covered_until)
+    while month <= add_months(current, months_ahead):
+        name = partition_name(table, month)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        created.append(name)
+        month = add_months(month, 1)
+    if created:
+        logger.info(f"🗂️ Created {table} partitions: {', '.join(created)}")
+    return created
+
+
+async def archive_partitions(conn, table: str, older_than_months: int = PARTITION_ARCHIVE_AFTER_MONTHS) -> List[str]:
+    """Detach partitions that end before the cutoff and move them to the archive schema.
+
+    Needs an autocommit connection: DETACH ... CONCURRENTLY can't run in a
+    transaction block, but it never blocks inserts or reads on the table.
+    """
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than_months)
+    archived = []
+    await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+    for name, _, upper in await list_partitions(conn, table):
+        if upper > cutoff:
+            break
+        await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} CONCURRENTLY"))
+        await conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        await conn.execute(text(
+            f"COMMENT ON TABLE {ARCHIVE_SCHEMA}.{name} IS "
+            f"'{ARCHIVE_COMMENT.format(table=table, upper=upper.isoformat())}'"
+        ))
+        archived.append(name)
+    if archived:
+        logger.info(f"🗄️ Archived {table} partitions: {', '.join(archived)}")
+    return archived
+
+
+async def drop_archived_partitions(conn, table: str, older_than_months: int = PARTITION_RETENTION_MONTHS) -> List[str]:
+    """Drop archived partitions whose data is entirely past retention"""
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than_months)
+    result = await conn.execute(text("""
+        SELECT c.relname, obj_description(c.oid, 'pg_class')
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relkind = 'r'
+    """), {"schema": ARCHIVE_SCHEMA})
+    dropped = []
+    for name, comment in result.all():
+        match = ARCHIVE_COMMENT_PATTERN.match(comment or "")
+        if not match or match.group(1) != table or datetime.fromisoformat(match.group(2)) > cutoff:
+            continue
+        await conn.execute(text(f"DROP TABLE {ARCHIVE_SCHEMA}.{name}"))
+        dropped.append(name)
+    if dropped:
+        logger.info(f"🗑️ Dropped archived {table} partitions past retention: {', '.join(dropped)}")
+    return dropped
+
+
+async def maintain_partitions(engine) -> None:
+    """Create upcoming partitions, archive old ones and apply retention"""
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SET lock_timeout = '10s'"))
+        for table in PARTITIONED_TABLES:
+            try:
+                if not await is_partitioned(conn, table):
+                    logger.warning(f"⚠️ {table} is not partitioned yet; run `python -m shared.migrations`")
+                    continue
+                await ensure_partitions(conn, table)
+                if PARTITION_ARCHIVE_AFTER_MONTHS > 0:
+                    await archive_partitions(conn, table)
+                if PARTITION_RETENTION_MONTHS > 0:
+                    await drop_archived_partitions(conn, table)
+            except Exception as e:
+                logger.error(f"❌ Partition maintenance for {table} failed: {e}")
+
+
+async def partition_by_month(engine, table: str) -> None:
+    """Turn an existing table into a monthly-partitioned one without copying rows.
+
+    The current table becomes ``<table>_legacy``, attached for everything
+    before next month. Its range CHECK and matching indexes are built first,
+    while writes continue, so the final swap only takes a brief lock.
+    """
+    indexes = PARTITIONED_TABLES[table]
+    legacy = f"{table}_legacy"
+    cutover = add_months(month_start(datetime.utcnow()), 1).isoformat()
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if await is_partitioned(conn, table):
+            await ensure_partitions(conn, table)
+            return
+
+        # A validated CHECK lets ATTACH PARTITION skip scanning the table under lock
+        await conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {legacy}_range"))
+        await conn.execute(text(
+            f"ALTER TABLE {table} ADD CONSTRAINT {legacy}_range "
+            f"CHECK (created_at IS NOT NULL AND created_at < '{cutover}') NOT VALID"
+        ))
+        await conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {legacy}_range"))
+        # Indexes matching the partitioned table's are adopted on ATTACH instead of rebuilt
+        await conn.execute(text(
+            f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_id_created_at ON {table} (id, created_at)"
+        ))
+        for name, definition in indexes:
+            await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+
+    async with engine.begin() as conn:
+        await conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+        sequence = await conn.scalar(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table})
+        foreign_keys = (await conn.execute(text("""
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = to_regclass(:table) AND contype = 'f'
+        """), {"table": table})).all()
+
+        primary_key = await conn.scalar(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'"
+        ), {"table": table})
+
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        # A partition can't keep a primary key of its own; the (id, created_at) index becomes
+        # the key ATTACH adopts. Its NOT NULL on created_at is proven by the validated CHECK.
+        if primary_key:
+            await conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {primary_key}"))
+        await conn.execute(text(
+            f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey PRIMARY KEY USING INDEX {legacy}_id_created_at"
+        ))
+        for name, _ in indexes:
+            await conn.execute(text(f"ALTER INDEX {name} RENAME TO {legacy}_{name.removeprefix('ix_' + table + '_')}"))
+
+        await conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        ))
+        await conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+        for name, definition in indexes:
+            await conn.execute(text(f"CREATE INDEX {name} ON {table} {definition}"))
+        for name, definition in foreign_keys:
+            await conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name}_p {definition}"))
+        if sequence:
+            # The id sequence must outlive the legacy partition once retention drops it
+            await conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+        await conn.execute(text(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{cutover}')"
+        ))
+        await ensure_partitions(conn, table)
+
+    logger.info(f"✅ {table} is now partitioned by month (existing rows in {legacy})")
+
+
+if __name__ == "__main__":
+    from shared.database import engine, run_script
+
+    run_script(maintain_partitions(engine))
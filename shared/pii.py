@@ -0,0 +1,193 @@
+"""Field-level encryption and blind indexes for beneficiary contact details.
+
+``contact_info`` is stored as AES-256-GCM ciphertext tagged with the id of the
+key that wrote it:
+
+    enc:v1:<key id>:<base64 nonce + ciphertext>
+
+Random nonces mean equal contacts encrypt differently, so equality lookups go
+through keyed blind indexes instead: an HMAC-SHA256 of the normalized value,
+truncated to ``PII_BLIND_INDEX_BYTES`` and stored in ``contact_hash`` and
+``phone_hash``. Those are ordinary B-tree columns. Shorter hashes leak less
+about which rows share a value; the occasional collision they allow is removed
+by decrypting the candidates and comparing.
+
+Keys come from the environment as comma-separated ``<id>:<base64 key>`` lists,
+newest first:
+
+    PII_ENCRYPTION_KEYS     32-byte AES keys. The first one encrypts; any listed
+                            key decrypts, so old keys stay until rekeyed away.
+    PII_BLIND_INDEX_KEYS    HMAC keys. The first one writes hashes; lookups try
+                            all of them while a rotation is in flight.
+
+Without ``PII_ENCRYPTION_KEYS`` values are stored in clear (local development);
+without ``PII_BLIND_INDEX_KEYS`` hashes are keyed from ``SECRET_KEY``. Rotation
+is a key list change followed by ``python contacts.py rekey`` in the
+beneficiaries service.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import String
+from sqlalchemy.types import TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+CIPHERTEXT_PREFIX = "enc:v1:"
+PII_BLIND_INDEX_BYTES = int(os.getenv("PII_BLIND_INDEX_BYTES", 16))
+
+# Binds ciphertext to its field, so a value can't be moved to another encrypted column
+_ASSOCIATED_DATA = b"contact_info"
+_NONCE_BYTES = 12
+
+
+class PIIKeyError(RuntimeError):
+    pass
+
+
+def _parse_keys(value: str, variable: str) -> List[Tuple[str, bytes]]:
+    keys = []
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        key_id, sep, encoded = entry.partition(":")
+        if not sep or not key_id or ":" in key_id:
+            raise PIIKeyError(f"{variable} entries must look like <id>:<base64 key>")
+        try:
+            keys.append((key_id, base64.b64decode(encoded, validate=True)))
+        except ValueError:
+            raise PIIKeyError(f"{variable} key {key_id!r} is not valid base64")
+    return keys
+
+
+@lru_cache(maxsize=1)
+def _encryption_keys() -> Tuple[Optional[str], Dict[str, object]]:
+    """(id of the writing key, AESGCM per key id)"""
+    keys = _parse_keys(os.getenv("PII_ENCRYPTION_KEYS", ""), "PII_ENCRYPTION_KEYS")
+    if not keys:
+        logger.warning("⚠️ PII_ENCRYPTION_KEYS is not set; contact details are stored unencrypted")
+        return None, {}
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    ciphers = {}
+    for key_id, key in keys:
+        if len(key) != 32:
+            raise PIIKeyError(f"PII_ENCRYPTION_KEYS key {key_id!r} must be 32 bytes")
+        ciphers[key_id] = AESGCM(key)
+    return keys[0][0], ciphers
+
+
+@lru_cache(maxsize=1)
+def _blind_index_keys() -> List["hmac.HMAC"]:
+    """Keyed HMAC states; copying one skips the key setup on every hash"""
+    keys = [key for _, key in _parse_keys(os.getenv("PII_BLIND_INDEX_KEYS", ""), "PII_BLIND_INDEX_KEYS")]
+    if not keys:
+        secret = (os.getenv("SECRET_KEY") or "").encode()
+        keys = [hmac.new(secret, b"pii-blind-index", hashlib.sha256).digest()]
+    return [hmac.new(key, digestmod=hashlib.sha256) for key in keys]
+
+
+def reload_keys():
+    """Forget cached keys so the next call reads the environment again"""
+    _encryption_keys.cache_clear()
+    _blind_index_keys.cache_clear()
+
+
+def current_key_id() -> Optional[str]:
+    return _encryption_keys()[0]
+
+
+def generate_key() -> str:
+    """A new base64 key, suitable for either key list"""
+    return base64.b64encode(secrets.token_bytes(32)).decode()
+
+
+# ==================== ENCRYPTION ====================
+
+def is_encrypted(value: Optional[str]) -> bool:
+    return bool(value) and value.startswith(CIPHERTEXT_PREFIX)
+
+
+def needs_rekey(value: Optional[str]) -> bool:
+    """Whether a stored value isn't ciphertext under the current key"""
+    key_id = current_key_id()
+    if key_id is None:
+        return False
+    return bool(value) and not value.startswith(f"{CIPHERTEXT_PREFIX}{key_id}:")
+
+
+def encrypt(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return value
+    key_id, ciphers = _encryption_keys()
+    if key_id is None:
+        return value
+    nonce = secrets.token_bytes(_NONCE_BYTES)
+    sealed = ciphers[key_id].encrypt(nonce, value.encode(), _ASSOCIATED_DATA)
+    return f"{CIPHERTEXT_PREFIX}{key_id}:{base64.b64encode(nonce + sealed).decode()}"
+
+
+def decrypt(value: Optional[str]) -> Optional[str]:
+    """Plaintext of a stored value; values written before encryption pass through"""
+    if not is_encrypted(value):
+        return value
+    key_id, _, payload = value[len(CIPHERTEXT_PREFIX):].partition(":")
+    cipher = _encryption_keys()[1].get(key_id)
+    if cipher is None:
+        raise PIIKeyError(f"No PII encryption key {key_id!r} configured")
+    raw = base64.b64decode(payload)
+    return cipher.decrypt(raw[:_NONCE_BYTES], raw[_NONCE_BYTES:], _ASSOCIATED_DATA).decode()
+
+
+class EncryptedText(TypeDecorator):
+    """String column holding ``encrypt()`` output; reads come back decrypted"""
+
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return encrypt(value)
+
+    def process_result_value(self, value, dialect):
+        return decrypt(value)
+
+
+# ==================== BLIND INDEXES ====================
+
+def normalize_contact(value: Optional[str]) -> Optional[str]:
+    normalized = " ".join((value or "").lower().split())
+    return normalized or None
+
+
+def normalize_phone(value: Optional[str]) -> Optional[str]:
+    """Last 9 digits, so +254 712..., 0712... and 712... agree; None for non-phone contacts"""
+    digits = "".join(ch for ch in value or "" if ch.isdigit())
+    return digits[-9:] if len(digits) >= 7 else None
+
+
+def _digest(key: "hmac.HMAC", value: str) -> str:
+    mac = key.copy()
+    mac.update(value.encode())
+    return mac.digest()[:PII_BLIND_INDEX_BYTES].hex()
+
+
+def blind_index(value: Optional[str]) -> Optional[str]:
+    """Hash of an already normalized value under the current key"""
+    return _digest(_blind_index_keys()[0], value) if value else None
+
+
+def blind_indexes(value: Optional[str]) -> List[str]:
+    """Hashes under every configured key, for lookups during a rotation"""
+    return [_digest(key, value) for key in _blind_index_keys()] if value else []
+
+
+def contact_hashes(contact_info: Optional[str]) -> Dict[str, Optional[str]]:
+    """Blind index columns for a plaintext contact"""
+    return {
+        "contact_hash": blind_index(normalize_contact(contact_info)),
+        "phone_hash": blind_index(normalize_phone(contact_info)),
+    }
@@ -0,0 +1,161 @@
+"""Plan quota checks backed by maintained usage counters.
+
+``organization_usage`` holds each organization's active beneficiary and user
+counts. Statement-level triggers (migration 18) update it in the same
+transaction as every insert, delete and activation change, so a quota check is
+a primary key read instead of a COUNT(*) over the tenant's rows.
+
+The triggers also refuse any statement that takes an organization past
+``max_beneficiaries``. The counter row lock makes concurrent writers queue, so
+two imports racing for the last seats can't both get them. Callers still check
+``remaining_beneficiaries`` first, to trim a batch instead of failing it.
+
+``reconcile_usage`` recounts each organization under its counter row lock and
+repairs any drift, e.g. from a trigger disabled during a restore. Services
+run it every ``QUOTA_RECONCILE_INTERVAL_SECONDS``; it also runs standalone:
+
+    python -m shared.quotas [--organization-id 3]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+
+from shared.database import AsyncSessionLocal
+from shared.migrations import BENEFICIARY_QUOTA_MESSAGE
+from shared.models import Beneficiary, Organization, OrganizationUsage, User
+
+logger = logging.getLogger(__name__)
+
+QUOTA_RECONCILE_INTERVAL_SECONDS = int(os.getenv("QUOTA_RECONCILE_INTERVAL_SECONDS", 6 * 3600))
+
+
+def is_quota_error(message: Optional[str]) -> bool:
+    """Whether a database error came from the beneficiary quota trigger"""
+    return BENEFICIARY_QUOTA_MESSAGE in (message or "")
+
+
+async def remaining_beneficiaries(session, organization_id: int, lock: bool = False) -> int:
+    """Beneficiaries the organization can still add.
+
+    With ``lock`` the counter row stays locked until the caller's transaction
+    ends, so the answer holds for inserts made in that transaction.
+    """
+    if lock:
+        await session.execute(
+            pg_insert(OrganizationUsage).values(organization_id=organization_id).on_conflict_do_nothing()
+        )
+        query = (
+            select(Organization.max_beneficiaries, OrganizationUsage.active_beneficiaries)
+            .join(OrganizationUsage, OrganizationUsage.organization_id == Organization.id)
+            .with_for_update(of=OrganizationUsage)
+        )
+    else:
+        query = (
+            select(Organization.max_beneficiaries, func.coalesce(OrganizationUsage.active_beneficiaries, 0))
+            .outerjoin(OrganizationUsage, OrganizationUsage.organization_id == Organization.id)
+        )
+    row = (await session.execute(query.where(Organization.id == organization_id))).first()
+    if not row:
+        return 0
+    max_beneficiaries, active = row
+    return max((max_beneficiaries or 0) - active, 0)
+
+
+async def reconcile_organization(organization_id: int) -> Dict[str, int]:
+    """Recount one organization; returns the drift that was repaired"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            pg_insert(OrganizationUsage).values(organization_id=organization_id).on_conflict_do_nothing()
+        )
+        # Writers wait on this lock, so the counts below and their later deltas line up
+        usage = (await session.execute(
+            select(OrganizationUsage).where(OrganizationUsage.organization_id == organization_id).with_for_update()
+        )).scalar_one()
+        beneficiaries = await session.scalar(
+            select(func.count()).select_from(Beneficiary).where(
+                Beneficiary.organization_id == organization_id, Beneficiary.is_active == True
+            )
+        )
+        users = await session.scalar(
+            select(func.count()).select_from(User).where(User.organization_id == organization_id, User.is_active == True)
+        )
+        drift = {
+            "beneficiaries": beneficiaries - usage.active_beneficiaries,
+            "users": users - usage.active_users,
+        }
+        usage.active_beneficiaries = beneficiaries
+        usage.active_users = users
+        usage.reconciled_at = datetime.utcnow()
+        await session.commit()
+    return drift
+
+
+async def reconcile_usage(organization_id: Optional[int] = None) -> Dict[str, int]:
+    """Recount every organization (or one) and log any drift"""
+    if organization_id is None:
+        async with AsyncSessionLocal() as session:
+            organization_ids = (await session.execute(select(Organization.id).order_by(Organization.id))).scalars().all()
+    else:
+        organization_ids = [organization_id]
+
+    summary = {"organizations": 0, "drifted": 0}
+    for org_id in organization_ids:
+        drift = await reconcile_organization(org_id)
+        summary["organizations"] += 1
+        if any(drift.values()):
+            summary["drifted"] += 1
+            logger.warning(f"⚠️ Usage counters for organization {org_id} drifted by {drift}; repaired")
+    logger.info(f"✅ Usage counters reconciled: {summary}")
+    return summary
+
+
+class UsageReconciler:
+    """Runs reconcile_usage periodically in the background"""
+
+    def __init__(self):
+        self.interval = QUOTA_RECONCILE_INTERVAL_SECONDS
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await reconcile_usage()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Usage counter reconciliation failed: {e}")
+
+
+usage_reconciler = UsageReconciler()
+
+
+if __name__ == "__main__":
+    from shared.database import run_script
+
+    parser = argparse.ArgumentParser(description="Recount organization usage counters")
+    parser.add_argument("--organization-id", type=int)
+    args = parser.parse_args()
+
+    run_script(reconcile_usage(args.organization_id))